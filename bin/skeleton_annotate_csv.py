@@ -62,6 +62,7 @@ except ImportError:
     sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(os.path.split(__file__)[0]))))
 
 from skeletonizer.amiramesh import *
+from skeletonizer.maths import swizzle3, k_AVIZO_BLENDER_SWIZZLE
 
 # TODO: Check for available object_cross_section addon
 '''
@@ -107,7 +108,7 @@ def swizzle_coordinates(p):
     :param p: Input position 3-tuple.
     :return: Position converted into new coordinate system
     '''
-    return (-p[0], p[2], p[1])
+    return swizzle3(p, k_AVIZO_BLENDER_SWIZZLE)
 
 
 
@@ -179,14 +180,19 @@ def generate_cross_sections(obj_name, skel_am_file, skel_json_file, segment_rang
     '''
     cxs = {}
     reader = AmirameshReader()
-    with open(skel_am_file, 'r') as f:
-        skel = reader.parse(f)
     with open(skel_json_file, 'r') as f:
         data = json.load(f)
 
-    r = (max(0, segment_range[0]), min(len(skel.segments), segment_range[1]))
+    # load only the segments in range, using the (shared, sidecar) byte-offset index
+    index = load_index(skel_am_file)
+    nsegments = index.segment_count()
+
+    r = (max(0, segment_range[0]), min(nsegments, segment_range[1]))
+
+    with open(skel_am_file, 'rb') as f:
+        skel = reader.read_segment_range(f, r, index)
 
-    csvfilename = obj_name+'-cross_section_data-range-'+str(r[0])+'-'+str(r[1]-1)+'-of-'+str(len(skel.segments))
+    csvfilename = obj_name+'-cross_section_data-range-'+str(r[0])+'-'+str(r[1]-1)+'-of-'+str(nsegments)
     csv_file = os.path.join(out_path, csvfilename + '.csv')
 
     with open(csv_file, 'w', newline='') as f:
@@ -198,7 +204,7 @@ def generate_cross_sections(obj_name, skel_am_file, skel_json_file, segment_rang
         writer.writeheader()
 
         for idx in range(r[0], r[1]):
-            s = skel.segments[idx]
+            s = skel.segments[idx - r[0]]
             am_pts = [i for i in s.points]
             if len(am_pts) >= 2:
                 prev_pnt = mathutils.Vector(swizzle_coordinates(am_pts[1].position()))
@@ -27,20 +27,26 @@ try:
 except ImportError:
     sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(os.path.split(__file__)[0]))))
 
-from skeletonizer.bbp_import_module import *
 from skeletonizer.amiramesh import *
+from skeletonizer.cache import *
+from skeletonizer.cross_section import *
 from skeletonizer.maths import *
 from skeletonizer.graphs import *
+from skeletonizer.simplify import *
 from skeletonizer.morphology import *
+from skeletonizer.profiling import *
 
 
 if __name__ == '__main__':
     options = MorphologyCreateOptions()
+    profile_file = None
+    profile_memory = False
     k_FORMAT = "%(message)s" # "%(asctime)-15s %(message)s"
     logging.basicConfig(format=k_FORMAT, level=options.verbosity_level)
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:],"hifas:o:v:t:x:",["skeleton=","output_dir=","verbose=","threshold=","scale="])
+        opts, args = getopt.getopt(sys.argv[1:], "hs:" + options.k_SHORT_OPTIONS,
+                                   ["skeleton=", "profile=", "profile_memory"] + options.k_LONG_OPTIONS)
     except getopt.GetoptError:
         print 'skeletonize.py -h'
         sys.exit(2)
@@ -50,21 +56,19 @@ if __name__ == '__main__':
                 print 'Skeletonize converts an Amiramesh skeleton graph, plus annotations, into a BBPSDK cell morphology.'
                 print '\nUsage:'
                 print ' skeletonize.py <skeleton>'
-                print ' skeletonize.py [-v <level>] [-a] [-t <threshold>] [-x <scale>] -s <skeleton> [-f] [-o <output_dir>]'
-                print '\t -a \t\t Allow cycles in skeleton graph (default False)'
-                print '\t -i \t\t Ignore optional secondary input files (e.g., *.cross-section.csv)'
-                print '\t -f \t\t Force overwrite of output files'
-                print '\t -o <dirname>\t Output directory'
+                print ' skeletonize.py [-v <level>] [-a] [-n] [-t <threshold>] [-x <scale>] -s <skeleton> [-f] [-o <output_dir>]'
                 print '\t -s <filename>\t Input skeleton filename'
-                print '\t -t <threshold>\t Set minimum segment arc length (default 0)'
-                print '\t -v <level>\t Set verbosity level: %i-%i' % (logging.NOTSET, logging.FATAL)
-                print '\t -x <scale>\t Set skeleton scaling factor to resize output skeleton'
+                print '\t -f \t\t Force overwrite of output files'
+                for line in options.k_OPTIONS_HELP:
+                    print line
+                print '\t --profile <filename>\t Write the wall time, CPU time and memory of each conversion stage to a JSON file'
+                print '\t --profile_memory\t Trace the memory of each stage with tracemalloc (requires --profile; when available; slower)'
                 print '\nExample:'
                 print '\t # creates /<path>/cell.Smt.SptGraph.h5 from /<path>/cell.Smt.SptGraph'
                 print '\t skeletonize.py -s cell.Smt.SptGraph'
                 print '\nNotes:'
                 print '\t For input source <filename>, expected input files are:'
-                print '\t\t <filename>.am # Amiramesh text file of skeleton graph'
+                print '\t\t <filename>.am # Amiramesh file (ASCII or binary) of skeleton graph'
                 print '\t\t <filename>.annotations.json # JSON file with {"soma": {"centre":{"x":x,"y":y,"z":z}, "radius":r}}'
                 print '\t\t\t Measurements such as "centre" and "radius" are in the coordinate system and units of the input source.'
                 print '\t Output file(s) are:'
@@ -83,31 +87,18 @@ if __name__ == '__main__':
                 print '\t Display in rtneuron-app.py using: display_morphology_file(\'/<path>/<filename>.h5\')'
                 print '\t\t NOTE: \'display_morphology_file\' may require a relative or absolute path, not just a filename, to display morphology.'
                 sys.exit()
-            elif opt == '-a':
-                options.allow_cycles = True
-                logging.info("Allow Cycles set to: %s", options.allow_cycles)
-            elif opt == '-i':
-                options.ignore_optional_input_files = True
-            elif opt == '-f':
-                options.force_overwrite = True
-            elif opt in ("-o", "--output_dir"):
-                options.skel_out_path = arg
-                if (not os.path.isdir(options.skel_out_path)):
-                    logging.error('ERROR - Output directory must be directory:%s', options.skel_out_path)
-                    sys.exit(4)
             elif opt in ("-s", "--skeleton"):
                 options.set_pathname(arg)
-            elif opt in ('-t', "--threshold"):
-                options.force_segment_threshold = True
-                options.threshold_segment_length = float(arg)
-                logging.info("Segment length threshold set to: %f", options.threshold_segment_length)
-            elif opt in ('-v', "--verbose"):
-                options.verbosity_level = int(arg)
-                logging.getLogger().setLevel(options.verbosity_level)
-                logging.info("Verbosity set to: %i", options.verbosity_level)
-            elif opt in ('-x', "--scale"):
-                options.scaling_factor = float(arg)
-                logging.info("Morphology scaling factor set to: %f", options.scaling_factor)
+            elif opt == '--profile':
+                profile_file = arg
+            elif opt == '--profile_memory':
+                profile_memory = True
+            else:
+                try:
+                    options.set_option(opt, arg)
+                except MorphologyOptionsError as e:
+                    logging.error('ERROR - %s', e)
+                    sys.exit(e.exit_code)
 
         if not opts:
             if len(sys.argv) != 2:
@@ -115,9 +106,17 @@ if __name__ == '__main__':
                 sys.exit(2)
             options.set_pathname(sys.argv[1])
 
+        if profile_memory and profile_file is None:
+            logging.error('ERROR - --profile_memory requires --profile <filename>')
+            sys.exit(2)
+
         options.set_filepaths()
 
-        options.validate()
+        try:
+            options.validate()
+        except MorphologyOptionsError as e:
+            logging.error('ERROR - %s', e)
+            sys.exit(e.exit_code)
 
         logging.info('HDF5 Skeletonizer')
         logging.info('\t Source graph: %s', options.skel_am_file)
@@ -126,40 +125,14 @@ if __name__ == '__main__':
         if options.force_overwrite:
             logging.info('\nFORCING OVERWRITE of output file: %s\n', options.skel_out_file)
 
-        with open(options.skel_am_file, 'r') as f:
-            reader = AmirameshReader()
-            skel = reader.parse(f)
-
-
-        with open(options.skel_json_file, 'r') as f:
-            annotation_data = json.load(f)
-
-        options.set_annotation_data(annotation_data)
-
-
-        if not options.ignore_optional_input_files:
-            with open(options.skel_csv_file, 'r') as f:
-                reader = csv.DictReader(f, delimiter='\t', quotechar='|')
-                xsection_data = {}
-                for r in reader:
-                    area = float(r['area'])
-                    perimeter = float(r['perimeter'])
-                    diameter = math.sqrt(area) / math.pi
-                    xsection_data[(int(r['segment_idx']), int(r['pnt_idx']))] = \
-                                {'area':area, 'perimeter':perimeter, \
-                                 'estimated_diameter':float(r['estimated_diameter']), \
-                                 'estimated_area':float(r['estimated_area']), \
-                                 'estimated_perimeter':float(r['estimated_perimeter']), \
-                                 'blender_position':r['blender_position'], \
-                                 'blender_normal':r['blender_normal'], \
-                                 'diameter':diameter}
-
-            skel.update_diameters(xsection_data, outlier_threshold=3.0)
-            options.set_xsection_data(xsection_data)
-
-        morphology = create_morphology(skel, annotation_data['soma'], options)
-
-        create_morphology_file(morphology, options)
+        profiler = StageProfiler(enabled=profile_file is not None, trace_memory=profile_memory)
+        try:
+            skeletonize(options, profiler)
+        finally:
+            if profile_file is not None:
+                profiler.show()
+                profiler.save(profile_file, skeleton=options.skel_am_file, writer=options.morphology_writer)
+            profiler.stop()
 
         logging.info('Wrote out file: %s', options.skel_out_file)
 
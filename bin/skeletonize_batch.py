@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+This program converts many skeletons into morphology files, in parallel, skipping the up to date outputs.
+"""
+
+import os
+import sys
+import time
+import getopt
+import logging
+
+try:
+    import skeletonizer
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(os.path.split(__file__)[0]))))
+
+from skeletonizer.morphology import *
+from skeletonizer.batch import *
+
+
+if __name__ == '__main__':
+    options = MorphologyCreateOptions()
+    processes = None
+    k_FORMAT = "%(message)s"
+    logging.basicConfig(format=k_FORMAT, level=options.verbosity_level)
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hj:" + options.k_SHORT_OPTIONS, ["jobs="] + options.k_LONG_OPTIONS)
+    except getopt.GetoptError:
+        print 'skeletonize_batch.py -h'
+        sys.exit(2)
+    else:
+        for opt, arg in opts:
+            if opt == '-h':
+                print 'Skeletonize batch converts many Amiramesh skeleton graphs, plus annotations, into cell morphologies, in parallel.'
+                print '\nUsage:'
+                print ' skeletonize_batch.py [-j <jobs>] [-v <level>] [-a] [-i] [-n] [-t <threshold>] [-x <scale>] [-f] [-o <output_dir>] <source> ...'
+                print '\t <source>\t Directory (all *.am files), glob pattern (quoted), *.am file, or manifest file'
+                print '\t\t\t (one skeleton per line, relative to the manifest; # comments)'
+                print '\t -j <jobs>\t Number of worker processes (default: number of cores)'
+                print '\t -f \t\t Force conversion of up to date outputs (by default, outputs newer than all their inputs are skipped)'
+                for line in options.k_OPTIONS_HELP:
+                    print line
+                print '\nExample:'
+                print '\t skeletonize_batch.py -j 8 --writer h5py /<path>/stack/'
+                print '\nNotes:'
+                print '\t Failed cells are reported, and do not abort the batch; the exit code is 1 if any cell failed.'
+                sys.exit()
+            else:
+                try:
+                    if opt in ('-j', '--jobs'):
+                        processes = parse_option_value(opt, arg, int)
+                    else:
+                        options.set_option(opt, arg)
+                except MorphologyOptionsError as e:
+                    logging.error('ERROR - %s', e)
+                    sys.exit(e.exit_code)
+
+    try:
+        if not args:
+            logging.error('Expected skeleton sources. Try: skeletonize_batch.py -h')
+            sys.exit(2)
+
+        am_files = find_skeletons(args)
+        if not am_files:
+            logging.error('ERROR - No skeletons found in: %s', ' '.join(args))
+            sys.exit(2)
+
+        start = time.time()
+        results = run_batch(am_files, options, processes)
+        summary = summarize_batch(results, time.time() - start)
+        show_batch_summary(summary, results)
+
+        sys.exit(1 if summary[k_FAILED] else 0)
+
+    finally:
+        logging.shutdown()
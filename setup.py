@@ -18,22 +18,22 @@ config = {
                         mesh (Blender source, exported into VRML for import into Avizo) and 
                         skeletonization data (Avizo Amiramesh ASCII format).
                         Generates accurate cross-sectional data from mesh and skeleton points (CSV format).
-                        '''
+                        ''',
     'author': 'Neuro-Inspired Computing Team: Glendon Holst, Heikki Lehvaslaiho, et. al.',
     'author_email': 'glendon.holst@kaust.edu.sa',
-    'maintainer': 'Neuro-Inspired Computing Team: Daniya Boges'
-    'maintainer_email': 'daniya.boges@kaust.edu.sa'
+    'maintainer': 'Neuro-Inspired Computing Team: Daniya Boges',
+    'maintainer_email': 'daniya.boges@kaust.edu.sa',
     'url': 'https://bitbucket.org/holstgr/skeletonizer',
     'version': '1.0.0b1',
     'license': 'MIT',
-    'install_requires': ['unittest','bbp'],
+    'install_requires': ['unittest','bbp','numpy'],
     'packages': ['skeletonizer'],
     'py_module': ['skeletonizer.amiramesh',
                   'skeletonizer.graphs',
                   'skeletonizer.maths',
                   'skeletonizer.morphology'
-                 ]
-    'scripts': ['bin/skeletonize.py', 'bin/skeleton_annotate.py'],
+                 ],
+    'scripts': ['bin/skeletonize.py', 'bin/skeletonize_batch.py', 'bin/skeleton_annotate.py'],
     'data_files': [('test',['data/test.blend',
                             'data/test.SptGraph.am',
                             'data/test.SptGraph.annotations.json'
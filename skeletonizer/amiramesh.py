@@ -8,10 +8,14 @@
     Amiramesh module.
 """
 
+import os
 import re
 import sys
+import mmap
 import logging
 
+import numpy as np
+
 #
 # Node class
 #
@@ -199,6 +203,985 @@ class Skeleton(object):
              c+= len(s.points)
         return "Nodes    : %5i\nSegments : %5i\nPoints   : %5i" % (len(self.nodes), len(self.segments), c)
 
+#
+# Array-backed views
+#
+
+class ArrayNode(Node):
+    """Node view of one row of a (N x 3) node position array"""
+
+    def __init__(self, positions, index):
+        self._positions = positions
+        self.index = index
+
+    def _get(self, c):
+        return float(self._positions[self.index, c])
+
+    def _set(self, c, value):
+        self._positions[self.index, c] = value
+
+    x = property(lambda self: self._get(0), lambda self, v: self._set(0, v))
+    y = property(lambda self: self._get(1), lambda self, v: self._set(1, v))
+    z = property(lambda self: self._get(2), lambda self, v: self._set(2, v))
+
+    def list(self):
+        """ Returns a list of XYZ values"""
+        return self._positions[self.index, :3].tolist()
+
+    def position(self):
+        """ Returns a tuple of XYZ values"""
+        return tuple(self._positions[self.index, :3].tolist())
+
+
+class ArrayPoint3D(Point3D):
+    """Point3D view of one row of a (P x 4) XYZ / diameter point array"""
+
+    def __init__(self, points, index):
+        self._points = points
+        self.index = index
+
+    def _get(self, c):
+        return float(self._points[self.index, c])
+
+    def _set(self, c, value):
+        self._points[self.index, c] = value
+
+    x = property(lambda self: self._get(0), lambda self, v: self._set(0, v))
+    y = property(lambda self: self._get(1), lambda self, v: self._set(1, v))
+    z = property(lambda self: self._get(2), lambda self, v: self._set(2, v))
+    diameter = property(lambda self: self._get(3), lambda self, v: self._set(3, v))
+
+    # views of the same row compare (and hash) as the same point object
+    def __eq__(self, other):
+        return isinstance(other, ArrayPoint3D) and other._points is self._points and other.index == self.index
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self._points), self.index))
+
+    def list(self):
+        """ Returns a list of XYZD values"""
+        return self._points[self.index, :4].tolist()
+
+    def position(self):
+        """ Returns a tuple of XYZ values"""
+        return tuple(self._points[self.index, :3].tolist())
+
+
+class ArrayPoints(object):
+    """Sequence of ArrayPoint3D views over all rows of a (P x 4) point array"""
+
+    def __init__(self, points):
+        self.array = points
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, idx):
+        return ArrayPoint3D(self.array, idx)
+
+
+class PointsView(object):
+    """Sequence view of points[start::step] (count items) that shares the
+    underlying point storage instead of copying it.
+
+    Slicing a view returns another view; points may be a list of Point3D
+    objects or an ArrayPoints sequence.
+    """
+
+    def __init__(self, points, start, count, step=1):
+        self.points = points
+        self.start = start
+        self.count = count
+        self.step = step
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            first, stop, step = idx.indices(self.count)
+            count = max(0, (stop - first + step - (1 if step > 0 else -1)) // step)
+            return PointsView(self.points, self.start + first * self.step, count, self.step * step)
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError('PointsView index out of range')
+        return self.points[self.start + idx * self.step]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.points[self.start + i * self.step]
+
+    def __reversed__(self):
+        return iter(self[::-1])
+
+    def indices(self):
+        """ Returns the array of indices into the underlying point storage"""
+        return self.start + np.arange(self.count, dtype=np.int64) * self.step
+
+
+class ArraySegment(Segment):
+    """Segment whose points are a PointsView over the skeleton point array"""
+
+    def __init__(self, start, end, points):
+        self.start = start
+        self.end = end
+
+        self.pointcount = len(points)
+        self.points = points
+
+
+class SegmentView(Segment):
+    """Segment re-oriented in O(1): swaps the start and end node-ids, and
+    iterates the points of the original segment in reverse, through a
+    PointsView over the original point storage instead of a copy."""
+
+    def __init__(self, segment, reverse = True):
+        self.segment = segment
+        self.start, self.end = (segment.end, segment.start) if reverse else (segment.start, segment.end)
+
+        points = segment.points
+        if not isinstance(points, PointsView):
+            points = PointsView(points, 0, len(points))
+        self.pointcount = len(points)
+        self.points = points[::-1] if reverse else points
+
+
+class ArrayNodes(object):
+    """Read-only mapping of node-id to ArrayNode over a (N x 3) position array.
+
+    Mirrors the Skeleton.nodes dictionary interface used by callers."""
+
+    def __init__(self, positions):
+        self.array = positions
+
+    def __len__(self):
+        return len(self.array)
+
+    def __contains__(self, idx):
+        return 0 <= idx < len(self.array)
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        return ArrayNode(self.array, idx)
+
+    def __iter__(self):
+        return iter(range(len(self.array)))
+
+    def keys(self):
+        return list(range(len(self.array)))
+
+    def iteritems(self):
+        for idx in range(len(self.array)):
+            yield idx, ArrayNode(self.array, idx)
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class ArraySegments(object):
+    """Read-only sequence of ArraySegment views over an ArraySkeleton"""
+
+    def __init__(self, skel):
+        self.skel = skel
+
+    def __len__(self):
+        return len(self.skel.edges)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('segment index out of range')
+        skel = self.skel
+        offset = int(skel.segment_offsets[idx])
+        count = int(skel.segment_offsets[idx + 1]) - offset
+        return ArraySegment(int(skel.edges[idx, 0]), int(skel.edges[idx, 1]),
+                            PointsView(skel.point_views, offset, count))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+#
+# ArraySkeleton class
+#
+
+class ArraySkeleton(Skeleton):
+    """Columnar skeleton storage in contiguous arrays.
+
+    node_positions: (N x 3) node XYZ, indexed by node-id.
+    edges: (E x 2) start and end node-ids of each segment.
+    segment_offsets: (E + 1) CSR offsets; the points of segment i are
+        points[segment_offsets[i]:segment_offsets[i+1]].
+    points: (P x 4) point XYZ and diameter (thickness).
+    attributes: SkeletonAttributes of the Amiramesh fields read with the skeleton, if any.
+
+    The nodes and segments attributes are lightweight Node / Segment views
+    over the arrays, so existing Skeleton callers keep working, while new
+    code may operate on the whole arrays.  Topology is fixed at construction.
+    """
+
+    def __init__(self, node_positions, edges, segment_offsets, points):
+        self.node_positions = np.asarray(node_positions, dtype=np.float64).reshape(-1, 3)
+        self.edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+        self.segment_offsets = np.asarray(segment_offsets, dtype=np.int64)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 4)
+
+        assert(len(self.segment_offsets) == len(self.edges) + 1), \
+            "Expected %i segment offsets, found %i" % (len(self.edges) + 1, len(self.segment_offsets))
+        assert(self.segment_offsets[-1] == len(self.points)), \
+            "Segment offsets cover %i points, found %i points" % (self.segment_offsets[-1], len(self.points))
+
+        self.point_views = ArrayPoints(self.points)
+        self.nodes = ArrayNodes(self.node_positions)
+        self.segments = ArraySegments(self)
+        self.attributes = SkeletonAttributes()
+
+    @classmethod
+    def from_skeleton(cls, skel):
+        """
+        Creates an ArraySkeleton from a Skeleton object (returned as is if already an ArraySkeleton).
+        :param skel: Skeleton with node-ids 0..N-1
+        :return: ArraySkeleton
+        """
+        if isinstance(skel, ArraySkeleton):
+            return skel
+
+        nnodes = len(skel.nodes)
+        assert(sorted(skel.nodes.keys()) == list(range(nnodes))), "Expected node-ids 0..%i" % (nnodes - 1)
+
+        node_positions = np.array([skel.nodes[i].position() for i in range(nnodes)],
+                                  dtype=np.float64).reshape(-1, 3)
+
+        return cls(node_positions, *segment_arrays(skel.segments))
+
+    def to_skeleton(self):
+        """ Returns a Skeleton of Node, Segment, and Point3D objects copied from the arrays"""
+        skel = Skeleton()
+        for nidx, pos in enumerate(self.node_positions.tolist()):
+            skel.add_node(nidx, Node(*pos))
+        for (start, end), count in zip(self.edges.tolist(), self.segment_counts().tolist()):
+            seg = Segment(start, end)
+            seg.pointcount = count
+            skel.add_segment(seg)
+        skel.add_points([Point3D(*p) for p in self.points.tolist()])
+        return skel
+
+    def segment_counts(self):
+        """ Returns the (E) array of point counts per segment"""
+        return np.diff(self.segment_offsets)
+
+    def point_segment_indices(self):
+        """ Returns the (P) array mapping each point to its segment index"""
+        return np.repeat(np.arange(len(self.edges)), self.segment_counts())
+
+    def segment_point(self, point_index):
+        """ Returns the (segment_index, point_index) of a point, given its index in the points array"""
+        sidx = int(np.searchsorted(self.segment_offsets, point_index, 'right')) - 1
+        return sidx, int(point_index - self.segment_offsets[sidx])
+
+    def update_diameters(self, xsection_dict,
+                         require_complete_xsection = True,
+                         outlier_logging_threshold = sys.float_info.max):
+        """
+        Given a dictionary of cross-sectional data, updates the point diameters
+        to match those provided by the cross-section data (see Skeleton.update_diameters).
+        :return: array of the point indices of outliers (see update_diameters_from_columns).
+        """
+        return self.update_diameters_from_columns(xsection_columns(xsection_dict),
+                                                  require_complete_xsection, outlier_logging_threshold)
+
+    def update_diameters_from_columns(self, columns,
+                                      require_complete_xsection = True,
+                                      outlier_logging_threshold = sys.float_info.max):
+        """
+        Given columns of cross-sectional data, updates the point diameters to match those
+        provided by the cross-section data.  Rows are joined to points through the segment
+        offsets in one pass, and statistics are computed as array reductions.
+        :param columns: Mapping of column name to array, with 'segment_idx', 'pnt_idx', 'diameter'
+             and 'estimated_diameter' columns; optional 'blender_position' and 'blender_normal'
+             columns are included in outlier logging.
+        :param require_complete_xsection: If true, assert on missing xsection data
+             otherwise, keep previous value.
+        :param outlier_logging_threshold: Threshold value for pre-post diameter difference;
+             logs special info about points whose new diameters differ by more
+             than the specified threshold.
+        :return: array of the point indices of outliers.
+        """
+        sidx = np.asarray(columns['segment_idx'], dtype=np.int64)
+        pidx = np.asarray(columns['pnt_idx'], dtype=np.int64)
+        counts = self.segment_counts()
+
+        logging.info('Updating diameters from cross_sections: total(%s)', len(sidx))
+
+        # rows of existing segment points, and their indices in the points array
+        valid = (sidx >= 0) & (sidx < len(counts)) & (pidx >= 0)
+        valid[valid] = pidx[valid] < counts[sidx[valid]]
+        rows = np.flatnonzero(valid)
+        indices = self.segment_offsets[sidx[rows]] + pidx[rows]
+
+        # in point order, as the per-point update
+        order = np.argsort(indices, kind='mergesort')
+        rows, indices = rows[order], indices[order]
+
+        if require_complete_xsection:
+            covered = np.zeros(len(self.points), dtype=bool)
+            covered[indices] = True
+            assert(covered.all()), \
+                "Missing index (%i,%i) in xsection dictionary. Expected complete cross-section data." % \
+                self.segment_point(np.flatnonzero(~covered)[0])
+
+        pre = self.points[indices, 3]
+        post = np.asarray(columns['diameter'], dtype=np.float64)[rows]
+        estimated = np.asarray(columns['estimated_diameter'], dtype=np.float64)[rows]
+        mismatch = np.flatnonzero(pre != estimated)
+        assert(mismatch.size == 0), \
+            "Expected point diameter (%f) to equal xsection estimate (%f)" % \
+            (pre[mismatch[0]], estimated[mismatch[0]])
+
+        diff = post - pre
+        outlier_rows = np.flatnonzero(np.abs(diff) > outlier_logging_threshold)
+        for i in outlier_rows.tolist():
+            row = rows[i]
+            logging.info('\t Updated OUTLIER diameter of segment point (%i,%i) at pos(%s) [blender pos(%s) normal(%s)], from old(%f) to new(%f), diff(%f)',
+                         sidx[row], pidx[row], tuple(self.points[indices[i], 0:3].tolist()),
+                         columns['blender_position'][row] if 'blender_position' in columns else None,
+                         columns['blender_normal'][row] if 'blender_normal' in columns else None,
+                         pre[i], post[i], abs(diff[i]))
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for i in np.flatnonzero(np.abs(diff) <= outlier_logging_threshold).tolist():
+                logging.debug('\t Updated diameter of segment point (%i,%i) from old(%f) to new(%f)',
+                              sidx[rows[i]], pidx[rows[i]], pre[i], post[i])
+
+        self.points[indices, 3] = post
+
+        inc, dec = diff > 0, diff < 0
+        cnt_inc, cnt_dec = int(inc.sum()), int(dec.sum())
+        inc_total, dec_total = float(diff[inc].sum()), float(-diff[dec].sum())
+        logging.info("Diameters updated: %i (inc: %i) (dec: %i), diameters total (pre: %f) (post:%f), increased: (total: %f) (avg: %f), decreased: (total: %f) (avg: %f)",
+                     len(rows), cnt_inc, cnt_dec, pre.sum(), post.sum(),
+                     inc_total, (inc_total / cnt_inc) if cnt_inc > 0 else 0,
+                     dec_total, (dec_total / cnt_dec) if cnt_dec > 0 else 0)
+
+        return indices[outlier_rows]
+
+    def info(self):
+        """Print out the count of Node, Segment and Points objects"""
+        return "Nodes    : %5i\nSegments : %5i\nPoints   : %5i" % (len(self.node_positions), len(self.edges), len(self.points))
+
+def xsection_columns(xsection_dict):
+    """
+    Converts a cross-section dictionary, indexed by (segment_index, point_index) tuples, into columns.
+    :param xsection_dict: A dictionary of cross-section data, including 'diameter' and 'estimated_diameter'.
+    :return: dictionary mapping column name to array, including 'segment_idx' and 'pnt_idx'.
+    """
+    keys = list(xsection_dict.keys())
+    values = [xsection_dict[k] for k in keys]
+
+    columns = {'segment_idx': np.array([k[0] for k in keys], dtype=np.int64),
+               'pnt_idx': np.array([k[1] for k in keys], dtype=np.int64)}
+    for name in ('diameter', 'estimated_diameter'):
+        columns[name] = np.array([v[name] for v in values], dtype=np.float64)
+    for name in ('blender_position', 'blender_normal'):
+        if values and name in values[0]:
+            columns[name] = [v.get(name) for v in values]
+    return columns
+
+
+def segment_arrays(segments):
+    """
+    Copies Segment objects into arrays.
+    :param segments: sequence of Segment objects
+    :return: tuple of (E x 2) edges, (E + 1) segment offsets and (P x 4) points arrays
+    """
+    edges = np.array([(s.start, s.end) for s in segments], dtype=np.int32).reshape(-1, 2)
+    counts = np.array([len(s.points) for s in segments], dtype=np.int64)
+    segment_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=segment_offsets[1:])
+    points = np.array([p.list() for s in segments for p in s.points],
+                      dtype=np.float64).reshape(-1, 4)
+    return edges, segment_offsets, points
+
+
+def compact_skeleton(skel):
+    """
+    Drops the nodes not referenced by any segment, and renumbers the remaining node-ids 0..N-1
+    (in ascending order of the original node-ids), e.g., after removing segments from a skeleton.
+    :param skel: Skeleton or ArraySkeleton; Skeleton node-ids may be any sortable keys.
+    :return: ArraySkeleton
+    """
+    if isinstance(skel, ArraySkeleton):
+        node_ids = np.arange(len(skel.node_positions))
+        node_positions = skel.node_positions
+        edges, segment_offsets, points = skel.edges, skel.segment_offsets, skel.points
+    else:
+        keys = sorted(skel.nodes.keys())
+        node_ids = np.array(keys)
+        node_positions = np.array([skel.nodes[k].position() for k in keys], dtype=np.float64).reshape(-1, 3)
+        edges, segment_offsets, points = segment_arrays(skel.segments)
+
+    used = np.unique(edges)
+    rows = np.searchsorted(node_ids, used)
+    assert(used.size == 0 or (rows[-1] < len(node_ids) and np.array_equal(node_ids[rows], used))), \
+        "Segments reference undefined nodes"
+
+    return ArraySkeleton(node_positions[rows], np.searchsorted(used, edges), segment_offsets, points)
+
+#
+# Amiramesh header classes
+#
+
+class AmirameshField(object):
+    """Data section declaration from the header, e.g.:
+        POINT { float[3] EdgePointCoordinates } @4
+        Lattice { byte Labels } @1(HxByteRLE,8182)
+    """
+
+    # Amiramesh primitive types
+    k_DTYPES = {'byte': np.uint8, 'short': np.int16, 'ushort': np.uint16,
+                'int': np.int32, 'float': np.float32, 'double': np.float64}
+
+    def __init__(self, location, type_name, components, name, index,
+                 encoding = None, encoded_size = None):
+        self.location = location
+        self.type_name = type_name
+        self.components = components
+        self.name = name
+        self.index = index
+        self.encoding = encoding
+        self.encoded_size = encoded_size
+
+    def dtype(self):
+        """ Returns the numpy dtype of a single component"""
+        assert(self.type_name in self.k_DTYPES), "Unsupported Amiramesh type: %s" % self.type_name
+        return np.dtype(self.k_DTYPES[self.type_name])
+
+
+class AmirameshHeader(object):
+    """Amiramesh file header: format, defined location counts and data section declarations"""
+
+    k_FORMAT_RE = re.compile(r'#\s*(?:Avizo|AmiraMesh)\s+(?:3D\s+)?(ASCII|BINARY-LITTLE-ENDIAN|BINARY)\s+([\d\.]+)')
+    k_DEFINE_RE = re.compile(r'define\s+(\w+)\s+([\d\s]+)')
+    k_FIELD_RE = re.compile(r'(\w+)\s*\{\s*(\w+)(?:\[(\d+)\])?\s+(\w+)\s*\}\s*@(\d+)(?:\((\w+),(\d+)\))?')
+    k_CONTENT_TYPE_RE = re.compile(r'ContentType\s+"(\w+)"')
+
+    def __init__(self):
+        self.format = None
+        self.version = None
+        self.content_type = None
+        self.defines = {}       # location name to count
+        self.dimensions = {}    # location name to dimensions tuple, e.g. Lattice (57, 77, 77)
+        self.fields = {}        # section index to AmirameshField
+
+    def is_binary(self):
+        return self.format is not None and self.format.startswith('BINARY')
+
+    def byte_order(self):
+        """ Returns the numpy byte order character of binary data"""
+        return '<' if self.format == 'BINARY-LITTLE-ENDIAN' else '>'
+
+    def field(self, name):
+        """ Returns the field declaration with the given name, or None"""
+        for field in self.fields.values():
+            if field.name == name:
+                return field
+        return None
+
+    def count(self, field):
+        """ Returns the declared item count for the location of a field"""
+        assert(field.location in self.defines), \
+            "Missing 'define %s' for field %s" % (field.location, field.name)
+        return self.defines[field.location]
+
+    def parse_line(self, line):
+        """
+        Parses one header line.
+        :param line: Trimmed header line text.
+        """
+        match = self.k_FORMAT_RE.match(line)
+        if match:
+            self.format, self.version = match.groups()
+            return
+
+        match = self.k_DEFINE_RE.match(line)
+        if match:
+            dims = tuple(int(d) for d in match.group(2).split())
+            self.dimensions[match.group(1)] = dims
+            self.defines[match.group(1)] = int(np.prod(dims))
+            return
+
+        match = self.k_FIELD_RE.match(line)
+        if match:
+            location, type_name, components, name, index, encoding, encoded_size = match.groups()
+            field = AmirameshField(location, type_name, int(components) if components else 1, name, int(index),
+                                   encoding, int(encoded_size) if encoded_size else None)
+            self.fields[field.index] = field
+            return
+
+        match = self.k_CONTENT_TYPE_RE.search(line)
+        if match:
+            self.content_type = match.group(1)
+
+
+def field_array(header, field, values):
+    """
+    Returns the validated (count x components) array of a field's data section.
+    :param header: AmirameshHeader
+    :param field: AmirameshField
+    :param values: flat array of the section values.
+    """
+    count = header.count(field)
+    assert(values.size == count * field.components), \
+        "Expected %i values in data section @%i (%s), found %i" % \
+        (count * field.components, field.index, field.name, values.size)
+
+    return values.reshape(count, field.components) if field.components > 1 else values
+
+
+class AmirameshSections(object):
+    """Data sections of an Amiramesh file, as a mapping of section index to a flat array of its values.
+
+    Sections are decoded on first access, so callers only pay for the fields they use.
+    """
+
+    def __init__(self, header, ranges, decode):
+        """
+        :param header: AmirameshHeader
+        :param ranges: dictionary mapping section index to the (start, end) of its data.
+        :param decode: function(field, start, end) returning the flat array of a section.
+        """
+        self.header = header
+        self.ranges = ranges
+        self.decode = decode
+        self.arrays = {}
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __contains__(self, index):
+        return index in self.ranges
+
+    def __iter__(self):
+        return iter(sorted(self.ranges))
+
+    def __getitem__(self, index):
+        if index not in self.arrays:
+            start, end = self.ranges[index]
+            self.arrays[index] = self.decode(self.header.fields[index], start, end)
+        return self.arrays[index]
+
+    def field_array(self, name):
+        """
+        Returns the validated (count x components) array of a named field.
+        :param name: field name
+        """
+        field = self.header.field(name)
+        assert(field is not None), "Missing %s declaration in Amiramesh header" % name
+        assert(field.index in self), "Missing data section @%i (%s)" % (field.index, name)
+        return field_array(self.header, field, self[field.index])
+
+
+class SkeletonAttributes(object):
+    """Typed arrays of the Amiramesh fields of a skeleton, keyed by field name, e.g.
+    attributes['thickness'] is the (POINT count) thickness array.  Arrays have the declared
+    field type (ASCII floats are read at double precision), and are decoded on first access.
+    """
+
+    def __init__(self, sections = None, names = None, lazy = True):
+        """
+        :param sections: AmirameshSections holding the fields.
+        :param names: field names to include; None includes every declared field.
+        :param lazy: Decode fields on first access, otherwise decode them now and release the sections.
+        """
+        self.arrays = {}
+        self.locations = {}
+        self.sections = sections
+        if sections is None:
+            return
+
+        fields = [sections.header.fields[i] for i in sorted(sections.header.fields)]
+        if names is None:
+            names = [field.name for field in fields if field.index in sections]
+        for name in names:
+            field = sections.header.field(name)
+            assert(field is not None), "Missing %s declaration in Amiramesh header" % name
+            self.locations[name] = field.location
+
+        if not lazy:
+            for name in names:
+                self[name]
+            self.sections = None
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, name):
+        return name in self.locations
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return sorted(self.locations)
+
+    def __getitem__(self, name):
+        assert(name in self.locations), "Unknown attribute: %s" % name
+        if name not in self.arrays:
+            self.arrays[name] = self.sections.field_array(name)
+        return self.arrays[name]
+
+    def location(self, name):
+        """ Returns the location (e.g., VERTEX, EDGE or POINT) of an attribute"""
+        return self.locations[name]
+
+
+def _to_str(data):
+    """ Returns data as native str (bytes read from files opened in binary mode are decoded)"""
+    return data if isinstance(data, str) else data.decode('latin-1')
+
+
+def read_header(f):
+    """
+    Reads the Amiramesh header from a file, leaving the file positioned at the first data section.
+    :param f: File object at the start of the file.
+    :return: AmirameshHeader
+    """
+    header = AmirameshHeader()
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line:
+            break
+
+        line = _to_str(line).strip()
+        if line.startswith('@'):
+            f.seek(pos)
+            break
+
+        header.parse_line(line)
+        if line.startswith('# Data section follows'):
+            break
+
+    return header
+
+def decode_byte_rle(encoded, size):
+    """
+    Decodes HxByteRLE run-length encoded data.  Each run starts with a control byte c:
+    if c < 128 the next byte is repeated c times; otherwise (c - 128) literal bytes follow.
+    :param encoded: Encoded data (bytes, buffer or uint8 array).
+    :param size: Expected decoded byte count.
+    :return: uint8 array of decoded bytes.
+    """
+    data = np.frombuffer(encoded, dtype=np.uint8)
+    raw = bytearray(data.tobytes())
+
+    # control byte positions must be found sequentially; expansion is vectorized
+    controls = []
+    pos = 0
+    end = len(raw)
+    while pos < end:
+        c = raw[pos]
+        if c == 0:
+            break
+        controls.append(pos)
+        pos += 1 + (c & 0x7f if c & 0x80 else 1)
+
+    controls = np.array(controls, dtype=np.int64)
+    ctrl = data[controls].astype(np.int64)
+    literal = (ctrl & 0x80) != 0
+    lengths = ctrl & 0x7f
+
+    assert(lengths.sum() == size), "HxByteRLE decoded %i bytes, expected %i" % (lengths.sum(), size)
+
+    # source index of each decoded byte: repeated runs reuse one byte, literal runs advance
+    run_starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=run_starts[1:])
+    within = np.arange(size, dtype=np.int64) - np.repeat(run_starts, lengths)
+    source = np.repeat(controls + 1, lengths) + within * np.repeat(literal, lengths)
+
+    return data[source]
+
+def make_points(coords, thickness = None):
+    """
+    Creates a (count x 4) XYZ and diameter point array; empty (nan) thickness values are replaced by 0.
+    :param coords: (count x 3) point coordinates.
+    :param thickness: Optional (count) point thickness values.
+    """
+    points = np.zeros((len(coords), 4), dtype=np.float64)
+    points[:, :3] = coords
+    if thickness is not None:
+        points[:, 3] = thickness
+        points[np.isnan(points[:, 3]), 3] = 0.0
+    return points
+
+
+def index_ascii_sections(f, block_size = 1 << 22):
+    """
+    Scans an ASCII file in blocks for '@N' data section marker lines.
+    :param f: File object.
+    :param block_size: Bytes read per block.
+    :return: dictionary mapping section index to (data start, data end) byte offsets.
+    """
+    markers = []
+    f.seek(0)
+    pos = 0
+    prev = '\n'
+    while True:
+        block = _to_str(f.read(block_size))
+        if not block:
+            break
+        # buf[0] is the last character of the previous block, so buf[i + 1] is at pos + i
+        buf = prev + block
+        found = buf.find('\n@')
+        while found != -1:
+            markers.append(pos + found)
+            found = buf.find('\n@', found + 1)
+        pos += len(block)
+        prev = block[-1]
+    end = pos
+
+    found = []  # (section index, marker offset, data start offset)
+    for marker in markers:
+        f.seek(marker)
+        line = _to_str(f.readline()).strip()
+        if line[1:].isdigit():
+            found.append((int(line[1:]), marker, f.tell()))
+
+    sections = {}
+    for i, (index, marker, start) in enumerate(found):
+        sections[index] = (start, found[i + 1][1] if i + 1 < len(found) else end)
+    return sections
+
+
+def read_ascii_lines(f, pos, count, dtype):
+    """
+    Reads count non-empty lines of ASCII values.
+    :param f: File object.
+    :param pos: Byte offset to start reading from.
+    :param count: Number of lines to read.
+    :param dtype: Value type.
+    :return: tuple of (flat array of values, byte offset after the last line read)
+    """
+    f.seek(pos)
+    lines = []
+    while len(lines) < count:
+        line = f.readline()
+        if not line:
+            break
+        if line.strip():
+            lines.append(_to_str(line))
+    assert(len(lines) == count), "Expected %i data lines at byte %i, found %i" % (count, pos, len(lines))
+    return np.fromstring(''.join(lines), dtype=dtype, sep=' '), f.tell()
+
+def index_ascii_lines(f, start, end, line_numbers, block_size = 1 << 22):
+    """
+    Finds the byte offsets of data lines within [start, end) of a file, scanning in blocks.
+    Empty lines are not counted.
+    :param f: File object opened in binary mode.
+    :param start: Byte offset of the first data line.
+    :param end: Byte offset of the end of the data.
+    :param line_numbers: Sorted array of line numbers; the total line count maps to the end of the last line.
+    :return: int64 array of byte offsets of the given lines.
+    """
+    targets = np.asarray(line_numbers, dtype=np.int64)
+    found = []
+    lines = 0               # non-empty lines seen so far
+    line_start = start      # offset of the line currently being scanned
+    after_last = start      # offset following the last non-empty line
+    prev = 10               # last byte of the previous block
+
+    f.seek(start)
+    pos = start
+    while pos < end:
+        block = f.read(min(block_size, end - pos))
+        if not block:
+            break
+        data = np.frombuffer(block, dtype=np.uint8)
+        nl = np.flatnonzero(data == 10)
+
+        # lines ending in this block; empty (or '\r' only) lines are skipped
+        starts = np.concatenate(([line_start], nl[:-1] + pos + 1)).astype(np.int64) if len(nl) else \
+                 np.zeros(0, dtype=np.int64)
+        lengths = nl + pos - starts
+        before = np.where(nl > 0, data[np.maximum(nl - 1, 0)], prev)
+        keep = (lengths > 1) | ((lengths == 1) & (before != 13))
+        kept_starts = starts[keep]
+
+        nkept = len(kept_starts)
+        selected = targets[(targets >= lines) & (targets < lines + nkept)]
+        found.append(kept_starts[selected - lines])
+        lines += nkept
+        if nkept:
+            after_last = int(nl[keep][-1]) + pos + 1
+        if len(nl):
+            line_start = int(nl[-1]) + pos + 1
+
+        prev = data[-1]
+        pos += len(block)
+
+    # final line without a terminating newline
+    if line_start < pos:
+        found.append(np.repeat(np.int64(line_start), np.count_nonzero(targets == lines)))
+        lines += 1
+        after_last = pos
+
+    found.append(np.repeat(np.int64(after_last), np.count_nonzero(targets == lines)))
+    offsets = np.concatenate(found)
+    assert(len(offsets) == len(targets)), \
+        "Expected at least %i data lines in bytes [%i, %i), found %i" % (targets.max(), start, end, lines)
+    return offsets
+
+
+#
+# AmirameshIndex class
+#
+
+class AmirameshIndex(object):
+    """Byte-offset index of an Amiramesh spatial graph for random access to segment ranges.
+
+    Records the (data start, data end) byte offsets of each '@N' section, the segment edges and
+    point offsets, and the byte offsets of each segment's first point and thickness lines.  The index
+    is persisted in a sidecar file next to the Amiramesh file (see index_file_path).
+    """
+
+    k_VERSION = 1
+
+    def __init__(self):
+        self.file_size = None
+        self.file_mtime = None
+        self.binary = False
+        self.section_offsets = {}       # section index to (data start, data end) byte offsets
+        self.edges = None               # (E x 2) segment start and end node-ids
+        self.segment_offsets = None     # (E + 1) CSR offsets of segment points
+        self.coords_offsets = None      # (E + 1) byte offsets of segment point coordinate lines
+        self.thickness_offsets = None   # (E + 1) byte offsets of segment thickness lines, or None
+
+    def segment_count(self):
+        return len(self.edges)
+
+    @classmethod
+    def build(cls, f):
+        """
+        Creates the index of an Amiramesh file.
+        :param f: File object opened in binary mode.
+        :return: AmirameshIndex
+        """
+        index = cls()
+        stat = os.fstat(f.fileno())
+        index.file_size, index.file_mtime = stat.st_size, stat.st_mtime
+
+        reader = AmirameshReader()
+        f.seek(0)
+        header = read_header(f)
+        index.binary = header.is_binary()
+        if index.binary:
+            sections = reader.map_binary_sections(f, header)
+            index.edges = np.array(sections.field_array(reader.k_EDGE_CONNECTIVITY))
+            counts = sections.field_array(reader.k_NUM_EDGE_POINTS)
+        else:
+            index.section_offsets = index_ascii_sections(f)
+            index.edges = reader.read_ascii_section(f, header, index.section_offsets, reader.k_EDGE_CONNECTIVITY)
+            counts = reader.read_ascii_section(f, header, index.section_offsets, reader.k_NUM_EDGE_POINTS)
+
+        index.segment_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=index.segment_offsets[1:])
+
+        if not index.binary:
+            for name, attr in [(reader.k_EDGE_POINT_COORDINATES, 'coords_offsets'),
+                               (reader.k_THICKNESS, 'thickness_offsets')]:
+                field = header.field(name)
+                if field is not None:
+                    start, end = index.section_offsets[field.index]
+                    setattr(index, attr, index_ascii_lines(f, start, end, index.segment_offsets))
+
+        return index
+
+    def is_current(self, am_file):
+        """ Returns True if the index matches the size and modification time of am_file"""
+        stat = os.stat(am_file)
+        return self.file_size == stat.st_size and self.file_mtime == stat.st_mtime
+
+    def save(self, path):
+        """
+        Writes the index to path (atomically, so concurrent readers never see a partial file).
+        :param path: Index file path.
+        """
+        sections = sorted(self.section_offsets.items())
+        arrays = {'version': self.k_VERSION,
+                  'file_stat': np.array([self.file_size, self.file_mtime], dtype=np.float64),
+                  'binary': self.binary,
+                  'section_ids': np.array([i for i, _ in sections], dtype=np.int64),
+                  'section_offsets': np.array([o for _, o in sections], dtype=np.int64).reshape(-1, 2),
+                  'edges': self.edges,
+                  'segment_offsets': self.segment_offsets}
+        if self.coords_offsets is not None:
+            arrays['coords_offsets'] = self.coords_offsets
+        if self.thickness_offsets is not None:
+            arrays['thickness_offsets'] = self.thickness_offsets
+
+        tmp_path = '%s.%i.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index file.
+        :param path: Index file path.
+        :return: AmirameshIndex, or None if the file is of a different index version.
+        """
+        with np.load(path) as data:
+            if int(data['version']) != cls.k_VERSION:
+                return None
+            index = cls()
+            file_size, index.file_mtime = data['file_stat'].tolist()
+            index.file_size = int(file_size)
+            index.binary = bool(data['binary'])
+            index.section_offsets = dict((i, tuple(o)) for i, o in
+                                         zip(data['section_ids'].tolist(), data['section_offsets'].tolist()))
+            index.edges = data['edges']
+            index.segment_offsets = data['segment_offsets']
+            index.coords_offsets = data['coords_offsets'] if 'coords_offsets' in data else None
+            index.thickness_offsets = data['thickness_offsets'] if 'thickness_offsets' in data else None
+        return index
+
+
+def index_file_path(am_file):
+    """ Returns the sidecar index file path of an Amiramesh file"""
+    return am_file + '.index.npz'
+
+
+def load_index(am_file, create = True):
+    """
+    Loads the sidecar index of an Amiramesh file, (re)building and saving it if missing or out of date.
+    :param am_file: Amiramesh file path.
+    :param create: If true, build a missing or stale index; otherwise return None.
+    :return: AmirameshIndex, or None
+    """
+    path = index_file_path(am_file)
+    if os.path.exists(path):
+        index = AmirameshIndex.load(path)
+        if index is not None and index.is_current(am_file):
+            return index
+
+    if not create:
+        return None
+
+    with open(am_file, 'rb') as f:
+        index = AmirameshIndex.build(f)
+    try:
+        index.save(path)
+    except (IOError, OSError) as e:
+        logging.warning('WARNING - Unable to save index file %s: %s', path, e)
+    return index
+
 #
 # AmirameshReader class
 #
@@ -206,10 +1189,38 @@ class Skeleton(object):
 class AmirameshReader(object):
     """ Read from a filehandle, parse, return a Skeleton object"""
 
+    def __init__(self, cache = None):
+        """
+        :param cache: Optional skeleton cache (e.g., cache.SkeletonCache) used by read; None disables caching.
+        """
+        self.cache = cache
+
+    def read(self, am_file):
+        """
+        Reads an Amiramesh spatial graph file (ASCII or binary) into an ArraySkeleton,
+        using the parsed-skeleton cache, if any.
+        :param am_file: Amiramesh file path.
+        :return: ArraySkeleton object
+        """
+        key = self.cache.key(am_file) if self.cache else None
+        if key:
+            skel = self.cache.load(am_file, key)
+            if skel is not None:
+                return skel
+
+        with open(am_file, 'rb') as f:
+            skel = self.parse_arrays(f)
+
+        if key:
+            self.cache.store(am_file, skel, key)
+        return skel
+
     def parse(self, f):
 
         skel = Skeleton()       # storage object
         points = []             # list of points
+        header = AmirameshHeader()
+        section = None          # field name of the current section
         counter = 0             # section counter
         linecounter = 0         # within sections
 
@@ -221,18 +1232,24 @@ class AmirameshReader(object):
             if not line:
                 continue
 
-            # skip intro
-            header = line.startswith("@")
-            if counter == 0 and not header:
+            # header declarations
+            marker = line.startswith("@")
+            if counter == 0 and not marker:
+                header.parse_line(line)
                 continue
 
-            # header
-            if header:
-                counter+= 1
+            # section marker: the header declares the field of each section
+            if marker:
+                counter += 1
                 linecounter = 0
+                field = header.fields.get(int(line[1:]))
+                if header.fields:
+                    section = field.name if field else None
+                else:
+                    section = self.k_SECTION_ORDER[counter - 1] if counter <= len(self.k_SECTION_ORDER) else None
                 continue
 
-            if counter == 1:            # nodes
+            if section == self.k_VERTEX_COORDINATES:        # nodes
                 match = re.search('([\d\.e\+\-]+) ([\d\.e\+\-]+) ([\d\.e\+\-]+)', line)
                 x,y,z = match.groups()
                 x = float(x)
@@ -242,19 +1259,19 @@ class AmirameshReader(object):
                 skel.add_node(linecounter,n)
                 linecounter += 1
 
-            elif counter == 2:          # segments to nodes
+            elif section == self.k_EDGE_CONNECTIVITY:       # segments to nodes
                 match = re.search('(\d+) (\d+)', line)
                 start,end = match.groups()
                 seg = Segment(int(start), int(end))
                 skel.add_segment(seg)
 
-            elif counter == 3:          # point count within segment
+            elif section == self.k_NUM_EDGE_POINTS:         # point count within segment
                 match = re.search('(\d+)', line)
                 count = match.groups()
                 skel.segments[linecounter].pointcount = int(count[0])
                 linecounter += 1
 
-            elif counter == 4:          # point coordinates within a segment
+            elif section == self.k_EDGE_POINT_COORDINATES:  # point coordinates within a segment
                 match = re.search('([\d\.e\+\-]+) ([\d\.e\+\-]+) ([\d\.e\+\-]+)', line)
                 x,y,z = match.groups()
                 x = float(x)
@@ -264,7 +1281,7 @@ class AmirameshReader(object):
                 points.append(p)
                 #linecounter += 1
 
-            elif counter == 5:           # diameter
+            elif section == self.k_THICKNESS:               # diameter
                 # empty values replaced by 0
                 if line == "nan":
                     line = "0.0"
@@ -275,6 +1292,360 @@ class AmirameshReader(object):
                 points[linecounter].set_diameter(dia)
                 linecounter += 1
 
+            # other fields (e.g., labels) are read by parse_arrays as skeleton attributes
+
         # add points in the end for efficiency
         skel.add_points(points)
         return skel
+
+    # spatial graph (HxSpatialGraph) field names
+    k_VERTEX_COORDINATES = 'VertexCoordinates'
+    k_EDGE_CONNECTIVITY = 'EdgeConnectivity'
+    k_NUM_EDGE_POINTS = 'NumEdgePoints'
+    k_EDGE_POINT_COORDINATES = 'EdgePointCoordinates'
+    k_THICKNESS = 'thickness'
+
+    # section order of spatial graph files without field declarations
+    k_SECTION_ORDER = (k_VERTEX_COORDINATES, k_EDGE_CONNECTIVITY, k_NUM_EDGE_POINTS,
+                       k_EDGE_POINT_COORDINATES, k_THICKNESS)
+
+    def parse_arrays(self, f, attributes = ()):
+        """
+        Fast reader: reads the header declarations, then bulk converts each ASCII data section
+        into a typed array in a single pass, or memory-maps the sections of a binary file.
+        :param f: File object at the start of an Amiramesh spatial graph; binary files must be opened 'rb'.
+        :param attributes: Names of the fields to attach as skeleton.attributes, or None to attach every
+                           declared field, decoded on first access (ASCII files then keep their text until released).
+        :return: ArraySkeleton object
+        """
+        header, sections = self.read_sections(f)
+        skel = self.create_array_skeleton(header, sections)
+        if attributes is None or attributes:
+            skel.attributes = SkeletonAttributes(sections, attributes, lazy=attributes is None)
+        return skel
+
+    def read_sections(self, f):
+        """
+        Reads the header and indexes the data sections of an ASCII or binary Amiramesh file.
+        :param f: File object at the start of the file; binary files must be opened in binary mode ('rb').
+        :return: tuple of (AmirameshHeader, AmirameshSections)
+        """
+        header = read_header(f)
+        if header.is_binary():
+            sections = self.map_binary_sections(f, header)
+        else:
+            sections = self.read_ascii_sections(header, _to_str(f.read()))
+        return header, sections
+
+    def read_ascii_sections(self, header, data):
+        """
+        Indexes the ASCII data sections declared in the header; each section is converted in one call on first access.
+        :param header: AmirameshHeader
+        :param data: Text of the data sections (following the header).
+        :return: AmirameshSections
+        """
+        # '@N' marker lines start each data section
+        starts = [0] if data.startswith('@') else []
+        pos = data.find('\n@')
+        while pos != -1:
+            starts.append(pos + 1)
+            pos = data.find('\n@', pos + 1)
+        starts.append(len(data))
+
+        ranges = {}
+        for start, end in zip(starts[:-1], starts[1:]):
+            body = data.find('\n', start, end)
+            body = end if body == -1 else body
+            index = int(data[start + 1:body])
+            if index in header.fields:
+                ranges[index] = (body, end)
+
+        def decode(field, start, end):
+            # parse floats at double precision, as the per-line parser does
+            dtype = np.float64 if field.dtype().kind == 'f' else field.dtype()
+            return np.fromstring(data[start:end], dtype=dtype, sep=' ')
+
+        return AmirameshSections(header, ranges, decode)
+
+    def map_binary_sections(self, f, header):
+        """
+        Memory-maps the binary data sections.  Plain sections are zero-copy read-only array views
+        of the mapped file; HxByteRLE encoded sections are decoded on first access.
+        :param f: File object positioned at the first data section (after read_header).
+        :param header: AmirameshHeader
+        :return: AmirameshSections
+        """
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pos = f.tell()
+        end = len(mm)
+
+        ranges = {}
+        while True:
+            pos = mm.find(b'@', pos)
+            if pos == -1:
+                break
+            eol = mm.find(b'\n', pos)
+            assert(eol != -1), "Missing data after section marker at byte %i" % pos
+
+            index = int(_to_str(mm[pos + 1:eol]).strip())
+            assert(index in header.fields), "Undeclared data section @%i" % index
+            field = header.fields[index]
+
+            if field.encoding == 'HxByteRLE':
+                size = field.encoded_size
+            else:
+                assert(field.encoding is None), "Unsupported encoding %s of data section @%i" % (field.encoding, index)
+                size = header.count(field) * field.components * field.dtype().itemsize
+
+            offset = eol + 1
+            assert(offset + size <= end), "Truncated data section @%i" % index
+            ranges[index] = (offset, offset + size)
+            pos = offset + size
+
+        def decode(field, start, end):
+            dtype = field.dtype().newbyteorder(header.byte_order())
+            count = header.count(field) * field.components
+            if field.encoding == 'HxByteRLE':
+                data = decode_byte_rle(np.frombuffer(mm, dtype=np.uint8, count=end - start, offset=start),
+                                       count * dtype.itemsize)
+                return data.view(dtype)
+            return np.frombuffer(mm, dtype=dtype, count=count, offset=start)
+
+        return AmirameshSections(header, ranges, decode)
+
+    def create_array_skeleton(self, header, sections):
+        """
+        Creates an ArraySkeleton from the spatial graph data sections.
+        :param header: AmirameshHeader
+        :param sections: AmirameshSections
+        :return: ArraySkeleton object
+        """
+        nodes = sections.field_array(self.k_VERTEX_COORDINATES)
+        edges = sections.field_array(self.k_EDGE_CONNECTIVITY)
+        counts = sections.field_array(self.k_NUM_EDGE_POINTS)
+        coords = sections.field_array(self.k_EDGE_POINT_COORDINATES)
+
+        assert(edges.size == 0 or (edges.min() >= 0 and edges.max() < len(nodes))), \
+            "Edge connectivity references nodes outside [0, %i)" % len(nodes)
+
+        segment_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=segment_offsets[1:])
+        assert(segment_offsets[-1] == len(coords)), \
+            "Sum of NumEdgePoints (%i) does not match POINT count (%i)" % (segment_offsets[-1], len(coords))
+
+        thickness = None
+        if header.field(self.k_THICKNESS) is not None:
+            thickness = sections.field_array(self.k_THICKNESS)
+
+        return ArraySkeleton(nodes, edges, segment_offsets, make_points(coords, thickness))
+
+    def iter_segments(self, f, chunk_points = 65536):
+        """
+        Streaming reader: indexes the data sections and reads the NumEdgePoints counts, then lazily
+        yields the points of each segment.  ASCII point data is read in chunks of about chunk_points
+        points (or one segment, if larger), so memory is bounded by the chunk rather than the file;
+        binary point data is sliced from the memory-mapped sections.
+        :param f: File object at the start of an Amiramesh spatial graph; binary files must be opened 'rb'.
+        :param chunk_points: Approximate number of ASCII points to convert at a time.
+        :return: generator of (segment_index, start, end, points) tuples, where points is a
+                 (count x 4) array of XYZ and diameter.
+        """
+        header = read_header(f)
+
+        if header.is_binary():
+            sections = self.map_binary_sections(f, header)
+            edges = sections.field_array(self.k_EDGE_CONNECTIVITY)
+            counts = sections.field_array(self.k_NUM_EDGE_POINTS)
+            coords = sections.field_array(self.k_EDGE_POINT_COORDINATES)
+            thickness = None
+            if header.field(self.k_THICKNESS) is not None:
+                thickness = sections.field_array(self.k_THICKNESS)
+
+            offset = 0
+            for sidx, (start, end) in enumerate(edges.tolist()):
+                count = int(counts[sidx])
+                yield sidx, start, end, make_points(coords[offset:offset + count],
+                                                    thickness[offset:offset + count] if thickness is not None else None)
+                offset += count
+            return
+
+        section_offsets = index_ascii_sections(f)
+        edges = self.read_ascii_section(f, header, section_offsets, self.k_EDGE_CONNECTIVITY)
+        counts = self.read_ascii_section(f, header, section_offsets, self.k_NUM_EDGE_POINTS)
+
+        segment_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=segment_offsets[1:])
+
+        coords_field = header.field(self.k_EDGE_POINT_COORDINATES)
+        assert(coords_field is not None), "Missing %s declaration in Amiramesh header" % self.k_EDGE_POINT_COORDINATES
+        assert(segment_offsets[-1] == header.count(coords_field)), \
+            "Sum of NumEdgePoints (%i) does not match POINT count (%i)" % (segment_offsets[-1], header.count(coords_field))
+        coords_pos = section_offsets[coords_field.index][0]
+
+        thickness_field = header.field(self.k_THICKNESS)
+        thickness_pos = section_offsets[thickness_field.index][0] if thickness_field is not None else None
+
+        nsegments = len(counts)
+        sidx = 0
+        while sidx < nsegments:
+            # chunk of whole segments covering about chunk_points points (at least one segment)
+            last = int(np.searchsorted(segment_offsets, segment_offsets[sidx] + chunk_points, 'right')) - 1
+            last = min(max(last, sidx + 1), nsegments)
+            npoints = int(segment_offsets[last] - segment_offsets[sidx])
+
+            coords, coords_pos = read_ascii_lines(f, coords_pos, npoints, np.float64)
+            thickness = None
+            if thickness_pos is not None:
+                thickness, thickness_pos = read_ascii_lines(f, thickness_pos, npoints, np.float64)
+            points = make_points(coords.reshape(-1, 3), thickness)
+
+            base = segment_offsets[sidx]
+            for i in range(sidx, last):
+                yield i, int(edges[i, 0]), int(edges[i, 1]), \
+                      points[segment_offsets[i] - base:segment_offsets[i + 1] - base]
+            sidx = last
+
+    def read_ascii_section(self, f, header, section_offsets, name):
+        """
+        Reads one whole ASCII data section.
+        :param f: File object.
+        :param header: AmirameshHeader
+        :param section_offsets: dictionary mapping section index to (data start, data end) byte offsets.
+        :param name: field name
+        :return: validated (count x components) array of the field.
+        """
+        field = header.field(name)
+        assert(field is not None), "Missing %s declaration in Amiramesh header" % name
+        assert(field.index in section_offsets), "Missing data section @%i (%s)" % (field.index, name)
+
+        start, end = section_offsets[field.index]
+        f.seek(start)
+        data = _to_str(f.read(end - start))
+        dtype = np.float64 if field.dtype().kind == 'f' else field.dtype()
+        return field_array(header, field, np.fromstring(data, dtype=dtype, sep=' '))
+
+    def read_segment_range(self, f, segment_range, index = None):
+        """
+        Loads only the segments in the [start, end) range, using the byte-offset index to read
+        just their point data (binary files are sliced from the memory-mapped sections).
+        :param f: File object opened in binary mode.
+        :param segment_range: A tuple with the [start, end) segment range.
+        :param index: AmirameshIndex of the file; required for ASCII files.
+        :return: ArraySkeleton with all nodes, whose segment i is segment (start + i) of the file.
+        """
+        f.seek(0)
+        header = read_header(f)
+        if header.is_binary():
+            sections = self.map_binary_sections(f, header)
+            nodes = sections.field_array(self.k_VERTEX_COORDINATES)
+            edges = sections.field_array(self.k_EDGE_CONNECTIVITY)
+            counts = sections.field_array(self.k_NUM_EDGE_POINTS)
+            segment_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=segment_offsets[1:])
+        else:
+            assert(index is not None and not index.binary), "Expected an ASCII AmirameshIndex"
+            nodes = self.read_ascii_section(f, header, index.section_offsets, self.k_VERTEX_COORDINATES)
+            edges = index.edges
+            segment_offsets = index.segment_offsets
+
+        start, end = max(0, segment_range[0]), min(len(edges), segment_range[1])
+        end = max(start, end)
+        first, last = segment_offsets[start], segment_offsets[end]
+
+        if header.is_binary():
+            coords = sections.field_array(self.k_EDGE_POINT_COORDINATES)[first:last]
+            thickness = None
+            if header.field(self.k_THICKNESS) is not None:
+                thickness = sections.field_array(self.k_THICKNESS)[first:last]
+        else:
+            f.seek(index.coords_offsets[start])
+            data = _to_str(f.read(index.coords_offsets[end] - index.coords_offsets[start]))
+            coords = np.fromstring(data, dtype=np.float64, sep=' ').reshape(-1, 3)
+            thickness = None
+            if index.thickness_offsets is not None:
+                f.seek(index.thickness_offsets[start])
+                data = _to_str(f.read(index.thickness_offsets[end] - index.thickness_offsets[start]))
+                thickness = np.fromstring(data, dtype=np.float64, sep=' ')
+
+        assert(len(coords) == last - first), "Expected %i points for segments [%i, %i), found %i" % \
+                                              (last - first, start, end, len(coords))
+
+        return ArraySkeleton(nodes, edges[start:end], segment_offsets[start:end + 1] - first,
+                             make_points(coords, thickness))
+
+
+#
+# AmirameshWriter class
+#
+
+class AmirameshWriter(object):
+    """ Write a Skeleton (or ArraySkeleton) as an Amiramesh HxSpatialGraph file"""
+
+    k_ASCII_FORMAT = '# Avizo 3D ASCII 2.0'
+    k_BINARY_FORMAT = '# Avizo BINARY-LITTLE-ENDIAN 2.1'
+    k_CHUNK_ROWS = 65536
+
+    def __init__(self, binary = False, compact = True):
+        """
+        :param binary: Write little-endian binary data sections, instead of ASCII.
+        :param compact: Drop the nodes not referenced by any segment, and renumber node-ids.
+        """
+        self.binary = binary
+        self.compact = compact
+
+    def write(self, f, skel):
+        """
+        Writes the VERTEX, EDGE and POINT sections of a skeleton.
+        :param f: File object opened for writing in binary mode ('wb').
+        :param skel: Skeleton or ArraySkeleton
+        """
+        skel = compact_skeleton(skel) if self.compact else ArraySkeleton.from_skeleton(skel)
+
+        fields = [('VERTEX', 'float', AmirameshReader.k_VERTEX_COORDINATES, skel.node_positions),
+                  ('EDGE', 'int', AmirameshReader.k_EDGE_CONNECTIVITY, skel.edges),
+                  ('EDGE', 'int', AmirameshReader.k_NUM_EDGE_POINTS, skel.segment_counts()),
+                  ('POINT', 'float', AmirameshReader.k_EDGE_POINT_COORDINATES, skel.points[:, 0:3]),
+                  ('POINT', 'float', AmirameshReader.k_THICKNESS, skel.points[:, 3])]
+
+        lines = [self.k_BINARY_FORMAT if self.binary else self.k_ASCII_FORMAT, '', '',
+                 'define VERTEX %i' % len(skel.node_positions),
+                 'define EDGE %i' % len(skel.edges),
+                 'define POINT %i' % len(skel.points), '',
+                 'Parameters {', '    ContentType "HxSpatialGraph"', '}', '']
+        for index, (location, type_name, name, values) in enumerate(fields, 1):
+            components = '[%i]' % values.shape[1] if values.ndim > 1 else ''
+            lines.append('%s { %s%s %s } @%i' % (location, type_name, components, name, index))
+        lines += ['', '# Data section follows']
+        f.write(('\n'.join(lines) + '\n').encode('ascii'))
+
+        for index, (location, type_name, name, values) in enumerate(fields, 1):
+            f.write(('@%i\n' % index).encode('ascii'))
+            if self.binary:
+                dtype = np.dtype(AmirameshField.k_DTYPES[type_name]).newbyteorder('<')
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                f.write(b'\n')
+            else:
+                self.write_ascii_section(f, values, '%.15e' if type_name == 'float' else '%i')
+                f.write(b'\n')
+
+    def write_ascii_section(self, f, values, fmt):
+        """
+        Writes the rows of an array as lines of space separated values, formatting blocks of rows at once.
+        :param f: File object opened for writing in binary mode ('wb').
+        :param values: (rows) or (rows x components) array
+        :param fmt: printf format of a single value
+        """
+        values = values.reshape(len(values), -1)
+        line = ' '.join([fmt] * values.shape[1]) + ' \n'
+        for start in range(0, len(values), self.k_CHUNK_ROWS):
+            chunk = values[start:start + self.k_CHUNK_ROWS]
+            f.write(((line * len(chunk)) % tuple(chunk.ravel().tolist())).encode('ascii'))
+
+    def save(self, am_file, skel):
+        """
+        Writes a skeleton to an Amiramesh file.
+        :param am_file: Amiramesh file path.
+        :param skel: Skeleton or ArraySkeleton
+        """
+        with open(am_file, 'wb') as f:
+            self.write(f, skel)
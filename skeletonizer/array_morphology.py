@@ -0,0 +1,164 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Array morphology module.
+"""
+
+import numpy as np
+
+
+#
+# ArrayMorphology class
+#
+
+class ArrayMorphology(object):
+    """Backend-neutral cell morphology in contiguous arrays, built by the morphology growth and
+    written by any of the morphology consumers (e.g., a BBPSDK morphology, an HDF5 or SWC file).
+
+    sections: (K x 3) parent section index (k_SOMA for sections grown from the soma), section type,
+        and offset of the first point of each section; sections are stored parents first.
+    points: (P x 4) point XYZ and diameter; the points of section i are
+        points[sections[i, 2]:sections[i+1, 2]] (the last section ends at P).
+    soma_points: (S x 3) soma surface points.
+    cut_points: (K) True where the section ends at a cut-point (the boundary of missing data).
+
+    Sections are built in order: points are only added to the most recently added section.
+    """
+
+    k_SOMA = -1
+
+    # section types (as BBPSDK Section_Type, and SWC)
+    k_SECTION_SOMA = 1
+    k_SECTION_AXON = 2
+    k_SECTION_DENDRITE = 3
+    k_SECTION_APICAL_DENDRITE = 4
+
+    k_PARENT = 0
+    k_TYPE = 1
+    k_OFFSET = 2
+
+    # initial capacity of the (growable) section, point and soma point buffers
+    k_INITIAL_CAPACITY = 64
+
+    def __init__(self, sections = None, points = None, soma_points = None, cut_points = None):
+        sections = np.zeros((0, 3), dtype=np.int64) if sections is None else \
+            np.asarray(sections, dtype=np.int64).reshape(-1, 3)
+        points = np.zeros((0, 4)) if points is None else np.asarray(points, dtype=np.float64).reshape(-1, 4)
+        soma_points = np.zeros((0, 3)) if soma_points is None else \
+            np.asarray(soma_points, dtype=np.float64).reshape(-1, 3)
+
+        # buffers, and the number of their used rows; buffers grow by doubling, so adding is amortized O(1)
+        self._sections = self._buffer(sections)
+        self._points = self._buffer(points)
+        self._soma_points = self._buffer(soma_points)
+        self._cut_points = np.zeros(len(self._sections), dtype=bool)
+        if cut_points is not None:
+            self._cut_points[0:len(sections)] = cut_points
+        self._nsections = len(sections)
+        self._npoints = len(points)
+        self._nsoma_points = len(soma_points)
+
+    @classmethod
+    def _buffer(cls, rows):
+        """ Returns a buffer initialized with rows, with room to grow"""
+        buf = np.zeros((max(cls.k_INITIAL_CAPACITY, len(rows)),) + rows.shape[1:], dtype=rows.dtype)
+        buf[0:len(rows)] = rows
+        return buf
+
+    @staticmethod
+    def _reserve(buf, nrows):
+        """ Returns buf, or a copy of buf with at least twice its capacity, if nrows do not fit"""
+        if nrows <= len(buf):
+            return buf
+        grown = np.zeros((max(nrows, 2 * len(buf)),) + buf.shape[1:], dtype=buf.dtype)
+        grown[0:len(buf)] = buf
+        return grown
+
+    def __len__(self):
+        return self._nsections
+
+    # NOTE: the arrays are views of the buffers (not copies), of the sections and points added so far
+
+    @property
+    def sections(self):
+        return self._sections[0:self._nsections]
+
+    @property
+    def points(self):
+        return self._points[0:self._npoints]
+
+    @property
+    def soma_points(self):
+        return self._soma_points[0:self._nsoma_points]
+
+    @property
+    def cut_points(self):
+        return self._cut_points[0:self._nsections]
+
+    def section_offsets(self):
+        """ Returns the (K + 1) CSR offsets of the section points"""
+        offsets = np.empty(self._nsections + 1, dtype=np.int64)
+        offsets[:-1] = self._sections[0:self._nsections, self.k_OFFSET]
+        offsets[-1] = self._npoints
+        return offsets
+
+    def section_points(self, section):
+        """ Returns the (n x 4) points of a section"""
+        assert(0 <= section < self._nsections), "Unknown section: %s" % section
+        first = self._sections[section, self.k_OFFSET]
+        last = self._sections[section + 1, self.k_OFFSET] if section + 1 < self._nsections else self._npoints
+        return self._points[first:last]
+
+    def add_soma_point(self, pos):
+        self._soma_points = self._reserve(self._soma_points, self._nsoma_points + 1)
+        self._soma_points[self._nsoma_points] = pos[0:3]
+        self._nsoma_points += 1
+
+    def add_section(self, parent, pos, diameter, section_type = k_SECTION_DENDRITE):
+        """
+        Adds a section grown from its parent, starting at pos.
+        :param parent: parent section index, or k_SOMA.
+        :param pos: position of the first point of the section.
+        :param diameter: diameter of the first point of the section.
+        :param section_type: section type, e.g., k_SECTION_DENDRITE.
+        :return: index of the new section.
+        """
+        assert(parent == self.k_SOMA or 0 <= parent < self._nsections), "Unknown parent section: %s" % parent
+        if self._nsections == len(self._sections):
+            self._sections = self._reserve(self._sections, self._nsections + 1)
+            self._cut_points = self._reserve(self._cut_points, len(self._sections))
+        self._sections[self._nsections] = (parent, section_type, self._npoints)
+        self._nsections += 1
+        self.add_points(self._nsections - 1, (pos[0], pos[1], pos[2], diameter))
+        return self._nsections - 1
+
+    def add_point(self, section, pos, diameter):
+        """ Adds a point to the end of the (most recently added) section"""
+        self.add_points(section, (pos[0], pos[1], pos[2], diameter))
+
+    def add_points(self, section, points):
+        """
+        Adds points to the end of the (most recently added) section.
+        :param section: section index.
+        :param points: (n x 4) array of point XYZ and diameter.
+        """
+        assert(section == self._nsections - 1), "Points may only be added to the last section"
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 4)
+        self._points = self._reserve(self._points, self._npoints + len(points))
+        self._points[self._npoints:self._npoints + len(points)] = points
+        self._npoints += len(points)
+
+    def mark_cut_point(self, section):
+        self._cut_points[section] = True
+
+    def soma_radius(self):
+        """ Returns the (mean, max) distance of the soma surface points from their centre, or (0, 0)"""
+        soma_points = self.soma_points
+        if not len(soma_points):
+            return 0.0, 0.0
+        radii = np.sqrt(((soma_points - soma_points.mean(axis=0)) ** 2).sum(axis=1))
+        return float(radii.mean()), float(radii.max())
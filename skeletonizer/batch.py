@@ -0,0 +1,204 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Batch skeletonization module.
+
+    Converts many skeletons, in parallel, over a process pool: each worker process imports the morphology
+    backend once, and converts the cells it is given.  A cell whose output is newer than its inputs is skipped,
+    and a failed cell is reported without aborting the batch.
+"""
+
+import os
+import copy
+import glob
+import time
+import logging
+import traceback
+import multiprocessing
+
+from skeletonizer.morphology import *
+
+
+k_CONVERTED = 'converted'
+k_SKIPPED = 'skipped'
+k_FAILED = 'failed'
+
+
+def read_manifest(manifest_file):
+    """
+    Reads a manifest of skeletons: one skeleton (*.am file, or skeleton name) per line, relative to the
+    manifest directory; empty lines and #-comments are ignored.
+    :param manifest_file: manifest file path.
+    :return: list of skeleton paths.
+    """
+    manifest_path = os.path.dirname(os.path.abspath(manifest_file))
+    paths = []
+    with open(manifest_file, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                paths.append(os.path.join(manifest_path, line))
+    return paths
+
+
+def find_skeletons(sources):
+    """
+    Finds the skeletons of batch sources.
+    :param sources: list of directories (all *.am files in them), glob patterns, *.am files,
+                    or manifest files (any other file, see read_manifest).
+    :return: sorted list of absolute *.am file paths, without duplicates.
+    """
+    am_files = set()
+    for source in sources:
+        if os.path.isdir(source):
+            paths = glob.glob(os.path.join(source, '*.am'))
+        elif glob.has_magic(source):
+            paths = glob.glob(source)
+        elif source[-3:] == '.am':
+            paths = [source]
+        else:
+            paths = read_manifest(source)
+
+        for path in paths:
+            am_files.add(os.path.abspath(path if path[-3:] == '.am' else path + '.am'))
+    return sorted(am_files)
+
+
+def input_files(options):
+    """ Returns the input files of the skeleton of the options (with their file paths set)"""
+    files = [options.skel_am_file, options.skel_json_file]
+    if not options.ignore_optional_input_files:
+        files.append(options.skel_csv_file)
+    return files
+
+
+def is_up_to_date(options):
+    """
+    :param options: MorphologyCreateOptions object, with its file paths set.
+    :return: True if the output file exists, and is newer than all (existing) input files.
+    """
+    if not os.path.exists(options.skel_out_file):
+        return False
+    out_mtime = os.path.getmtime(options.skel_out_file)
+    return all(os.path.getmtime(f) < out_mtime for f in input_files(options) if os.path.exists(f))
+
+
+def skeletonize_cell(args):
+    """
+    Converts one cell of a batch (in a worker process); exceptions are returned, not raised.
+    :param args: tuple of (am_file, options), where options is the MorphologyCreateOptions batch template.
+    :return: dictionary of the cell result: am_file, out_file, status (k_CONVERTED, k_SKIPPED or k_FAILED),
+             elapsed (seconds), sections, points, and error (failure message) and traceback.
+    """
+    am_file, template = args
+    result = {'am_file': am_file, 'out_file': None, 'status': k_FAILED, 'elapsed': 0.0,
+              'sections': 0, 'points': 0, 'error': None, 'traceback': None}
+    start = time.time()
+    try:
+        options = copy.copy(template)
+        options.set_pathname(am_file)
+        options.set_filepaths()
+        result['out_file'] = options.skel_out_file
+
+        if not template.force_overwrite and is_up_to_date(options):
+            result['status'] = k_SKIPPED
+            return result
+
+        # an out of date output is replaced
+        options.force_overwrite = True
+        options.validate()
+
+        morphology = skeletonize(options)
+        result['sections'] = len(morphology)
+        result['points'] = len(morphology.points)
+        result['status'] = k_CONVERTED
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    finally:
+        result['elapsed'] = time.time() - start
+    return result
+
+
+def run_batch(am_files, options, processes = None):
+    """
+    Converts skeletons in parallel; failed cells are logged, and the batch continues.
+    :param am_files: list of *.am file paths.
+    :param options: MorphologyCreateOptions object, the template of the options of each cell
+                    (its skeleton name and file paths are set per cell).
+    :param processes: number of worker processes; None for the number of cores, 1 to convert in this process.
+    :return: list of cell results (see skeletonize_cell), in completion order.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(am_files)))
+    tasks = [(am_file, options) for am_file in am_files]
+
+    results = []
+    if processes == 1:
+        cells = (skeletonize_cell(task) for task in tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        cells = pool.imap_unordered(skeletonize_cell, tasks)
+
+    try:
+        for result in cells:
+            results.append(result)
+            if result['status'] == k_FAILED:
+                logging.error('FAILED [%i/%i] %s: %s', len(results), len(tasks), result['am_file'], result['error'])
+                logging.debug(result['traceback'])
+            else:
+                logging.info('%s [%i/%i] %s (%.2fs)', result['status'], len(results), len(tasks),
+                             result['out_file'], result['elapsed'])
+    except BaseException:
+        # e.g., KeyboardInterrupt: stop the workers, without waiting for the queued cells
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def summarize_batch(results, elapsed):
+    """
+    :param results: list of cell results (see skeletonize_cell).
+    :param elapsed: batch wall time (seconds).
+    :return: dictionary of the batch totals (by status), elapsed time, and throughput (cells/s, points/s).
+    """
+    converted = [r for r in results if r['status'] == k_CONVERTED]
+    summary = {
+        'cells': len(results),
+        k_CONVERTED: len(converted),
+        k_SKIPPED: sum(1 for r in results if r['status'] == k_SKIPPED),
+        k_FAILED: sum(1 for r in results if r['status'] == k_FAILED),
+        'points': sum(r['points'] for r in converted),
+        'sections': sum(r['sections'] for r in converted),
+        'elapsed': elapsed,
+        'cell_time': sum(r['elapsed'] for r in converted),
+    }
+    summary['cells_per_second'] = summary[k_CONVERTED] / elapsed if elapsed > 0 else 0.0
+    summary['points_per_second'] = summary['points'] / elapsed if elapsed > 0 else 0.0
+    return summary
+
+
+def show_batch_summary(summary, results):
+    """ Logs the batch summary, and the failed cells"""
+    logging.info('Batch: %i cells, %i converted, %i skipped (up to date), %i failed',
+                 summary['cells'], summary[k_CONVERTED], summary[k_SKIPPED], summary[k_FAILED])
+    logging.info('\t %i sections, %i points in %.2fs (%.2fs of cell time)',
+                 summary['sections'], summary['points'], summary['elapsed'], summary['cell_time'])
+    logging.info('\t Throughput: %.2f cells/s, %.0f points/s',
+                 summary['cells_per_second'], summary['points_per_second'])
+    for result in results:
+        if result['status'] == k_FAILED:
+            logging.error('\t FAILED %s: %s', result['am_file'], result['error'])
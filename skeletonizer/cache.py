@@ -0,0 +1,142 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Skeleton cache module.
+"""
+
+import os
+import zipfile
+import hashlib
+import logging
+
+import numpy as np
+
+from skeletonizer.amiramesh import ArraySkeleton
+
+
+def default_cache_dir():
+    """ Returns $SKELETONIZER_CACHE_DIR, or ~/.cache/skeletonizer"""
+    return os.environ.get('SKELETONIZER_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'skeletonizer'))
+
+
+#
+# SkeletonCache class
+#
+
+class SkeletonCache(object):
+    """On-disk cache of parsed skeletons, stored as *.npz arrays.
+
+    Entries are keyed by the source file's size, modification time and content hash, and
+    evicted least-recently-used first once the cache directory exceeds max_bytes.
+    """
+
+    k_VERSION = 1
+    k_DEFAULT_MAX_BYTES = 1 << 30
+    k_HASH_BLOCK_SIZE = 1 << 20
+
+    def __init__(self, cache_dir = None, max_bytes = k_DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir if cache_dir else default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, am_file):
+        """
+        Returns the cache key of a source file.
+        :param am_file: Amiramesh file path.
+        """
+        stat = os.stat(am_file)
+        content = hashlib.sha1()
+        with open(am_file, 'rb') as f:
+            block = f.read(self.k_HASH_BLOCK_SIZE)
+            while block:
+                content.update(block)
+                block = f.read(self.k_HASH_BLOCK_SIZE)
+
+        key = hashlib.sha1(('%i:%r:%s' % (stat.st_size, stat.st_mtime, content.hexdigest())).encode('ascii'))
+        return key.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, am_file, key = None):
+        """
+        Returns the cached skeleton of a source file.
+        :param am_file: Amiramesh file path.
+        :param key: Optional, precomputed cache key of am_file.
+        :return: ArraySkeleton, or None if not cached.
+        """
+        path = self.entry_path(key if key else self.key(am_file))
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != self.k_VERSION:
+                    return None
+                skel = ArraySkeleton(data['node_positions'], data['edges'],
+                                     data['segment_offsets'], data['points'])
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile) as e:
+            logging.warning('WARNING - Ignoring unreadable cache entry %s: %s', path, e)
+            return None
+
+        # mark as recently used; the entry may have been evicted meanwhile (e.g., by another process)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        logging.info('Loaded cached skeleton: %s', path)
+        return skel
+
+    def store(self, am_file, skel, key = None):
+        """
+        Adds a skeleton to the cache, then evicts least-recently-used entries over max_bytes.
+        :param am_file: Amiramesh file path.
+        :param skel: Skeleton parsed from am_file.
+        :param key: Optional, precomputed cache key of am_file.
+        """
+        skel = ArraySkeleton.from_skeleton(skel)
+        path = self.entry_path(key if key else self.key(am_file))
+
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            tmp_path = '%s.%i.tmp' % (path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, version=self.k_VERSION,
+                         node_positions=skel.node_positions, edges=skel.edges,
+                         segment_offsets=skel.segment_offsets, points=skel.points)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logging.warning('WARNING - Unable to write cache entry %s: %s', path, e)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """ Removes least-recently-used entries until the cache is within max_bytes"""
+        # entries may be removed meanwhile (e.g., evicted by another process sharing the cache); they are skipped
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+                logging.debug('Evicted cache entry: %s', name)
+            except OSError:
+                pass
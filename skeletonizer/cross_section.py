@@ -0,0 +1,157 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Cross-section data module.
+"""
+
+import os
+import re
+import math
+import logging
+
+import numpy as np
+
+
+#
+# CrossSectionData class
+#
+
+class CrossSectionData(object):
+    """Columnar cross-section data, as written by skeleton_annotate_csv.py, e.g.:
+        data['segment_idx'], data['pnt_idx']: (N) int64 segment and point indices.
+        data['area'], data['diameter'], ...: (N) float64 measurements.
+        data['blender_position'], data['blender_normal']: (N x 3) float64 vectors.
+
+    The 'diameter' column is derived from the cross-sectional 'area'.
+    """
+
+    k_VERSION = 1
+
+    k_INT_COLUMNS = ('segment_idx', 'pnt_idx')
+    k_FLOAT_COLUMNS = ('area', 'perimeter', 'estimated_diameter', 'estimated_area', 'estimated_perimeter')
+    k_VECTOR_COLUMNS = ('am_position', 'blender_position', 'blender_normal')
+
+    def __init__(self, columns):
+        """
+        :param columns: dictionary mapping column name to array.
+        """
+        self.columns = columns
+        if 'diameter' not in columns and 'area' in columns:
+            columns['diameter'] = np.sqrt(columns['area']) / math.pi
+
+    def __len__(self):
+        return len(self.columns['segment_idx'])
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def keys(self):
+        return sorted(self.columns)
+
+    def to_dict(self):
+        """ Returns the cross-section dictionary, indexed by (segment_index, point_index) tuples"""
+        names = self.keys()
+        rows = zip(*[self.columns[n].tolist() for n in names])
+        return dict(((r['segment_idx'], r['pnt_idx']), r) for r in (dict(zip(names, row)) for row in rows))
+
+    @classmethod
+    def parse(cls, f):
+        """
+        Reads a tab-delimited cross-section *.csv file, converting each column in one call.
+        :param f: File object of the *.csv file.
+        :return: CrossSectionData
+        """
+        lines = [l for l in f.read().splitlines() if l.strip()]
+        assert(lines), "Missing cross-section header line"
+
+        names = lines[0].split('\t')
+        values = list(zip(*[l.split('\t') for l in lines[1:]])) or [()] * len(names)
+        assert(len(values) == len(names)), "Expected %i cross-section columns, found %i" % (len(names), len(values))
+
+        columns = {}
+        for name, column in zip(names, values):
+            if name in cls.k_INT_COLUMNS:
+                columns[name] = np.array(column, dtype=np.int64)
+            elif name in cls.k_FLOAT_COLUMNS:
+                columns[name] = np.fromstring(' '.join(column), dtype=np.float64, sep=' ')
+            elif name in cls.k_VECTOR_COLUMNS:
+                # tuple "(x, y, z)" or Blender vector "Vector((x, y, z))" text
+                vectors = ','.join(re.findall(r'\(([^()]*)\)', ' '.join(column)))
+                columns[name] = np.fromstring(vectors, dtype=np.float64, sep=',').reshape(-1, 3)
+            else:
+                continue
+            assert(len(columns[name]) == len(column)), "Unable to parse cross-section column: %s" % name
+
+        return cls(columns)
+
+    def save(self, path, file_stat = None):
+        """
+        Writes the columns to a binary *.npz file (atomically, so concurrent readers never see a partial file).
+        :param path: Binary file path.
+        :param file_stat: Optional (size, mtime) of the source *.csv file.
+        """
+        arrays = dict(self.columns)
+        arrays['version'] = self.k_VERSION
+        if file_stat is not None:
+            arrays['file_stat'] = np.array(file_stat, dtype=np.float64)
+
+        tmp_path = '%s.%i.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, file_stat = None):
+        """
+        Reads a binary *.npz file of columns.
+        :param path: Binary file path.
+        :param file_stat: Optional (size, mtime) the source *.csv file is expected to have.
+        :return: CrossSectionData, or None if the file is of a different version or source file.
+        """
+        with np.load(path) as data:
+            if int(data['version']) != cls.k_VERSION:
+                return None
+            if file_stat is not None and \
+               ('file_stat' not in data or data['file_stat'].tolist() != [float(v) for v in file_stat]):
+                return None
+            return cls(dict((name, data[name]) for name in data.files if name not in ('version', 'file_stat')))
+
+
+def companion_file_path(csv_file):
+    """ Returns the binary companion file path of a cross-section *.csv file"""
+    return csv_file + '.npz'
+
+
+def load_cross_sections(csv_file, companion = True):
+    """
+    Loads a cross-section *.csv file, using its binary companion file if it matches the size and
+    modification time of the *.csv file, otherwise parsing the *.csv file and (re)writing the companion file.
+    :param csv_file: Tab-delimited cross-section *.csv file path.
+    :param companion: If true, use and maintain the binary companion file.
+    :return: CrossSectionData
+    """
+    path = companion_file_path(csv_file)
+    stat = os.stat(csv_file)
+    file_stat = (stat.st_size, stat.st_mtime)
+    if companion and os.path.exists(path):
+        data = CrossSectionData.load(path, file_stat)
+        if data is not None:
+            logging.info('Loaded cross-section data: %s', path)
+            return data
+
+    with open(csv_file, 'r') as f:
+        data = CrossSectionData.parse(f)
+
+    if companion:
+        try:
+            data.save(path, file_stat)
+        except (IOError, OSError) as e:
+            logging.warning('WARNING - Unable to save cross-section file %s: %s', path, e)
+    return data
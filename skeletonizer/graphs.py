@@ -17,36 +17,125 @@ import copy
 import json
 import logging
 import operator
-from collections import defaultdict
+from collections import defaultdict, deque
 
 try:
     import skeletonizer
 except ImportError:
     sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(os.path.split(__file__)[0]))))
 
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
 from skeletonizer.amiramesh import *
 from skeletonizer.maths import *
 
 
-def collect_soma_nodes(pos, radius, nodes):
+#
+# GrowStatistics class
+#
+
+class GrowStatistics(object):
+    """Statistics of one morphology creation run; each run collects its own (see show_warning_stats)."""
+
+    k_WARN_UNCONNECTED_SEGMENTS = 1
+    k_WARN_IGNORED_EDGES = 2
+    k_WARN_MAX_GROW_DEPTH_REACHED = 3
+    k_WARN_CUT_NODES_FOUND = 4
+    k_INFO_IGNORED_POSITIONS = 100
+
+    def __init__(self):
+        # dictionary mapping warning and info categories above to occurrence counts
+        self.warn_counts = defaultdict(int)
+
+        # dictionary mapping morphology sections (or the soma) to the (morphology) positions grown from them.
+        self.node_grow_stats = defaultdict(list)
+
+
+#
+# NodeSpatialIndex class
+#
+
+class NodeSpatialIndex(object):
+    """Spatial index over the node positions of a skeleton, answering radius queries
+    (e.g., collecting the nodes of one or many somata) without scanning every node.
+
+    Uses a scipy KD-tree when available; otherwise, binary searches of the positions sorted by X.
+    Build once per skeleton, and query as often as needed (e.g., while tuning soma radii).
+    """
+
+    def __init__(self, nodes):
+        """
+        :param nodes: nodes in skeleton data structure from amiramesh reader (mapping node-id to Node).
+        """
+        if isinstance(nodes, ArrayNodes):
+            self.node_ids = np.arange(len(nodes))
+            self.positions = np.asarray(nodes.array, dtype=np.float64)
+        else:
+            items = list(nodes.iteritems())
+            self.node_ids = np.array([nidx for nidx, _ in items])
+            self.positions = np.array([node.position() for _, node in items], dtype=np.float64).reshape(-1, 3)
+
+        if cKDTree is not None:
+            self.tree = cKDTree(self.positions)
+        else:
+            self.tree = None
+            self.order = np.argsort(self.positions[:, 0], kind='mergesort')
+            self.sorted_x = self.positions[self.order, 0]
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def candidates(self, centre, radius):
+        """ Returns the row indices of the positions possibly within radius of centre (a superset)"""
+        # slightly enlarged, so the exact test decides nodes on the boundary
+        r = radius * (1.0 + 1e-9) + 1e-12
+        if self.tree is not None:
+            return np.array(self.tree.query_ball_point(centre, r), dtype=np.int64)
+        first = np.searchsorted(self.sorted_x, centre[0] - r, 'left')
+        last = np.searchsorted(self.sorted_x, centre[0] + r, 'right')
+        return self.order[first:last]
+
+    def query_radius(self, centres, radii):
+        """
+        Returns the nodes within radius of each centre (inclusive, as collect_soma_nodes).
+        :param centres: (M x 3) array of centre positions, or a single centre position.
+        :param radii: (M) array of radii, or a single radius for all centres.
+        :return: list of M node-id arrays, each in the order of the skeleton nodes.
+        """
+        centres = np.asarray(centres, dtype=np.float64).reshape(-1, 3)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(centres),))
+
+        results = []
+        for centre, radius in zip(centres.tolist(), radii.tolist()):
+            rows = np.sort(self.candidates(centre, radius))
+            dsqr = distance_squared_array(self.positions[rows], centre)
+            results.append(self.node_ids[rows[dsqr <= radius * radius]])
+        return results
+
+
+def collect_soma_nodes(pos, radius, nodes, index = None):
     """
     Creates a list of node-ids for nodes within the given soma volume.
     :param pos: centre location of soma.
     :param radius: radius of soma from pos.
     :param nodes: nodes list in skeleton data structure from amiramesh reader.
+    :param index: Optional, NodeSpatialIndex of the nodes (created if None).
     :return: list of node-ids for nodes within soma region.
     """
     logging.info('Soma pos:%s radius:%s', pos, radius)
 
-    soma_ids = []
-    rsqr = square(radius)
-    for nidx, node in nodes.iteritems():
-        npos = node.position()
-        dsqr = distance_squared(pos, npos)
+    if index is None:
+        index = NodeSpatialIndex(nodes)
+    soma_ids = index.query_radius(pos, radius)[0].tolist()
 
-        if dsqr <= rsqr:
-            soma_ids.append(nidx)
-            logging.debug('Soma Node:%s pos:%s', nidx, npos)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        for nidx in soma_ids:
+            logging.debug('Soma Node:%s pos:%s', nidx, nodes[nidx].position())
 
     return soma_ids
 
@@ -73,21 +162,38 @@ def is_cut_point(pos, aabb):
     return is_cut
 
 
-def show_node_pos_stats(nodepositions, aabb, centre):
-    x = map(lambda a: a[0], nodepositions)
-    y = map(lambda a: a[1], nodepositions)
-    z = map(lambda a: a[2], nodepositions)
+def cut_point_mask(positions, aabb):
+    """
+    Classifies positions as cut-points (outside the cut boundary aabb) in one vectorized pass.
+    :param positions: (N x 3) array of positions (e.g., skeleton points or nodes).
+    :param aabb: The AABB (Axis Aligned Bounding Box) representing the cut boundary, or None.
+    :return: (N) boolean array, True where is_cut_point; None if there is no aabb.
+    """
+    if not aabb:
+        return None
+    return ~inside_aabb_array(aabb, positions)
+
 
-    logging.info( "X min:%s max:%s avg:%s", min(x), max(x), sum(x)/float(len(x)))
-    logging.info( "Y min:%s max:%s avg:%s", min(y), max(y), sum(y)/float(len(y)))
-    logging.info( "Z min:%s max:%s avg:%s", min(z), max(z), sum(z)/float(len(z)))
+def show_node_pos_stats(nodepositions, aabb, centre, cut_mask = None):
+    """
+    :param nodepositions: list or (N x 3) array of node positions.
+    :param aabb: The stack AABB, or None.
+    :param centre: soma centre.
+    :param cut_mask: Optional, cut_point_mask of nodepositions (computed if None).
+    """
+    positions = np.asarray(nodepositions, dtype=np.float64).reshape(-1, 3)
+    for name, c in zip('XYZ', positions.T.tolist()):
+        logging.info( "%s min:%s max:%s avg:%s", name, min(c), max(c), sum(c)/float(len(c)))
 
-    clipped_nodepositions = filter(lambda v: not inside_aabb(aabb, v), nodepositions)
+    if cut_mask is None:
+        cut_mask = cut_point_mask(positions, aabb)
+    clipped_nodepositions = positions[cut_mask].tolist() if cut_mask is not None else []
     logging.info( "Stack AABB clipped nodes:%s", len(clipped_nodepositions))
 
-    for np in clipped_nodepositions:
-        anp = vadjust_offset_length3(np, centre, 0)
-        logging.warning( "\t clipped node pos:%s, original source pos:%s", anp, np)
+    for npos in clipped_nodepositions:
+        npos = tuple(npos)
+        anp = vadjust_offset_length3(npos, centre, 0)
+        logging.warning( "\t clipped node pos:%s, original source pos:%s", anp, npos)
 
 
 def show_graph_stats(dag_nodes, node_segments):
@@ -137,8 +243,8 @@ def show_graph_stats(dag_nodes, node_segments):
 
 def show_grow_stats(stats, soma):
     """
-    :param stats: Statistics data to log.
-    :param soma: BBPSDK Soma object
+    :param stats: GrowStatistics to log.
+    :param soma: soma key of the grown statistics (e.g., ArrayMorphology.k_SOMA)
     """
 
     node_grow_stats = stats.node_grow_stats
@@ -172,7 +278,7 @@ def show_grow_stats(stats, soma):
 def show_warning_stats(stats):
     """
     Log warning statistics data.
-    :param stats: Statistics data to log.
+    :param stats: GrowStatistics to log.
     """
     warnings = False
     WARN_UNCONNECTED_SEGMENTS_cnt = stats.warn_counts[stats.k_WARN_UNCONNECTED_SEGMENTS]
@@ -217,29 +323,33 @@ def create_node_graph(skel):
         edges[segm.end].add(segm.start)
     return edges
 
-def create_directed_graph(somanodes, nodesgraph, options, stats):
+def create_directed_graph(somanodes, nodesgraph, context):
     """
     Creates a directed graph dictionary of edges mapping node id to node ids.
     :param somanodes: list of soma node-ids
     :param nodesgraph: bidirectional node-id graph of skeleton structure
-    :param options: struct of graph options.
-    :param stats: statistic collection object
+    :param context: run context: graph options (k_ALLOW_CYCLES, k_CONNECT_SOMA_SOMA), and stats (GrowStatistics).
     :return: directed edge dictionary mapping node-id to set of node-ids.
     """
     def node_name(n, snodes, vnodes):
         return "%s%snode %s" % ('visited ' if n in vnodes else '', 'soma ' if n in snodes else '', n)
 
+    # NOTE: a node reached from several nodes is queued once per such node, but its edges are explored
+    # only when it is first dequeued; with a deque and sets, the traversal is linear in the graph size.
+    stats = context.stats
+    somaset = set(somanodes)
     edges = {}
-    visited = []
-    frontier = copy.deepcopy(somanodes)
+    visited = set()
+    frontier = deque(somanodes)
     while frontier:
-        n = frontier[0]
+        n = frontier.popleft()
+        if n in visited:
+            continue
         neighbours = nodesgraph[n]
 
         logging.debug("Exploring frontier node:%s neighbours:%s", n, neighbours)
 
-        visited.append(n)
-        frontier.remove(n)
+        visited.add(n)
         if (n not in edges):
             edges[n] = set()
 
@@ -247,23 +357,24 @@ def create_directed_graph(somanodes, nodesgraph, options, stats):
             is_visited = nn in visited
             if (not is_visited):
                 frontier.append(nn)
-            if (options.k_CONNECT_SOMA_SOMA or nn not in somanodes) and (options.k_ALLOW_CYCLES or not is_visited):
+            if (context.k_CONNECT_SOMA_SOMA or nn not in somaset) and (context.k_ALLOW_CYCLES or not is_visited):
                 edges[n].add(nn)
             else:
                 stats.warn_counts[stats.k_WARN_IGNORED_EDGES] += 1
                 logging.debug("WARNING - Ignoring edge from %s to %s",
-                      node_name(n, somanodes, visited), node_name(nn, somanodes, visited))
+                      node_name(n, somaset, visited), node_name(nn, somaset, visited))
 
     return edges
 
-def create_node_segments_dict(segments, dgraph, stats):
+def create_node_segments_dict(segments, dgraph, context):
     """
     Creates a dictionary of correctly ordered segments ordered according to the dgraph.
     :param segments: list of segments from amiramesh reader.
     :param dgraph: directed node-id graph.
-    :param stats: statistic collection object
+    :param context: run context, with stats (GrowStatistics).
     :return: dictionary mapping start node-ids to the segments which grow from them.
     """
+    stats = context.stats
     nodesegments = defaultdict(lambda: [])
     for s in segments:
         connected = False
@@ -271,9 +382,7 @@ def create_node_segments_dict(segments, dgraph, stats):
             nodesegments[s.start].append(s)
             connected = True
         if (s.end in dgraph and s.start in dgraph[s.end]):
-            r = copy.deepcopy(s)
-            r.start, r.end = s.end, s.start
-            r.points = [i for i in reversed(s.points)]
+            r = SegmentView(s)
             nodesegments[r.start].append(r)
             connected = True
 
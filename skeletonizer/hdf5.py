@@ -0,0 +1,160 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    HDF5 morphology module.
+
+    Writes and reads ArrayMorphology objects in the BBP HDF5 (v1) morphology layout, as whole arrays:
+        /points: (P x 4) point XYZ and diameter.
+        /structure: (K x 3) first point offset, section type, and parent section of each section;
+            section 0 is the soma (its points are the soma surface points), with parent -1.
+    Skeletonizer specific data is kept apart, in the /skeletonizer group (ignored by other readers).
+"""
+
+import os
+import logging
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from skeletonizer.array_morphology import ArrayMorphology
+
+
+#
+# H5MorphologyWriter class
+#
+
+class H5MorphologyWriter(object):
+    """Writes ArrayMorphology objects to BBP HDF5 morphology files (requires h5py)."""
+
+    k_FLOAT_TYPES = {32: np.float32, 64: np.float64}
+    k_DEFAULT_CHUNK_ROWS = 1 << 14
+
+    def __init__(self, precision = 32, compression = 4, chunk_rows = None):
+        """
+        :param precision: float precision of the points, in bits: 32 or 64.
+        :param compression: gzip compression level (1-9), or 0 for none.
+        :param chunk_rows: rows per chunk of the datasets; None to chunk (k_DEFAULT_CHUNK_ROWS) only if compressed,
+                           0 for contiguous (uncompressed) datasets.
+        """
+        assert(precision in self.k_FLOAT_TYPES), \
+            "Expected float precision of %s bits, found %s" % (' or '.join(map(str, sorted(self.k_FLOAT_TYPES))), precision)
+        assert(0 <= compression <= 9), "Expected gzip compression level 0-9, found %s" % compression
+        assert(compression == 0 or chunk_rows != 0), "Compressed datasets must be chunked"
+
+        self.precision = precision
+        self.compression = compression
+        self.chunk_rows = chunk_rows if chunk_rows is not None else (self.k_DEFAULT_CHUNK_ROWS if compression else 0)
+
+    def arrays(self, amorph):
+        """
+        Returns the (points, structure, cut_sections) arrays of the file layout of a morphology.
+        :param amorph: ArrayMorphology object.
+        """
+        soma_points = amorph.soma_points
+        # the soma section requires a point; a non-inflated soma is a zero sized point at the origin
+        nsoma = max(1, len(soma_points))
+
+        points = np.zeros((nsoma + len(amorph.points), 4), dtype=self.k_FLOAT_TYPES[self.precision])
+        points[0:len(soma_points), 0:3] = soma_points
+        points[nsoma:] = amorph.points
+
+        sections = amorph.sections
+        structure = np.empty((len(sections) + 1, 3), dtype=np.int32)
+        structure[0] = (0, ArrayMorphology.k_SECTION_SOMA, -1)
+        structure[1:, 0] = sections[:, ArrayMorphology.k_OFFSET] + nsoma
+        structure[1:, 1] = sections[:, ArrayMorphology.k_TYPE]
+        # soma (k_SOMA) becomes section 0, section i becomes section i + 1
+        structure[1:, 2] = sections[:, ArrayMorphology.k_PARENT] + 1
+
+        cut_sections = (np.flatnonzero(amorph.cut_points) + 1).astype(np.int32)
+        return points, structure, cut_sections
+
+    def create_dataset(self, group, name, data):
+        kwargs = {}
+        if self.chunk_rows and len(data):
+            kwargs['chunks'] = (min(self.chunk_rows, len(data)),) + data.shape[1:]
+            if self.compression:
+                kwargs['compression'] = 'gzip'
+                kwargs['compression_opts'] = self.compression
+                kwargs['shuffle'] = True
+        return group.create_dataset(name, data=data, **kwargs)
+
+    def write(self, f, amorph):
+        """
+        :param f: h5py File object, opened for writing.
+        :param amorph: ArrayMorphology object.
+        """
+        points, structure, cut_sections = self.arrays(amorph)
+        self.create_dataset(f, 'points', points)
+        self.create_dataset(f, 'structure', structure)
+
+        group = f.create_group('skeletonizer')
+        group.attrs['soma_point_count'] = len(amorph.soma_points)
+        group.create_dataset('cut_sections', data=cut_sections)
+
+    def save(self, h5_file, amorph):
+        """
+        Writes a morphology file (atomically, so readers never see a partial file).
+        :param h5_file: HDF5 file path.
+        :param amorph: ArrayMorphology object.
+        """
+        assert(h5py is not None), "h5py is required to write HDF5 morphology files"
+
+        tmp_path = '%s.%i.tmp' % (h5_file, os.getpid())
+        try:
+            with h5py.File(tmp_path, 'w') as f:
+                self.write(f, amorph)
+            os.rename(tmp_path, h5_file)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        logging.info('Wrote %i sections, %i points: %s', len(amorph) + 1, len(amorph.points), h5_file)
+
+
+#
+# H5MorphologyReader class
+#
+
+class H5MorphologyReader(object):
+    """Reads BBP HDF5 morphology files (requires h5py), e.g., to verify written files."""
+
+    def read(self, h5_file):
+        """
+        :param h5_file: HDF5 file path.
+        :return: ArrayMorphology object.
+        """
+        assert(h5py is not None), "h5py is required to read HDF5 morphology files"
+
+        with h5py.File(h5_file, 'r') as f:
+            return self.parse(f)
+
+    def parse(self, f):
+        """
+        :param f: h5py File object.
+        :return: ArrayMorphology object.
+        """
+        points = np.asarray(f['points'], dtype=np.float64).reshape(-1, 4)
+        structure = np.asarray(f['structure'], dtype=np.int64).reshape(-1, 3)
+        assert(len(structure) and structure[0, 1] == ArrayMorphology.k_SECTION_SOMA), \
+            "Expected the soma as the first section"
+
+        nsoma = structure[1, 0] if len(structure) > 1 else len(points)
+        soma_points = points[0:nsoma, 0:3]
+        cut_points = np.zeros(len(structure) - 1, dtype=bool)
+        if 'skeletonizer' in f:
+            group = f['skeletonizer']
+            soma_points = soma_points[0:int(group.attrs['soma_point_count'])]
+            cut_points[np.asarray(group['cut_sections'], dtype=np.int64) - 1] = True
+
+        sections = np.column_stack((structure[1:, 2] - 1, structure[1:, 1], structure[1:, 0] - nsoma))
+        return ArrayMorphology(sections, points[nsoma:], soma_points, cut_points)
@@ -11,6 +11,8 @@
 import math
 import operator
 
+import numpy as np
+
 
 def vlogger(func):
     def inner(*args, **kwargs):
@@ -96,11 +98,10 @@ def inside_aabb(aabb, v):
     :param v: position vector.
     :return: True if v is inside, False otherwise.
     """
-    inside_min = all(map(lambda (aabbn, vn): aabbn < vn, zip(aabb[0], v)))
-    inside_max = all(map(lambda (aabbn, vn): aabbn > vn, zip(aabb[1], v)))
+    inside_min = all(aabbn < vn for aabbn, vn in zip(aabb[0], v))
+    inside_max = all(aabbn > vn for aabbn, vn in zip(aabb[1], v))
     return inside_min and inside_max
 
-
 #@vlogger
 def vadjust_offset_length3(v, centre, min_length):
     """
@@ -110,5 +111,162 @@ def vadjust_offset_length3(v, centre, min_length):
     m = vlength(nv)
     return nv if m > min_length else vmuls3(vnormalize_zero3(nv), min_length)
 
+def swizzle3(v, swizzle):
+    """
+    Reorders and negates the coordinates of a position.
+    :param v: position vector.
+    :param swizzle: pair of (axes, signs), e.g., k_AVIZO_BLENDER_SWIZZLE.
+    :return: (v[axes[0]]*signs[0], v[axes[1]]*signs[1], v[axes[2]]*signs[2])
+    """
+    axes, signs = swizzle
+    return (v[axes[0]]*signs[0], v[axes[1]]*signs[1], v[axes[2]]*signs[2])
+
+# XYZ coordinates in Avizo become -XZY in Blender, and visa-versa
+k_AVIZO_BLENDER_SWIZZLE = ((0, 2, 1), (-1, 1, 1))
+
+#
+# Batch (N x 3) array counterparts of the 3-tuple functions above; inputs broadcast as numpy arrays
+#
+
+def varray3(v):
+    """ Returns v as a float64 array of 3-vectors (a single vector becomes a 1 x 3 array)"""
+    v = np.asarray(v, dtype=np.float64)
+    return v.reshape(-1, 3) if v.ndim < 2 else v
+
+def distance_squared_array(v1, v2):
+    """
+    :param v1: (N x 3) array of positions.
+    :param v2: (N x 3) array of positions, or a single position.
+    :return: (N) array of squared distances, as distance_squared.
+    """
+    return vlength_squared_array(vsub_array(v1, v2))
+
+def distance_array(v1, v2):
+    return np.sqrt(distance_squared_array(v1, v2))
+
+def pairwise_distance_squared_array(v1, v2):
+    """
+    :param v1: (N x 3) array of positions.
+    :param v2: (M x 3) array of positions.
+    :return: (N x M) array of squared distances between each v1 and each v2 position.
+    """
+    return distance_squared_array(varray3(v1)[:, np.newaxis, :], varray3(v2)[np.newaxis, :, :])
+
+def pairwise_distance_array(v1, v2):
+    return np.sqrt(pairwise_distance_squared_array(v1, v2))
+
+
+def vlength_squared_array(v):
+    v = varray3(v)
+    return v[..., 0] * v[..., 0] + v[..., 1] * v[..., 1] + v[..., 2] * v[..., 2]
+
+def vlength_array(v):
+    """
+    :param v: (N x 3) array of vectors.
+    :return: (N) array of vector lengths, as vlength.
+    """
+    return np.sqrt(vlength_squared_array(v))
+
+def vsub_array(v1, v2):
+    """ Returns the (N x 3) array of offsets v1 - v2, e.g., of positions v1 from a centre v2"""
+    return varray3(v1) - np.asarray(v2, dtype=np.float64)
+
+def vadd_array(v1, v2):
+    return varray3(v1) + np.asarray(v2, dtype=np.float64)
+
+
+def vnormalize_array(v):
+    v = varray3(v)
+    m = vlength_array(v)
+    assert(np.all(m != 0)), "Unable to normalize zero length vectors"
+    return v / m[..., np.newaxis]
+
+def vnormalize_zero_array(v):
+    """
+    :param v: (N x 3) array of vectors.
+    :return: (N x 3) array of unit vectors; zero length vectors are unchanged, as vnormalize_zero3.
+    """
+    v = varray3(v)
+    m = vlength_array(v)[..., np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(m != 0, v / m, v)
+
+
+def inside_aabb_array(aabb, v):
+    """
+    Tests if points are inside the AABB.
+    :param aabb: The AABB (Axis Aligned Bounding Box).
+    :param v: (N x 3) array of position vectors.
+    :return: (N) boolean array, True where v is inside, as inside_aabb.
+    """
+    v = varray3(v)
+    return np.all(v > np.asarray(aabb[0], dtype=np.float64), axis=-1) & \
+           np.all(v < np.asarray(aabb[1], dtype=np.float64), axis=-1)
+
+def vadjust_offset_length_array(v, centre, min_length):
+    """
+    Returns the (N x 3) array of vectors offset as if centre point was moved to zero; and, at least as long as
+    min_length (a scalar, or (N) array), as vadjust_offset_length3.
+    """
+    nv = vsub_array(v, centre)
+    m = vlength_array(nv)
+    min_length = np.asarray(min_length, dtype=np.float64)[..., np.newaxis]
+    return np.where((m[..., np.newaxis] > min_length), nv, vnormalize_zero_array(nv) * min_length)
+
+
+#
+# CoordinateTransform class
+#
+
+class CoordinateTransform(object):
+    """Maps source (e.g., Avizo) positions to output (e.g., BBPSDK morphology) positions as one operation:
+        offset from centre (clamped to at least min_length from it, e.g., onto the soma surface), swizzle, scale.
+
+    Apply it once to whole (N x 3) arrays of node and point positions; inverse maps output positions
+    back to source positions, for reporting (clamped positions map back to the clamped source positions).
+    """
+
+    def __init__(self, centre = (0.0, 0.0, 0.0), scale = 1.0, swizzle = None):
+        """
+        :param centre: source position which becomes the origin (e.g., the soma centre).
+        :param scale: scaling factor applied to the offset positions.
+        :param swizzle: Optional, pair of (axes, signs) reordering the coordinates, e.g., k_AVIZO_BLENDER_SWIZZLE.
+        """
+        self.centre = tuple(float(c) for c in centre)
+        self.scale = scale
+        self.axes, self.signs = swizzle if swizzle else ((0, 1, 2), (1, 1, 1))
+        self.axes = list(self.axes)
+        self.inverse_axes = np.argsort(self.axes).tolist()
+
+    def is_swizzled(self):
+        return self.axes != [0, 1, 2] or any(s != 1 for s in self.signs)
+
+    def swizzle(self, v):
+        v = varray3(v)
+        return v[..., self.axes] * np.asarray(self.signs, dtype=np.float64) if self.is_swizzled() else v
+
+    def offset(self, v, min_length = 0):
+        """
+        :param v: (N x 3) array of source positions.
+        :param min_length: minimum distance from centre (a scalar, or (N) array), as vadjust_offset_length3.
+        :return: (N x 3) array of swizzled offset positions, in (unscaled) source units.
+        """
+        return self.swizzle(vadjust_offset_length_array(v, self.centre, min_length))
 
+    def apply(self, v, min_length = 0):
+        """
+        :param v: (N x 3) array of source positions.
+        :param min_length: minimum distance from centre (a scalar, or (N) array), in source units.
+        :return: (N x 3) array of output positions.
+        """
+        return self.offset(v, min_length) * self.scale
 
+    def inverse(self, v):
+        """
+        :param v: (N x 3) array of output positions.
+        :return: (N x 3) array of the source positions they were transformed from.
+        """
+        v = varray3(v) / self.scale
+        if self.is_swizzled():
+            v = (v * np.asarray(self.signs, dtype=np.float64))[..., self.inverse_axes]
+        return v + self.centre
@@ -19,16 +19,76 @@ import logging
 import operator
 from collections import defaultdict
 
+import numpy as np
+
 try:
     import skeletonizer
 except ImportError:
     sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(os.path.split(__file__)[0]))))
 
-from skeletonizer.bbp_import_module import *
+try:
+    from skeletonizer.bbp_import_module import *
+except ImportError:
+    # BBPSDK is only required to create BBPSDK morphologies (see create_bbp_morphology)
+    Morphology = None
+
+from skeletonizer.amiramesh import *
+from skeletonizer.cache import *
 from skeletonizer.maths import *
 from skeletonizer.graphs import *
+from skeletonizer.cross_section import *
+from skeletonizer.simplify import *
+from skeletonizer.array_morphology import *
+from skeletonizer.hdf5 import *
+from skeletonizer.swc import *
+from skeletonizer.profiling import *
+
+class MorphologyOptionsError(Exception):
+    """Invalid morphology creation options, e.g., missing input files; exit_code is the command line exit code."""
+
+    def __init__(self, message, exit_code = 2):
+        super(MorphologyOptionsError, self).__init__(message)
+        self.exit_code = exit_code
+
+
+def parse_option_value(opt, arg, parse = float):
+    """
+    Converts a command line option argument, raising MorphologyOptionsError (exit code 2) if it is invalid.
+    :param opt: getopt option, e.g., '-t'.
+    :param arg: getopt option argument.
+    :param parse: conversion of the argument, e.g., float or int.
+    :return: converted argument.
+    """
+    try:
+        return parse(arg)
+    except ValueError:
+        raise MorphologyOptionsError('Expected %s %s value, found: %s' % (opt, parse.__name__, arg), 2)
+
 
 class MorphologyCreateOptions:
+    # command line options shared by the skeletonize scripts (see set_option), as getopt short and long options
+    k_SHORT_OPTIONS = "aifno:t:v:x:"
+    k_LONG_OPTIONS = ["output_dir=", "verbose=", "threshold=", "scale=", "no_cache", "cache_dir=", "cache_size=",
+                      "simplify=", "writer=", "precision=", "compression="]
+    k_OPTIONS_HELP = [
+        '\t -a \t\t Allow cycles in skeleton graph (default False)',
+        '\t -i \t\t Ignore optional secondary input files (e.g., *.cross-section.csv)',
+        '\t -n \t\t Do not use the parsed skeleton cache (--no_cache)',
+        '\t -o <dirname>\t Output directory',
+        '\t -t <threshold>\t Set minimum segment arc length (default 0)',
+        '\t -v <level>\t Set verbosity level: %i-%i' % (logging.NOTSET, logging.FATAL),
+        '\t -x <scale>\t Set skeleton scaling factor to resize output skeleton',
+        '\t --cache_dir <dirname>\t Parsed skeleton cache directory (default $SKELETONIZER_CACHE_DIR or ~/.cache/skeletonizer)',
+        '\t --cache_size <MB>\t Maximum size of the parsed skeleton cache (default 1024)',
+        '\t --simplify <method>:<value>\t Simplify segments before growth, with method:',
+        '\t\t spacing:<length> \t drop points closer than length (arc-length) to the previous point',
+        '\t\t uniform:<length> \t resample at uniform intervals of at most length',
+        '\t\t dp:<tolerance> \t Douglas-Peucker, tolerance as a multiple of the local diameter',
+        '\t --writer <bbp|h5py|swc>\t Morphology file writer: BBPSDK, native HDF5 writer, or SWC (*.swc file) (default bbp)',
+        '\t --precision <32|64>\t h5py writer float precision in bits (default 32)',
+        '\t --compression <0-9>\t h5py writer gzip compression level; 0 for none (default 4)',
+    ]
+
     force_overwrite = False
     skel_path = "."
     skel_name = None
@@ -46,6 +106,17 @@ class MorphologyCreateOptions:
     scaling_factor = 1
     allow_cycles = False
     graph_depth = -1
+    simplify_method = None
+    simplify_value = 0
+
+    use_cache = True
+    cache_dir = None
+    cache_max_bytes = 1 << 30
+
+    morphology_writer = 'bbp'
+    h5_precision = 32
+    h5_compression = 4
+    h5_chunk_rows = None
 
     stack_AABB = None
     xsection_dict = None
@@ -67,7 +138,8 @@ class MorphologyCreateOptions:
         self.skel_am_file = os.path.join(self.skel_path, self.skel_name + '.am')
         self.skel_json_file = os.path.join(self.skel_path, self.skel_name + '.annotations.json')
         self.skel_csv_file = os.path.join(self.skel_path, self.skel_name + '.cross_section.csv')
-        self.skel_out_file = os.path.join(self.skel_out_path, self.skel_name + '.h5')
+        self.skel_out_file = os.path.join(self.skel_out_path, self.skel_name +
+                                          ('.swc' if self.morphology_writer == 'swc' else '.h5'))
 
     def set_annotation_data(self, data):
         if 'skeletonize' in data:
@@ -99,55 +171,182 @@ class MorphologyCreateOptions:
                              self.threshold_segment_length)
 
     def set_xsection_data(self, data):
-        assert (type(data) == dict), "Expected xsection dictionary object"
+        assert (type(data) == dict or isinstance(data, CrossSectionData)), \
+                "Expected xsection dictionary or CrossSectionData object"
         self.xsection_dict = data
         logging.info("Set cross-section data. Found %i entries.", len(self.xsection_dict))
 
-    #TODO: throw exception instead of sys.exit (client should sys.exit)
     def validate(self):
+        """ Raises MorphologyOptionsError if the input files are missing, or the output file exists (unless forced)"""
         if not self.skel_name:
-            logging.error('ERROR - Missing skeleton name.')
-            sys.exit(2)
+            raise MorphologyOptionsError('Missing skeleton name.', 2)
         if not os.path.exists(self.skel_am_file):
-            logging.error('ERROR - Missing source file: %s', self.skel_am_file)
-            sys.exit(2)
+            raise MorphologyOptionsError('Missing source file: %s' % self.skel_am_file, 2)
         if not os.path.exists(self.skel_json_file):
-            logging.error('ERROR - Missing annotation file: %s', self.skel_json_file)
-            sys.exit(3)
+            raise MorphologyOptionsError('Missing annotation file: %s' % self.skel_json_file, 3)
         if not self.ignore_optional_input_files and not os.path.exists(self.skel_csv_file):
-            logging.error('ERROR - Missing cross_section file: %s', self.skel_csv_file)
-            sys.exit(3)
+            raise MorphologyOptionsError('Missing cross_section file: %s' % self.skel_csv_file, 3)
         if not self.force_overwrite and os.path.exists(self.skel_out_file):
-            logging.error('ERROR - Existing output file (requires force overwrite): %s', self.skel_out_file)
-            sys.exit(4)
+            raise MorphologyOptionsError('Existing output file (requires force overwrite): %s' % self.skel_out_file, 4)
+
+    def set_option(self, opt, arg):
+        """
+        Sets a command line option shared by the skeletonize scripts (see k_SHORT_OPTIONS and k_LONG_OPTIONS).
+        Raises MorphologyOptionsError if the option argument is invalid.
+        :param opt: getopt option, e.g., '-t' or '--threshold'.
+        :param arg: getopt option argument.
+        :return: True if opt is a shared option; False otherwise.
+        """
+        if opt == '-a':
+            self.allow_cycles = True
+            logging.info("Allow Cycles set to: %s", self.allow_cycles)
+        elif opt == '-i':
+            self.ignore_optional_input_files = True
+        elif opt == '-f':
+            self.force_overwrite = True
+        elif opt in ('-n', '--no_cache'):
+            self.use_cache = False
+        elif opt == '--cache_dir':
+            self.cache_dir = arg
+        elif opt == '--cache_size':
+            self.cache_max_bytes = int(parse_option_value(opt, arg) * (1 << 20))
+        elif opt == '--simplify':
+            method, _, value = arg.partition(':')
+            if method not in k_SIMPLIFY_METHODS or not value:
+                raise MorphologyOptionsError('Expected --simplify <method>:<value>, with method one of: %s' %
+                                             ', '.join(sorted(k_SIMPLIFY_METHODS)), 2)
+            self.simplify_method = method
+            self.simplify_value = parse_option_value(opt, value)
+        elif opt == '--writer':
+            if arg not in ('bbp', 'h5py', 'swc'):
+                raise MorphologyOptionsError('Expected --writer bbp, h5py or swc, found: %s' % arg, 2)
+            self.morphology_writer = arg
+        elif opt == '--precision':
+            precisions = sorted(H5MorphologyWriter.k_FLOAT_TYPES)
+            if arg not in map(str, precisions):
+                raise MorphologyOptionsError('Expected --precision %s, found: %s' %
+                                             (' or '.join(map(str, precisions)), arg), 2)
+            self.h5_precision = int(arg)
+        elif opt == '--compression':
+            if arg not in map(str, range(10)):
+                raise MorphologyOptionsError('Expected --compression 0-9, found: %s' % arg, 2)
+            self.h5_compression = int(arg)
+        elif opt in ("-o", "--output_dir"):
+            if (not os.path.isdir(arg)):
+                raise MorphologyOptionsError('Output directory must be directory:%s' % arg, 4)
+            self.skel_out_path = os.path.abspath(arg)
+        elif opt in ('-t', "--threshold"):
+            self.force_segment_threshold = True
+            self.threshold_segment_length = parse_option_value(opt, arg)
+            logging.info("Segment length threshold set to: %f", self.threshold_segment_length)
+        elif opt in ('-v', "--verbose"):
+            self.verbosity_level = parse_option_value(opt, arg, int)
+            logging.getLogger().setLevel(self.verbosity_level)
+            logging.info("Verbosity set to: %i", self.verbosity_level)
+        elif opt in ('-x', "--scale"):
+            self.scaling_factor = parse_option_value(opt, arg)
+            logging.info("Morphology scaling factor set to: %f", self.scaling_factor)
+        else:
+            return False
+        return True
+
+
+#
+# MorphologyContext class
+#
+
+class MorphologyContext(object):
+    """Per-run state of a morphology creation: the growth options derived from the create options, the transformed
+    skeleton point arrays, and the run statistics.  Each run creates its own context, which is passed through the
+    graph and growth functions, so concurrent (or successive) runs in one process share no state.
+    """
+
+    def __init__(self, skel, soma_centre, soma_radius, options):
+        """
+        :param skel: ArraySkeleton.
+        :param soma_centre: soma centre, in source coordinates.
+        :param soma_radius: soma radius, in source units.
+        :param options: MorphologyCreateOptions object (or struct of create morphology options).
+        """
+        self.soma_centre = soma_centre
+        self.soma_radius = soma_radius
+
+        # boolean set True to allow cyclic graphs, False forces acyclic graph.
+        self.k_ALLOW_CYCLES = options.allow_cycles                                      # Default: False
+        # boolean set True to allow soma nodes to connect to each other, False makes them root nodes.
+        self.k_CONNECT_SOMA_SOMA = options.verbosity_level <= logging.NOTSET            # Default: False
+
+        # float specifies minimum length between segment arcs (inter-node section edges)
+        self.k_SEGMENT_THRESHOLD_SQR = options.threshold_segment_length                 # Default: 0
+        # boolean set True to start segments after they leave the soma
+        self.k_CLIP_INSIDE_SOMA = options.verbosity_level > logging.NOTSET              # Default: True
+
+        # boolean set True to create normal BBPSDK soma node; False creates zero sized node for debugging
+        self.k_INFLATE_SOMA = options.verbosity_level > logging.NOTSET                  # Default: True
+
+        # float specifies morphology scaling factor
+        self.k_SCALING_FACTOR = options.scaling_factor                                  # Default: 1
+
+        # integer debugging growth limit (max node count); -1 if unlimited
+        self.k_GRAPH_DEPTH = options.graph_depth                                        # Default: -1
 
+        self.k_CUTPOINT_AABB = options.stack_AABB                                       # Default: None
+        # (P) boolean array, True where the skeleton point is outside k_CUTPOINT_AABB; None if no AABB
+        self.k_CUTPOINT_MASK = cut_point_mask(skel.points[:, 0:3], options.stack_AABB)
 
-def debug_soma(soma, radius):
+        # source to morphology coordinate transform (offset to centre the soma at the origin, then scale),
+        # applied once to all skeleton points: (P x 3) morphology positions of the points, and (P) diameters
+        self.k_TRANSFORM = CoordinateTransform(soma_centre, options.scaling_factor)
+        self.k_POINT_POSITIONS = self.k_TRANSFORM.apply(skel.points[:, 0:3])
+        self.k_POINT_DIAMETERS = skel.points[:, 3] * options.scaling_factor
+
+        # segment end points (the nodes) are also clamped onto (or just inside) the soma surface, as end nodes and
+        # soma nodes: (E) sorted point indices of the end points, and their (E x 3) clamped morphology positions
+        self.k_END_POINTS = np.unique(np.concatenate((skel.segment_offsets[:-1], skel.segment_offsets[1:] - 1)))
+        end_positions = skel.points[self.k_END_POINTS, 0:3]
+        self.k_NODE_POSITIONS = self.k_TRANSFORM.apply(end_positions,
+                                                       np.maximum(0, soma_radius - skel.points[self.k_END_POINTS, 3]))
+        self.k_SOMA_POSITIONS = self.k_TRANSFORM.apply(end_positions, soma_radius)
+
+        self.stats = GrowStatistics()
+
+    def node_position(self, pidx):
+        """ Returns the morphology position of a segment end point, as an end node"""
+        return tuple(self.k_NODE_POSITIONS[np.searchsorted(self.k_END_POINTS, pidx)].tolist())
+
+    def soma_position(self, pidx):
+        """ Returns the morphology position of a segment end point, as a soma node"""
+        return tuple(self.k_SOMA_POSITIONS[np.searchsorted(self.k_END_POINTS, pidx)].tolist())
+
+
+def debug_soma(morphology, radius):
     """
     Grows fake soma nodes to outline soma visually.  Invoke prior to adding soma points.
     Assumes centre is (0,0,0)
-    :param soma: BBPSDK Soma object
+    :param morphology: ArrayMorphology object
     :param radius: Soma radius
     """
 
     k_POINTS = 25
+    soma = ArrayMorphology.k_SOMA
+    dendrite = ArrayMorphology.k_SECTION_DENDRITE
 
     # axis
-    n = soma.grow(radius*2, 0, 0, 0.1, Section_Type.DENDRITE)
-    n = soma.grow(0,radius*2, 0, 0.1, Section_Type.DENDRITE)
-    n.grow(1, radius*2, 0, 0.1, Section_Type.DENDRITE)
-    n = soma.grow(0,0,radius*2, 0.1, Section_Type.DENDRITE)
-    n.grow(0, 1, radius*2, 0.1, Section_Type.DENDRITE)
-    n.grow(1, 0, radius*2, 0.1, Section_Type.DENDRITE)
+    n = morphology.add_section(soma, (radius*2, 0, 0), 0.1, dendrite)
+    n = morphology.add_section(soma, (0,radius*2, 0), 0.1, dendrite)
+    morphology.add_section(n, (1, radius*2, 0), 0.1, dendrite)
+    n = morphology.add_section(soma, (0,0,radius*2), 0.1, dendrite)
+    morphology.add_section(n, (0, 1, radius*2), 0.1, dendrite)
+    morphology.add_section(n, (1, 0, radius*2), 0.1, dendrite)
 
     # exterior
     for a in range(0,k_POINTS):
         ang = a * (360.0 / k_POINTS)
         i = math.sin(ang) * radius
         j = math.cos(ang) * radius
-        n = soma.grow(i,j,0, 0.1, Section_Type.DENDRITE)
-        n = soma.grow(i,0,j, 0.1, Section_Type.DENDRITE)
-        n = soma.grow(0,i,j, 0.1, Section_Type.DENDRITE)
+        n = morphology.add_section(soma, (i,j,0), 0.1, dendrite)
+        n = morphology.add_section(soma, (i,0,j), 0.1, dendrite)
+        n = morphology.add_section(soma, (0,i,j), 0.1, dendrite)
 
 def debug_scale_cut_point_diameter(scaled_diameter, scale):
     """
@@ -159,27 +358,25 @@ def debug_scale_cut_point_diameter(scaled_diameter, scale):
     return max(2 * scale, scaled_diameter * 5)
 
 
-def grow_soma(soma, somanodes, nodesegments, nodes, offsets, options, stats):
+def grow_soma(morphology, somanodes, nodesegments, nodes, context):
     """
     Grows the soma nodes.
-    :param soma: BBPSDK Soma object.
+    :param morphology: ArrayMorphology object.
     :param somanodes: list of soma node-ids.
     :param nodesegments: dictionary mapping start node-ids to the segments which grow from them.
-    :param nodes: dictionary mapping node positions to BBPSDK section.
-    :param offsets: tuple of (soma_centre, soma_radius).
-    :param options: struct of growth options.
-    :param stats: statistic collection object
+    :param nodes: dictionary mapping node positions to ArrayMorphology section index (or ArrayMorphology.k_SOMA).
+    :param context: MorphologyContext of the run.
     """
 
-    # NOTE: we offset the original graph to centre the soma at origin in BBPSDK morphology, but preserve
+    # NOTE: we offset the original graph to centre the soma at origin in the morphology, but preserve
     # the original positions to make it easier to report original graph positions to user
-    scentre, sradius = offsets
-    scale = options.k_SCALING_FACTOR
-    soma_spoints = soma.surface_points()
+    sradius = context.soma_radius
+    scale = context.k_SCALING_FACTOR
+    soma = ArrayMorphology.k_SOMA
 
     # visual debug support
     if logging.getLogger().getEffectiveLevel() <= logging.DEBUG:
-        debug_soma(soma, sradius * scale)
+        debug_soma(morphology, sradius * scale)
 
     # initialize soma and nodes
     for snode_idx in somanodes:
@@ -189,61 +386,81 @@ def grow_soma(soma, somanodes, nodesegments, nodes, offsets, options, stats):
 
             ndata = segm.points[0]
             npos = ndata.position()
-            snpos = vadjust_offset_length3(npos, scentre, sradius)
+            spos = context.soma_position(ndata.index)
 
-            if options.k_INFLATE_SOMA:
-                spos = vmuls3(snpos, scale)
-                sdiameter = ndata.diameter * scale
-                soma_spoints.insert(Vector3f(spos[0], spos[1], spos[2]))
+            if context.k_INFLATE_SOMA:
+                morphology.add_soma_point(spos)
                 nodes[npos] = soma
             else:
                 if logging.getLogger().getEffectiveLevel() < logging.DEBUG:
-                    snpos = vadjust_offset_length3(npos, scentre, 0)
-                spos = vmuls3(snpos, scale)
-                sdiameter = ndata.diameter * scale
-                node = soma.grow(spos[0], spos[1], spos[2], sdiameter, Section_Type.DENDRITE)
-                stats.node_grow_stats[soma].append(snpos)
-                node.move_point(0, Vector3f(spos[0], spos[1], spos[2]))
+                    spos = tuple(context.k_POINT_POSITIONS[ndata.index].tolist())
+                sdiameter = context.k_POINT_DIAMETERS[ndata.index]
+                node = morphology.add_section(soma, spos, sdiameter, ArrayMorphology.k_SECTION_DENDRITE)
+                context.stats.node_grow_stats[soma].append(spos)
                 nodes[npos] = node
 
             logging.debug('Root Node: %s', segm.start)
 
     # debug support
-    logging.info("Soma created: radius (mean, max): (%s, %s)",
-                    soma.mean_radius(), soma.max_radius())
+    logging.info("Soma created: radius (mean, max): (%s, %s)", *morphology.soma_radius())
 
 
 def grow_segments(pnode_idx, dagnodes, nodesegments, nodes, visited,
-                  morphology, offsets, options, stats, depth = -1):
+                  morphology, context, depth = -1):
     """
-    Grows the node to node segments.
+    Grows the node to node segments, depth-first from the parent node.
+    Uses an explicit stack (not recursion), so deep branches are not limited by the recursion limit;
+    nodes are grown in the same order as a recursive, pre-order traversal of the directed graph.
     :param pnode_idx: node-id of parent node.
     :param dagnodes: directed edge dictionary mapping node-id to list of node-ids.
     :param nodesegments: dictionary mapping start node-ids to the segments which grow from them.
-    :param nodes: dictionary mapping node positions to BBPSDK section.
-    :param visited: node-ids of already visited nodes.
-    :param morphology: BBPSDK Morphology object.
-    :param offsets: tuple of (soma_centre, soma_radius).
-    :param options: struct of growth options.
-    :param stats: statistic collection object
+    :param nodes: dictionary mapping node positions to ArrayMorphology section index (or ArrayMorphology.k_SOMA).
+    :param visited: set of node-ids of already visited nodes.
+    :param morphology: ArrayMorphology object.
+    :param context: MorphologyContext of the run.
     :param depth: debugging: controls growth size; if non-negative specifies max node count; -1 if unlimited
     """
-    if (depth == 0):
-        stats.warn_counts[stats.k_WARN_MAX_GROW_DEPTH_REACHED] += 1
-        logging.debug("WARNING - max depth reached for node: %i", pnode_idx)
-        return
+    stats = context.stats
+    stack = [(pnode_idx, depth)]
+    while stack:
+        pnode_idx, depth = stack.pop()
+
+        if (depth == 0):
+            stats.warn_counts[stats.k_WARN_MAX_GROW_DEPTH_REACHED] += 1
+            logging.debug("WARNING - max depth reached for node: %i", pnode_idx)
+            continue
 
-    if (pnode_idx in visited):
-        return
+        if (pnode_idx in visited):
+            continue
 
-    # NOTE: we offset the original graph to centre the soma at origin in BBPSDK morphology, but preserve
-    # the original positions to make it easier to report original graph positions to user
-    scentre, sradius = offsets
-    scale = options.k_SCALING_FACTOR
+        visited.add(pnode_idx)
 
-    logging.debug('Growing:%s', str(pnode_idx))
+        is_parent_cut = grow_node_segments(pnode_idx, nodesegments, nodes, morphology, context)
+        if is_parent_cut:
+            continue
+
+        # grow children, in order
+        child_depth = depth - 1 if depth > 0 else -1
+        stack.extend((cn_idx, child_depth) for cn_idx in reversed(list(dagnodes[pnode_idx])))
 
-    visited.append(pnode_idx)
+
+def grow_node_segments(pnode_idx, nodesegments, nodes, morphology, context):
+    """
+    Grows the segments of one node.
+    :param pnode_idx: node-id of parent node.
+    :param nodesegments: dictionary mapping start node-ids to the segments which grow from them.
+    :param nodes: dictionary mapping node positions to ArrayMorphology section index (or ArrayMorphology.k_SOMA).
+    :param morphology: ArrayMorphology object.
+    :param context: MorphologyContext of the run.
+    :return: True if the parent node is a cut-point (its children are not grown); False otherwise.
+    """
+    # NOTE: growth uses the transformed (morphology) positions of the context, in morphology units; the original
+    # positions are preserved, to make it easier to report original graph positions to user
+    sradius = context.soma_radius * context.k_SCALING_FACTOR
+    scale = context.k_SCALING_FACTOR
+    stats = context.stats
+
+    logging.debug('Growing:%s', str(pnode_idx))
 
     is_parent_cut = False
 
@@ -255,6 +472,15 @@ def grow_segments(pnode_idx, dagnodes, nodesegments, nodes, visited,
         if len(segm.points) < 2:
             continue
 
+        # morphology positions, diameters and cut-point flags of the segment points, from the precomputed arrays
+        pidxs = segm.points.indices()
+        positions = context.k_POINT_POSITIONS[pidxs]
+        diameters = context.k_POINT_DIAMETERS[pidxs]
+        if context.k_CUTPOINT_MASK is not None:
+            cut_flags = context.k_CUTPOINT_MASK[pidxs]
+        else:
+            cut_flags = np.zeros(len(pidxs), dtype=bool)
+
         # ndata is the parent node data (first in the segment); spt is the first section
         ndata = segm.points[0]
         npos = ndata.position()
@@ -265,193 +491,232 @@ def grow_segments(pnode_idx, dagnodes, nodesegments, nodes, visited,
         assert(npos in nodes), 'Missing start node - id: %i, npos: %s' % (segm.start, npos)
         node = nodes[npos]
 
-        is_parent_cut = is_parent_cut or is_cut_point(npos, options.k_CUTPOINT_AABB)
+        is_parent_cut = is_parent_cut or bool(cut_flags[0])
         if is_parent_cut:
             logging.debug('Cut node reached at node:%s position:%s', str(segm.start), npos)
             break
 
-        is_cut = is_parent_cut
-
-        # grow initial sections; first and last points belong to the start and end nodes
-        # growth begins when segment exits soma
-        section = None
-        for pt in segm.points[1:-1]:
-            pos_orig = pt.position()
-            pos = vadjust_offset_length3(pos_orig, scentre, 0)
+        # grow initial section from the interior points; first and last points belong to the start and end nodes
+        # growth begins when segment exits soma, and ends at the first cut-point
+        cuts = np.flatnonzero(cut_flags[1:-1])
+        is_cut = len(cuts) > 0
+        last = cuts[0] + 1 if is_cut else len(pidxs) - 2
 
-            spos = vmuls3(pos, scale)
-            sdiameter = pt.diameter * scale
+        grow_idxs = np.arange(1, last + 1)
+        if context.k_CLIP_INSIDE_SOMA:
+            outside = vlength_array(positions[grow_idxs]) > sradius + diameters[grow_idxs]
+            grow_idxs = grow_idxs[np.argmax(outside):] if outside.any() else grow_idxs[:0]
 
-            is_cut = is_cut or is_cut_point(pos_orig, options.k_CUTPOINT_AABB)
+        section = None
+        if len(grow_idxs):
+            spoints = np.column_stack((positions[grow_idxs], diameters[grow_idxs]))
 
             # visual debug support
             if is_cut and logging.getLogger().getEffectiveLevel() <= logging.DEBUG:
-                sdiameter = debug_scale_cut_point_diameter(sdiameter, scale)
+                spoints[-1, 3] = debug_scale_cut_point_diameter(spoints[-1, 3], scale)
+
+            section = morphology.add_section(node, spoints[0, 0:3], spoints[0, 3], ArrayMorphology.k_SECTION_DENDRITE)
+            stats.node_grow_stats[node].append(tuple(spoints[0, 0:3].tolist()))
+
+            # drop the points closer than the threshold (in source units) to the previous grown point
+            grown = np.ones(len(grow_idxs), dtype=bool)
+            if context.k_SEGMENT_THRESHOLD_SQR > 0:
+                threshold_sqr = context.k_SEGMENT_THRESHOLD_SQR * scale * scale
+                grow_positions = [tuple(pos) for pos in spoints[:, 0:3].tolist()]
+                prev_gidx = 0
+                for gidx in range(1, len(grow_positions)):
+                    if (distance_squared(grow_positions[gidx], grow_positions[prev_gidx]) >= threshold_sqr):
+                        prev_gidx = gidx
+                    else:
+                        grown[gidx] = False
+                        stats.warn_counts[stats.k_INFO_IGNORED_POSITIONS] += 1
+                        if logging.getLogger().isEnabledFor(logging.DEBUG):
+                            logging.debug("INFO - ignoring pos: %s too close to previous: %s",
+                                          *[tuple(p) for p in context.k_TRANSFORM.inverse(
+                                              spoints[[gidx, prev_gidx], 0:3]).tolist()])
+
+            morphology.add_points(section, spoints[1:][grown[1:]])
+
+            if is_cut and len(grow_idxs) > 1 and grown[-1]:
+                morphology.mark_cut_point(section)
 
-            if section:
-                if (distance_squared(pos, prev_pos) >= options.k_SEGMENT_THRESHOLD_SQR):
-                    section.grow(spos[0], spos[1], spos[2], sdiameter)
-
-                    if is_cut:
-                        morphology.mark_cut_point(section)
-
-                    prev_pos = pos
-                else:
-                    stats.warn_counts[stats.k_INFO_IGNORED_POSITIONS] += 1
-                    logging.debug("INFO - ignoring pos: %s too close to previous: %s", pos, prev_pos)
-            elif not options.k_CLIP_INSIDE_SOMA or vlength(pos) > sradius+pt.diameter:
-                section = node.grow(spos[0], spos[1], spos[2], sdiameter, Section_Type.DENDRITE)
-                stats.node_grow_stats[node].append(pos)
-                prev_pos = pos
-
-            if is_cut:
-                stats.warn_counts[stats.k_WARN_CUT_NODES_FOUND] += 1
-                logging.debug('Cut node reached at node segment position:%s', pos_orig)
-                break
+        if is_cut:
+            stats.warn_counts[stats.k_WARN_CUT_NODES_FOUND] += 1
+            logging.debug('Cut node reached at node segment position:%s', segm.points[last].position())
 
         # end node
         ndata = segm.points[-1]
         npos = ndata.position()
-        nposadj = vadjust_offset_length3(npos, scentre, max(0, sradius-ndata.diameter))
+        spos = context.node_position(pidxs[-1])
 
-        is_cut = is_cut or is_cut_point(npos, options.k_CUTPOINT_AABB)
+        is_cut = is_cut or bool(cut_flags[-1])
 
         if is_cut:
             stats.warn_counts[stats.k_WARN_CUT_NODES_FOUND] += 1
             logging.debug('Ending cut node reached at node position:%s', npos)
 
-        if not section and (not options.k_CLIP_INSIDE_SOMA or vlength(nposadj) >= sradius + ndata.diameter):
+        if section is None and (not context.k_CLIP_INSIDE_SOMA or vlength(spos) >= sradius + diameters[-1]):
             section = node
 
         if npos not in nodes:
-            if section:
-                spos = vmuls3(nposadj, scale)
-                sdiameter = ndata.diameter * scale
+            if section is not None:
+                sdiameter = diameters[-1]
 
                 # visual debug support
                 if is_cut and logging.getLogger().getEffectiveLevel() <= logging.DEBUG:
                     sdiameter = debug_scale_cut_point_diameter(sdiameter, scale)
 
-                nodes[npos] = section.grow(spos[0], spos[1], spos[2], sdiameter, Section_Type.DENDRITE)
+                nodes[npos] = morphology.add_section(section, spos, sdiameter, ArrayMorphology.k_SECTION_DENDRITE)
 
                 if is_cut:
                     morphology.mark_cut_point(nodes[npos])
 
-                stats.node_grow_stats[section].append(nposadj)
+                stats.node_grow_stats[section].append(spos)
                 logging.debug('New Node:%s', str(segm.end))
             else:
                 nodes[npos] = node
                 logging.debug('Reusing Start Node:%s as End Node:%s', str(segm.start), str(segm.end))
 
-    if is_parent_cut:
-        return
-
-    # grow children
-    for cn_idx in dagnodes[pnode_idx]:
-        grow_segments(cn_idx, dagnodes, nodesegments, nodes, visited, morphology,
-                      offsets, options, stats, depth - 1 if depth > 0 else -1)
+    return is_parent_cut
 
 
-def create_morphology(skel, soma_data, options):
+def create_array_morphology(skel, soma_data, options, soma_nodes = None, profiler = None, soma_index = None):
     """
-    creates morphology from the skeleton obtained
+    creates the (backend-neutral) array morphology from the skeleton obtained
     :param skel: skeleton data structure from amiramesh reader
     :param soma_data: soma data dictionary
     :param options: struct of create morphology options
-    :return: BBPsdk morphology of the skeleton
+    :param soma_nodes: Optional, node-ids (list or array) of the soma nodes, e.g., from a batched
+                       NodeSpatialIndex.query_radius of many somata; collected from soma_data if None.
+    :param profiler: Optional, StageProfiler recording the stages.
+    :param soma_index: Optional, NodeSpatialIndex of the skeleton nodes, built once per skeleton when it is grown
+                       several times (e.g., with different soma radii); built if None (and soma_nodes is None).
+    :return: ArrayMorphology of the skeleton
     """
-    class morph_options:
-        # boolean set True to allow cyclic graphs, False forces acyclic graph.
-        k_ALLOW_CYCLES = options.allow_cycles                                           # Default: False
-        # boolean set True to allow soma nodes to connect to each other, False makes them root nodes.
-        k_CONNECT_SOMA_SOMA = options.verbosity_level <= logging.NOTSET                 # Default: False
-
-        # float specifies minimum length between segment arcs (inter-node section edges)
-        k_SEGMENT_THRESHOLD_SQR = options.threshold_segment_length                      # Default: 0
-        # boolean set True to start segments after they leave the soma
-        k_CLIP_INSIDE_SOMA = options.verbosity_level > logging.NOTSET                   # Default: True
-
-        # boolean set True to create normal BBPSDK soma node; False creates zero sized node for debugging
-        k_INFLATE_SOMA = options.verbosity_level > logging.NOTSET                       # Default: True
-
-        # float specifies morphology scaling factor
-        k_SCALING_FACTOR = options.scaling_factor                                       # Default: 1
-
-        k_CUTPOINT_AABB = options.stack_AABB                                            # Default: None
-
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
 
-    class morph_statistics:
-        k_WARN_UNCONNECTED_SEGMENTS = 1
-        k_WARN_IGNORED_EDGES = 2
-        k_WARN_MAX_GROW_DEPTH_REACHED = 3
-        k_WARN_CUT_NODES_FOUND = 4
-        k_INFO_IGNORED_POSITIONS = 100
+    with profiler.stage('array_skeleton'):
+        skel = ArraySkeleton.from_skeleton(skel)
+    if options.simplify_method:
+        with profiler.stage('simplify'):
+            skel = simplify_skeleton(skel, options.simplify_method, options.simplify_value)
 
-        # dictionary mapping warning and info categories above to occurrence counts
-        warn_counts = defaultdict(lambda: 0)
-
-        # dictionary mapping BBPSDK nodes to the positions grown from them.
-        node_grow_stats = defaultdict(lambda: [])
-
-
-    depth = options.graph_depth
-
-    # Collect soma nodes
     soma_centre = (soma_data['centre']['x'], soma_data['centre']['y'], soma_data['centre']['z'])
     soma_radius = soma_data['radius']
 
-    soma_node_idxs = collect_soma_nodes(soma_centre, soma_radius, skel.nodes)
+    # all run state (options, transformed points, cut-point mask, statistics) is in the run context
+    with profiler.stage('transform'):
+        context = MorphologyContext(skel, soma_centre, soma_radius, options)
 
-    npositions = collect_node_positions(skel.nodes)
+    # Collect soma nodes
+    with profiler.stage('collect_soma_nodes'):
+        if soma_nodes is None:
+            assert(soma_index is None or len(soma_index) == len(skel.nodes)), "Expected soma index of the skeleton nodes"
+            soma_node_idxs = collect_soma_nodes(soma_centre, soma_radius, skel.nodes, soma_index)
+        else:
+            soma_node_idxs = np.asarray(soma_nodes).tolist()
 
-    show_node_pos_stats(npositions, options.stack_AABB, soma_centre)
+    node_cutpoint_mask = cut_point_mask(skel.node_positions, context.k_CUTPOINT_AABB)
+    show_node_pos_stats(skel.node_positions, context.k_CUTPOINT_AABB, soma_centre, node_cutpoint_mask)
     logging.info('Collected %s soma nodes out of %s total nodes',  str(len(soma_node_idxs)), str(len(skel.nodes)))
 
     # Create graph / data-structures of skeleton
     # NOTE: creating the directed graph also re-orders the segment directions (required to grow correctly)
-    node_idx_graph = create_node_graph(skel)
-    dag_nodes = create_directed_graph(soma_node_idxs, node_idx_graph,
-                                      morph_options, morph_statistics)
-    node_segments = create_node_segments_dict(skel.segments, dag_nodes,
-                                              morph_statistics)
+    with profiler.stage('create_node_graph'):
+        node_idx_graph = create_node_graph(skel)
+    with profiler.stage('create_directed_graph'):
+        dag_nodes = create_directed_graph(soma_node_idxs, node_idx_graph, context)
+    with profiler.stage('create_node_segments_dict'):
+        node_segments = create_node_segments_dict(skel.segments, dag_nodes, context)
 
     show_graph_stats(dag_nodes, node_segments)
 
     # TODO: add better tools for analysing the connectivity of unreachable nodes
     # some nodes are unreachable islands in the graph (no path from the soma); we validate and warn
-    validate_graph_segments(dag_nodes, node_segments,
-                            soma_node_idxs if morph_options.k_CONNECT_SOMA_SOMA else None)
+    with profiler.stage('validate_graph_segments'):
+        validate_graph_segments(dag_nodes, node_segments,
+                                soma_node_idxs if context.k_CONNECT_SOMA_SOMA else None)
 
     # Grow nodes
+    with profiler.stage('grow'):
+        morphology = ArrayMorphology()
+        nodes = {}
+
+        # Grow soma nodes
+        grow_soma(morphology, soma_node_idxs, node_segments, nodes, context)
+
+        # Grow segments from inside (soma nodes) out
+        visited = set()
+        for snidx in soma_node_idxs:
+            logging.debug('Growing Soma Node:%s', str(snidx))
+            grow_segments(snidx, dag_nodes, node_segments, nodes, visited,
+                          morphology, context, context.k_GRAPH_DEPTH)
+
+    show_grow_stats(context.stats, ArrayMorphology.k_SOMA)
+    show_warning_stats(context.stats)
+
+    return morphology
+
+
+def create_bbp_morphology(amorph):
+    """
+    Creates a BBPSDK morphology from an array morphology.
+    :param amorph: ArrayMorphology object.
+    :return: BBPSDK Morphology object.
+    """
+    assert(Morphology is not None), "BBPSDK (bbp module) is required to create BBPSDK morphologies"
+
+    section_types = {ArrayMorphology.k_SECTION_SOMA: Section_Type.SOMA,
+                     ArrayMorphology.k_SECTION_AXON: Section_Type.AXON,
+                     ArrayMorphology.k_SECTION_DENDRITE: Section_Type.DENDRITE,
+                     ArrayMorphology.k_SECTION_APICAL_DENDRITE: getattr(Section_Type, 'APICAL_DENDRITE',
+                                                                        Section_Type.DENDRITE)}
+
     morphology = Morphology()
     soma = morphology.soma()
-    nodes = {}
 
-    # Grow soma nodes
-    grow_soma(soma, soma_node_idxs,
-              node_segments, nodes,
-              (soma_centre, soma_radius),
-              morph_options, morph_statistics)
+    soma_spoints = soma.surface_points()
+    for pos in amorph.soma_points.tolist():
+        soma_spoints.insert(Vector3f(pos[0], pos[1], pos[2]))
+
+    points = amorph.points.tolist()
+    offsets = amorph.section_offsets().tolist()
+    cut_points = amorph.cut_points.tolist()
 
-    # Grow segments from inside (soma nodes) out
-    visited = []
-    for snidx in soma_node_idxs:
-        logging.debug('Growing Soma Node:%s', str(snidx))
-        grow_segments(snidx, dag_nodes, node_segments, nodes, visited,
-                      morphology, (soma_centre, soma_radius),
-                      morph_options, morph_statistics, depth)
+    sections = []
+    for sidx, (parent, section_type, first) in enumerate(amorph.sections.tolist()):
+        node = soma if parent == ArrayMorphology.k_SOMA else sections[parent]
+        x, y, z, d = points[first]
+        section = node.grow(x, y, z, d, section_types[section_type])
+        for x, y, z, d in points[first + 1:offsets[sidx + 1]]:
+            section.grow(x, y, z, d)
 
-    show_grow_stats(morph_statistics, soma)
-    show_warning_stats(morph_statistics)
+        if cut_points[sidx]:
+            morphology.mark_cut_point(section)
+        sections.append(section)
 
     return morphology
 
 
+def create_morphology(skel, soma_data, options, soma_nodes = None, soma_index = None):
+    """
+    creates morphology from the skeleton obtained
+    :param skel: skeleton data structure from amiramesh reader
+    :param soma_data: soma data dictionary
+    :param options: struct of create morphology options
+    :param soma_nodes: Optional, node-ids of the soma nodes (see create_array_morphology).
+    :param soma_index: Optional, NodeSpatialIndex of the skeleton nodes (see create_array_morphology).
+    :return: BBPsdk morphology of the skeleton
+    """
+    return create_bbp_morphology(create_array_morphology(skel, soma_data, options, soma_nodes, soma_index=soma_index))
+
+
 def create_morphology_file(morphology, filespec):
     """
-    Writes the morphology object into the specified hdf5 file.
-    :param morphology: BBPSDK Morphology object.
-    :param filespec: Object specifying label, filepath, and output directory
+    Writes the morphology object into the specified hdf5 (or SWC) file.
+    :param morphology: ArrayMorphology (or BBPSDK Morphology) object.
+    :param filespec: Object specifying label, filepath, output directory, and morphology writer
     """
 
     # handle existing output file
@@ -461,13 +726,61 @@ def create_morphology_file(morphology, filespec):
     except OSError:
         pass
 
+    if filespec.morphology_writer == 'h5py':
+        assert(isinstance(morphology, ArrayMorphology)), "Expected ArrayMorphology object"
+        writer = H5MorphologyWriter(filespec.h5_precision, filespec.h5_compression, filespec.h5_chunk_rows)
+        writer.save(filespec.skel_out_file, morphology)
+        return
+
+    if filespec.morphology_writer == 'swc':
+        assert(isinstance(morphology, ArrayMorphology)), "Expected ArrayMorphology object"
+        SWCWriter().save(filespec.skel_out_file, morphology)
+        return
+
+    if isinstance(morphology, ArrayMorphology):
+        morphology = create_bbp_morphology(morphology)
+
     morphology.label(filespec.skel_name)
 
     # write file to directory
-    try:
-        writer = Morphology_Writer()
-        writer.open(filespec.skel_out_path)
-        writer.write(morphology, Morphology_Repair_Stage.RAW_MORPHOLOGY)
-    except OSError:
-        pass
+    writer = Morphology_Writer()
+    writer.open(filespec.skel_out_path)
+    writer.write(morphology, Morphology_Repair_Stage.RAW_MORPHOLOGY)
+
 
+def skeletonize(options, profiler = None):
+    """
+    Converts a skeleton into a morphology file: reads the skeleton, annotations and (unless ignored) cross-sections,
+    grows the morphology and writes it.  The options are expected to be validated.
+    :param options: MorphologyCreateOptions object, with its file paths set.
+    :param profiler: Optional, StageProfiler recording the conversion stages.
+    :return: ArrayMorphology object.
+    """
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    # annotations and cross-sections are set on a copy, so the caller's options may be shared by concurrent runs
+    options = copy.copy(options)
+
+    with profiler.stage('read_skeleton'):
+        cache = SkeletonCache(options.cache_dir, options.cache_max_bytes) if options.use_cache else None
+        skel = AmirameshReader(cache).read(options.skel_am_file)
+
+    with profiler.stage('read_annotations'):
+        with open(options.skel_json_file, 'r') as f:
+            annotation_data = json.load(f)
+
+        options.set_annotation_data(annotation_data)
+
+    if not options.ignore_optional_input_files:
+        with profiler.stage('load_cross_sections'):
+            xsection_data = load_cross_sections(options.skel_csv_file)
+        with profiler.stage('update_diameters'):
+            skel.update_diameters_from_columns(xsection_data, outlier_logging_threshold=3.0)
+        options.set_xsection_data(xsection_data)
+
+    with profiler.stage('create_morphology'):
+        morphology = create_array_morphology(skel, annotation_data['soma'], options, profiler=profiler)
+    with profiler.stage('write'):
+        create_morphology_file(morphology, options)
+    return morphology
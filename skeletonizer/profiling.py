@@ -0,0 +1,164 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Profiling module.
+
+    Records the wall time, CPU time and memory of each stage of a conversion (e.g., reading the skeleton, building
+    the graphs, growth and writing).  Memory is measured with tracemalloc (allocated and peak traced memory of the
+    stage) when memory tracing is enabled.  The peak resident set size is always recorded, but it is process-wide
+    and never decreases: a stage's rss_delta is the growth of the peak during the stage (0 for a stage that stays
+    below an earlier peak), not the memory the stage used.
+"""
+
+import time
+import json
+import logging
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# process CPU time (seconds)
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+def max_rss():
+    """ Returns the peak resident set size of the process (bytes), or None if unknown"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# description of the memory records, saved with the profile
+k_MEMORY_NOTE = {
+    'allocated': 'tracemalloc: memory allocated (and not freed) by the stage',
+    'peak': 'tracemalloc: peak traced memory since the enclosing outermost stage started (since tracing '
+            'started, before Python 3.9)',
+    'max_rss': 'process-wide peak resident set size at the end of the stage (never decreases)',
+    'rss_delta': 'growth of the process-wide peak resident set size during the stage',
+}
+
+
+#
+# StageProfiler class
+#
+
+class StageProfiler(object):
+    """Per-stage timing and memory records of a conversion, in stage order; e.g.:
+        profiler = StageProfiler(trace_memory=True)
+        with profiler.stage('read_skeleton'):
+            ...
+        profiler.save('profile.json')
+    A disabled profiler records nothing (and costs nothing), so stages can always be instrumented.
+    """
+
+    def __init__(self, enabled = True, trace_memory = False):
+        """
+        :param enabled: False to record nothing.
+        :param trace_memory: True to measure the memory of stages with tracemalloc (started, if not yet tracing);
+                             memory is also traced if tracemalloc is already tracing.
+        """
+        self.enabled = enabled
+        self.records = []
+        self.started_tracing = False
+        if enabled and trace_memory:
+            if tracemalloc is None:
+                logging.warning('WARNING - tracemalloc is not available, memory is not traced')
+            elif not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+
+    def is_tracing_memory(self):
+        return self.enabled and tracemalloc is not None and tracemalloc.is_tracing()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Records a stage; stages may be nested (records are ordered by their start, with their nesting depth).
+        :param name: stage name.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        # open (enclosing) stages have no wall time yet
+        record = {'name': name, 'depth': sum(1 for r in self.records if r['wall'] is None), 'wall': None}
+        self.records.append(record)
+
+        tracing = self.is_tracing_memory()
+        if tracing:
+            traced_start = tracemalloc.get_traced_memory()[0]
+            # per stage peaks require reset_peak (Python 3.9), otherwise peaks are since tracing started
+            if hasattr(tracemalloc, 'reset_peak') and record['depth'] == 0:
+                tracemalloc.reset_peak()
+        rss_start = max_rss()
+        wall_start = time.time()
+        cpu_start = cpu_time()
+        try:
+            yield
+        finally:
+            record['cpu'] = cpu_time() - cpu_start
+            record['wall'] = time.time() - wall_start
+            if tracing:
+                traced, peak = tracemalloc.get_traced_memory()
+                record['allocated'] = traced - traced_start
+                record['peak'] = peak
+            record['max_rss'] = max_rss()
+            record['rss_delta'] = record['max_rss'] - rss_start if rss_start is not None else None
+
+    def stop(self):
+        """ Stops memory tracing, if it was started by the profiler"""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def totals(self):
+        """ Returns the wall and CPU time of the (outermost) stages, and the peak memory of all stages"""
+        outer = [r for r in self.records if r['depth'] == 0 and r['wall'] is not None]
+        totals = {'wall': sum(r['wall'] for r in outer), 'cpu': sum(r['cpu'] for r in outer)}
+        for key in ('peak', 'max_rss'):
+            values = [r[key] for r in self.records if r.get(key) is not None]
+            totals[key] = max(values) if values else None
+        return totals
+
+    def to_dict(self, **metadata):
+        """
+        :param metadata: additional items of the profile, e.g., the skeleton name.
+        :return: JSON serializable dictionary of the profile.
+        """
+        profile = dict(metadata)
+        profile['tracemalloc'] = any('peak' in r for r in self.records)
+        profile['memory'] = dict((key, note) for key, note in k_MEMORY_NOTE.items()
+                                 if profile['tracemalloc'] or 'rss' in key)
+        profile['stages'] = self.records
+        profile['total'] = self.totals()
+        return profile
+
+    def save(self, json_file, **metadata):
+        with open(json_file, 'w') as f:
+            json.dump(self.to_dict(**metadata), f, indent=2, sort_keys=True)
+        logging.info('Wrote profile of %i stages: %s', len(self.records), json_file)
+
+    def show(self):
+        """ Logs the stage records"""
+        def mb(value):
+            return '%10.1f' % (value / float(1 << 20)) if value is not None else '%10s' % '-'
+
+        logging.info('%-32s %10s %10s %10s %10s %10s %10s', 'Stage', 'wall (s)', 'cpu (s)', 'alloc (MB)', 'peak (MB)',
+                     'rss (MB)', '+rss (MB)')
+        for r in self.records:
+            logging.info('%-32s %10.4f %10.4f %s %s %s %s', '  ' * r['depth'] + r['name'], r['wall'], r['cpu'],
+                         mb(r.get('allocated')), mb(r.get('peak')), mb(r.get('max_rss')), mb(r.get('rss_delta')))
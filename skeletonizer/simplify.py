@@ -0,0 +1,201 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Skeleton simplification module.
+
+    Simplifies (decimates or resamples) the points of all segments of an ArraySkeleton at once, using the
+    cumulative arc-length along each segment. The first and last points of a segment (at its nodes) are kept.
+"""
+
+import logging
+
+import numpy as np
+
+from skeletonizer.amiramesh import ArraySkeleton
+from skeletonizer.maths import vlength_array
+
+
+def segment_arc_lengths(skel):
+    """
+    :param skel: ArraySkeleton
+    :return: (P) array of the arc-length of each point from the first point of its segment.
+    """
+    points = skel.points[:, 0:3]
+    counts = skel.segment_counts()
+    starts = skel.segment_offsets[:-1][counts > 0]
+
+    steps = np.zeros(len(points))
+    steps[1:] = vlength_array(points[1:] - points[:-1])
+    # no step onto the first point of a segment
+    steps[starts] = 0.0
+
+    arc = np.cumsum(steps)
+    return arc - np.repeat(arc[starts], counts[counts > 0])
+
+
+def segment_end_mask(skel):
+    """ Returns the (P) boolean array, True for the first and last point of each segment"""
+    mask = np.zeros(len(skel.points), dtype=bool)
+    counts = skel.segment_counts()
+    mask[skel.segment_offsets[:-1][counts > 0]] = True
+    mask[skel.segment_offsets[1:][counts > 0] - 1] = True
+    return mask
+
+
+def select_points(skel, keep):
+    """
+    :param skel: ArraySkeleton
+    :param keep: (P) boolean array of the points to keep.
+    :return: ArraySkeleton of the same nodes and segments, with only the kept points.
+    """
+    offsets = np.zeros(len(skel.segment_offsets), dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(skel.point_segment_indices(), weights=keep, minlength=len(skel.edges)))
+    return ArraySkeleton(skel.node_positions, skel.edges, offsets, skel.points[keep])
+
+
+def simplify_min_spacing(skel, spacing):
+    """
+    Drops the points closer (in arc-length) than spacing to the previous kept point of their segment.
+    Greedy, as the segment threshold of growth; all segments advance together, one kept point per pass.
+    :param skel: ArraySkeleton
+    :param spacing: minimum arc-length between kept points.
+    :return: ArraySkeleton
+    """
+    arc = segment_arc_lengths(skel)
+    counts = skel.segment_counts()
+    segments = np.flatnonzero(counts > 2)
+
+    # monotonic key over all points; segments are separated by more than spacing
+    seg_lengths = np.zeros(len(counts))
+    seg_lengths[counts > 0] = arc[skel.segment_offsets[1:][counts > 0] - 1]
+    seg_starts = np.zeros(len(counts))
+    seg_starts[1:] = np.cumsum(seg_lengths + 2.0 * spacing + 1.0)[:-1]
+    key = arc + np.repeat(seg_starts, counts)
+
+    keep = segment_end_mask(skel)
+    current = skel.segment_offsets[:-1][segments]
+    last = skel.segment_offsets[1:][segments] - 1
+    while len(current):
+        current = np.searchsorted(key, key[current] + spacing, 'left')
+        more = current < last
+        current, last = current[more], last[more]
+        keep[current] = True
+
+    return select_points(skel, keep)
+
+
+def resample_uniform(skel, step):
+    """
+    Resamples each segment at uniform arc-length intervals (of at most step), interpolating positions and thickness.
+    :param skel: ArraySkeleton
+    :param step: maximum arc-length between resampled points.
+    :return: ArraySkeleton
+    """
+    arc = segment_arc_lengths(skel)
+    counts = skel.segment_counts()
+    has_points = counts > 0
+
+    seg_lengths = np.zeros(len(counts))
+    seg_lengths[has_points] = arc[skel.segment_offsets[1:][has_points] - 1]
+    intervals = np.maximum(1, np.ceil(seg_lengths / step)).astype(np.int64)
+    new_counts = np.where(counts > 1, intervals + 1, counts)
+
+    # interpolate over a monotonic key of all points; segments are separated by a gap
+    seg_starts = np.zeros(len(counts))
+    seg_starts[1:] = np.cumsum(seg_lengths + 1.0)[:-1]
+    key = arc + np.repeat(seg_starts, counts)
+
+    seg_idxs = np.repeat(np.arange(len(counts)), new_counts)
+    new_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(new_counts)
+    sample_idxs = np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1], new_counts)
+    fraction = sample_idxs / np.maximum(1, new_counts - 1).astype(np.float64)[seg_idxs]
+    targets = seg_starts[seg_idxs] + fraction * seg_lengths[seg_idxs]
+
+    points = np.empty((new_offsets[-1], 4))
+    for c in range(4):
+        points[:, c] = np.interp(targets, key, skel.points[:, c])
+
+    # segment ends are exactly the original end points (the node positions)
+    points[new_offsets[:-1][has_points]] = skel.points[skel.segment_offsets[:-1][has_points]]
+    points[new_offsets[1:][has_points] - 1] = skel.points[skel.segment_offsets[1:][has_points] - 1]
+
+    return ArraySkeleton(skel.node_positions, skel.edges, new_offsets, points)
+
+
+def simplify_douglas_peucker(skel, tolerance):
+    """
+    Douglas-Peucker simplification, with a tolerance proportional to the local diameter: a point is kept if it
+    is further than tolerance * diameter from the chord of the kept points around it.
+    All pending chords, of all segments, are split together, one level per pass.
+    :param skel: ArraySkeleton
+    :param tolerance: tolerance, as a multiple of the point diameter.
+    :return: ArraySkeleton
+    """
+    positions = skel.points[:, 0:3]
+    thresholds = tolerance * skel.points[:, 3]
+
+    keep = segment_end_mask(skel)
+    counts = skel.segment_counts()
+    firsts = skel.segment_offsets[:-1][counts > 2]
+    lasts = skel.segment_offsets[1:][counts > 2] - 1
+
+    while len(firsts):
+        # interior points of each chord
+        nbetween = lasts - firsts - 1
+        chord = np.repeat(np.arange(len(firsts)), nbetween)
+        pidxs = np.arange(nbetween.sum()) - np.repeat(np.cumsum(nbetween) - nbetween, nbetween) + firsts[chord] + 1
+
+        start = positions[firsts][chord]
+        direction = positions[lasts][chord] - start
+        offset = positions[pidxs] - start
+        dlen_sqr = np.einsum('ij,ij->i', direction, direction)
+        t = np.einsum('ij,ij->i', offset, direction) / np.where(dlen_sqr > 0, dlen_sqr, 1.0)
+        distances = vlength_array(offset - np.clip(t, 0.0, 1.0)[:, np.newaxis] * direction)
+        excess = distances - thresholds[pidxs]
+
+        # split each chord at its point of greatest excess distance, if beyond tolerance
+        order = np.lexsort((-excess, chord))
+        first_of_chord = np.cumsum(nbetween) - nbetween
+        split = pidxs[order[first_of_chord]]
+        split_excess = excess[order[first_of_chord]]
+        is_split = split_excess > 0
+        keep[split[is_split]] = True
+
+        firsts, lasts, split = firsts[is_split], lasts[is_split], split[is_split]
+        firsts, lasts = np.concatenate((firsts, split)), np.concatenate((split, lasts))
+        pending = lasts - firsts > 1
+        firsts, lasts = firsts[pending], lasts[pending]
+
+    return select_points(skel, keep)
+
+
+k_SIMPLIFY_METHODS = {
+    'spacing': simplify_min_spacing,
+    'uniform': resample_uniform,
+    'dp': simplify_douglas_peucker,
+}
+
+
+def simplify_skeleton(skel, method, value):
+    """
+    Simplifies the segment points of a skeleton.
+    :param skel: Skeleton or ArraySkeleton
+    :param method: one of k_SIMPLIFY_METHODS: 'spacing' (minimum spacing), 'uniform' (uniform resampling),
+                   or 'dp' (Douglas-Peucker).
+    :param value: spacing, resampling step, or Douglas-Peucker tolerance (multiple of the point diameter).
+    :return: ArraySkeleton
+    """
+    assert(method in k_SIMPLIFY_METHODS), \
+        "Unknown simplification method '%s', expected one of: %s" % (method, ', '.join(sorted(k_SIMPLIFY_METHODS)))
+    assert(value > 0 or method == 'dp'), "Expected a positive simplification value, found %s" % value
+
+    skel = ArraySkeleton.from_skeleton(skel)
+    simplified = k_SIMPLIFY_METHODS[method](skel, value)
+    logging.info('Simplified skeleton (%s %s): %i points to %i points',
+                 method, value, len(skel.points), len(simplified.points))
+    return simplified
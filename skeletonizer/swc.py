@@ -0,0 +1,166 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    SWC morphology module.
+
+    Writes and reads ArrayMorphology objects as SWC files, i.e., rows of:
+        id type x y z radius parent
+    with 1-based ids, and parent -1 for root points. The soma is written as the standard three-point soma (type 1):
+    its centre at the morphology origin, and two points one soma radius (the mean distance of the soma surface
+    points from their centre) along Y on either side; the root sections grow from the centre.  A soma of zero radius
+    is a single point, and a morphology without soma points has no soma rows (its root sections are roots).
+"""
+
+import re
+import logging
+
+import numpy as np
+
+from skeletonizer.array_morphology import ArrayMorphology
+
+
+#
+# SWCWriter class
+#
+
+class SWCWriter(object):
+    """Writes ArrayMorphology objects to SWC files; rows are computed, and formatted, as whole arrays."""
+
+    k_CHUNK_ROWS = 1 << 16
+
+    def __init__(self, float_format = '%.9g'):
+        """
+        :param float_format: format of the position and radius columns.
+        """
+        self.row_format = ' '.join(['%d', '%d'] + [float_format] * 4 + ['%d']) + '\n'
+
+    def rows(self, amorph):
+        """
+        Returns the (R x 7) SWC rows of a morphology (as float64).
+        :param amorph: ArrayMorphology object.
+        """
+        # three-point soma: centre (root), and the points at -radius and +radius along Y (children of the centre)
+        soma_radius = amorph.soma_radius()[0]
+        if not len(amorph.soma_points):
+            nsoma = 0
+        elif soma_radius > 0:
+            nsoma = 3
+        else:
+            nsoma = 1
+        points = amorph.points
+        sections = amorph.sections
+        offsets = amorph.section_offsets()
+
+        rows = np.zeros((nsoma + len(points), 7))
+        rows[:, 0] = np.arange(1, len(rows) + 1)
+        rows[0:nsoma, 1] = ArrayMorphology.k_SECTION_SOMA
+        rows[0:nsoma, 5] = soma_radius
+        if nsoma == 3:
+            rows[1:3, 3] = (-soma_radius, soma_radius)
+        rows[nsoma:, 1] = np.repeat(sections[:, ArrayMorphology.k_TYPE], np.diff(offsets))
+        rows[nsoma:, 2:5] = points[:, 0:3]
+        rows[nsoma:, 5] = points[:, 3] / 2.0
+
+        # each point continues from the previous point, except the first points: soma centre (root), soma points
+        # (from the centre), and sections (from the last point of their parent section, or the soma centre)
+        rows[:, 6] = rows[:, 0] - 1
+        rows[0:nsoma, 6] = 1
+        rows[0:1, 6] = -1
+        parents = sections[:, ArrayMorphology.k_PARENT]
+        from_soma = parents == ArrayMorphology.k_SOMA
+        first_rows = offsets[:-1] + nsoma
+        rows[first_rows[from_soma], 6] = 1 if nsoma else -1
+        rows[first_rows[~from_soma], 6] = offsets[parents[~from_soma] + 1] + nsoma
+        return rows
+
+    def write(self, f, amorph):
+        """
+        :param f: File object, opened for writing.
+        :param amorph: ArrayMorphology object.
+        """
+        rows = self.rows(amorph)
+
+        f.write('# SWC morphology, written by skeletonizer\n')
+        f.write('# id type x y z radius parent\n')
+        for first in range(0, len(rows), self.k_CHUNK_ROWS):
+            chunk = rows[first:first + self.k_CHUNK_ROWS]
+            f.write((self.row_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+    def save(self, swc_file, amorph):
+        with open(swc_file, 'w') as f:
+            self.write(f, amorph)
+        logging.info('Wrote %i sections, %i points: %s', len(amorph), len(amorph.points), swc_file)
+
+
+#
+# SWCReader class
+#
+
+class SWCReader(object):
+    """Reads SWC files into ArrayMorphology objects, converting all rows at once.
+
+    Points of types other than soma form sections, split at branch points and type changes
+    (so unbranched chains of written sections are read as one section). Rows may be in any id order,
+    but parents must precede their children.
+
+    The soma points are the surface points of the soma: the two points of a three-point soma (not its centre), the
+    centre moved one radius along -Y and +Y for a single-point soma, and the row positions of other (contour) somata.
+        """
+
+    def read(self, swc_file):
+        with open(swc_file, 'r') as f:
+            return self.parse(f)
+
+    def parse(self, f):
+        """
+        :param f: File object of the SWC file.
+        :return: ArrayMorphology object.
+        """
+        text = re.sub(r'#[^\n]*', '', f.read())
+        values = np.fromstring(text, dtype=np.float64, sep=' ')
+        assert(len(values) % 7 == 0), "Expected 7 SWC columns, found %i values" % len(values)
+        rows = values.reshape(-1, 7)
+
+        ids = rows[:, 0].astype(np.int64)
+        types = rows[:, 1].astype(np.int64)
+        parent_ids = rows[:, 6].astype(np.int64)
+
+        # parent row of each row; -1 for root points
+        order = np.argsort(ids, kind='mergesort')
+        parent_rows = order[np.clip(np.searchsorted(ids, parent_ids, sorter=order), 0, max(0, len(ids) - 1))]
+        is_root = parent_ids < 0
+        assert(np.all(is_root | (ids[parent_rows] == parent_ids))), "SWC parent ids reference undefined ids"
+        parent_rows[is_root] = -1
+        assert(np.all(parent_rows < np.arange(len(rows)))), "Expected SWC parent rows before their child rows"
+
+        is_soma = types == ArrayMorphology.k_SECTION_SOMA
+        soma_rows = np.flatnonzero(is_soma)
+        soma_points = rows[soma_rows, 2:5]
+        if len(soma_rows) == 1 and rows[soma_rows[0], 5] > 0:
+            soma_points = soma_points + np.outer((-1, 1), (0, rows[soma_rows[0], 5], 0))
+        elif len(soma_rows) == 3 and parent_rows[soma_rows[0]] < 0 and \
+                np.all(parent_rows[soma_rows[1:]] == soma_rows[0]):
+            soma_points = soma_points[1:]
+
+        # section points: rows of other types; sections start at roots, branches and type changes
+        point_rows = np.flatnonzero(~is_soma)
+        prows = parent_rows[point_rows]
+        nchildren = np.bincount(prows[prows >= 0], minlength=len(rows))
+        starts = (prows < 0) | (prows != point_rows - 1)
+        starts[~starts] = is_soma[prows[~starts]] | (types[prows[~starts]] != types[point_rows[~starts]]) | \
+                          (nchildren[prows[~starts]] > 1)
+
+        # section of each row, and parent section of each section (soma for roots, and soma children)
+        row_sections = np.full(len(rows), ArrayMorphology.k_SOMA, dtype=np.int64)
+        row_sections[point_rows] = np.cumsum(starts) - 1
+        first_rows = point_rows[starts]
+        section_parents = np.where(parent_rows[first_rows] < 0, ArrayMorphology.k_SOMA,
+                                   row_sections[parent_rows[first_rows]])
+
+        sections = np.column_stack((section_parents, types[first_rows], np.flatnonzero(starts)))
+        points = np.column_stack((rows[point_rows, 2:5], rows[point_rows, 5] * 2.0))
+        return ArrayMorphology(sections, points, soma_points)
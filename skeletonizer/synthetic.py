@@ -0,0 +1,166 @@
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Synthetic skeleton module.
+
+    Generates random branching tree skeletons of a given size (e.g., for benchmarks), with the defects of real
+    skeletonizations: cycles (including diamonds: reconvergent paths of equal length), duplicate (and reversed)
+    edges, segments in arbitrary order and direction, and cut regions (points outside the stack AABB).  All arrays
+    are generated at once, so 10^7 point skeletons are generated in seconds.
+"""
+
+import json
+
+import numpy as np
+
+from skeletonizer.amiramesh import ArraySkeleton, AmirameshWriter
+
+
+def tree_positions(parents, steps):
+    """
+    Positions of the nodes of a tree, as the sum of the steps along the path from the root (by pointer jumping).
+    :param parents: (N) parent node of each node; -1 for the root.
+    :param steps: (N x 3) step from the parent to each node (the position of the root).
+    :return: (N x 3) node positions.
+    """
+    positions = np.array(steps, dtype=np.float64)
+    ancestors = np.array(parents, dtype=np.int64)
+    has_ancestor = ancestors >= 0
+    while has_ancestor.any():
+        positions[has_ancestor] += positions[ancestors[has_ancestor]]
+        ancestors[has_ancestor] = ancestors[ancestors[has_ancestor]]
+        has_ancestor = ancestors >= 0
+    return positions
+
+
+def generate_skeleton(npoints, seed = 0, segment_points = 10, segment_length = 10.0, stems = 6,
+                      branch_probability = 0.2, cycle_fraction = 0.01, diamond_fraction = 0.01, diamond_chain = None,
+                      duplicate_fraction = 0.01, cut_fraction = 0.05):
+    """
+    Generates a random branching tree skeleton, grown from a soma at the origin.
+    :param npoints: approximate number of skeleton points.
+    :param seed: random seed; the same arguments generate the same skeleton.
+    :param segment_points: mean number of interior points of each segment.
+    :param segment_length: mean length of the segments.
+    :param stems: number of segments grown from the soma node.
+    :param branch_probability: probability that a node branches from a random earlier node, instead of
+                               continuing from the previous node.
+    :param cycle_fraction: fraction of added edges closing a cycle (a node to its grandparent).
+    :param diamond_fraction: fraction of added diamonds: a new node joined to a node and its grandparent, i.e.,
+                             a second path of the same length.
+    :param diamond_chain: number of diamonds stacked along a tree path (the number of paths to the nodes below a chain
+                          grows exponentially with its length); None for half the log2 of the segment count, i.e.,
+                          paths growing with the square root of the skeleton size.
+    :param duplicate_fraction: fraction of added duplicate edges (half of them reversed).
+    :param cut_fraction: approximate fraction of the points outside the stack AABB (cut regions).
+    :return: tuple of (ArraySkeleton, annotation data dictionary with the soma and stack AABB).
+    """
+    rng = np.random.RandomState(seed)
+
+    nsegments = max(stems + 1, int(npoints / (segment_points + 2.0) /
+                                   (1.0 + cycle_fraction + 2 * diamond_fraction + duplicate_fraction)))
+    nnodes = nsegments + 1
+
+    # tree: the first nodes are stems of the soma (node 0); other nodes continue from the previous node,
+    # or branch from a random earlier node
+    idxs = np.arange(nnodes)
+    parents = idxs - 1
+    branches = rng.random_sample(nnodes) < branch_probability
+    parents[branches] = (rng.random_sample(nnodes) * np.maximum(1, idxs))[branches].astype(np.int64)
+    parents[1:stems + 1] = 0
+    parents[0] = -1
+
+    directions = rng.normal(size=(nnodes, 3))
+    directions /= np.sqrt((directions ** 2).sum(axis=1))[:, np.newaxis]
+    steps = directions * (segment_length * rng.uniform(0.5, 1.5, nnodes))[:, np.newaxis]
+    steps[0] = 0.0
+    node_positions = tree_positions(parents, steps)
+
+    # edges: the tree, cycles (node to grandparent), diamonds and duplicates; in random order and direction
+    tree_edges = np.column_stack((parents[1:], idxs[1:]))
+    grand = np.flatnonzero(parents >= 0)
+    grand = grand[parents[parents[grand]] >= 0]
+    cycles = rng.choice(grand, min(len(grand), int(cycle_fraction * nsegments)), replace=False) \
+        if len(grand) else np.zeros(0, dtype=np.int64)
+    cycle_edges = np.column_stack((parents[parents[cycles]], cycles))
+
+    # diamonds: a new node beside each parent, from the grandparent to the node; in chains up the tree
+    if diamond_chain is None:
+        diamond_chain = max(1, int(0.5 * np.log2(nsegments)))
+    ndiamonds = int(diamond_fraction * nsegments)
+    bottoms = rng.choice(grand, min(len(grand), -(-ndiamonds // diamond_chain)), replace=False) \
+        if len(grand) and ndiamonds else np.zeros(0, dtype=np.int64)
+    chains = [bottoms]
+    for _ in range(diamond_chain - 1):
+        bottoms = parents[parents[bottoms]]
+        bottoms = bottoms[parents[np.maximum(0, parents[bottoms])] >= 0]
+        chains.append(bottoms)
+    diamonds = np.unique(np.concatenate(chains))
+    diamond_idxs = nnodes + np.arange(len(diamonds))
+    diamond_tops = parents[parents[diamonds]]
+    diamond_edges = np.concatenate((np.column_stack((diamond_tops, diamond_idxs)),
+                                    np.column_stack((diamond_idxs, diamonds))))
+    offsets = rng.normal(scale=0.5 * segment_length, size=(len(diamonds), 3))
+    node_positions = np.concatenate((node_positions,
+                                     0.5 * (node_positions[diamond_tops] + node_positions[diamonds]) + offsets))
+    duplicate_edges = tree_edges[rng.randint(0, len(tree_edges), int(duplicate_fraction * nsegments))]
+    duplicate_edges[::2] = duplicate_edges[::2, ::-1]
+
+    edges = np.concatenate((tree_edges, cycle_edges, diamond_edges, duplicate_edges))
+    edges = edges[rng.permutation(len(edges))]
+    reverse = rng.random_sample(len(edges)) < 0.5
+    edges[reverse] = edges[reverse, ::-1]
+
+    # segment points: from the start to the end node, with a lateral bulge of the interior points
+    counts = rng.randint(0, 2 * segment_points + 1, len(edges)) + 2
+    segment_offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    segment_offsets[1:] = np.cumsum(counts)
+    seg_idxs = np.repeat(np.arange(len(edges)), counts)
+    t = (np.arange(segment_offsets[-1]) - segment_offsets[seg_idxs]) / (counts[seg_idxs] - 1.0)
+
+    starts = node_positions[edges[seg_idxs, 0]]
+    ends = node_positions[edges[seg_idxs, 1]]
+    bulge = rng.normal(scale=0.1 * segment_length, size=(len(edges), 3))[seg_idxs]
+    points = np.empty((segment_offsets[-1], 4))
+    points[:, 0:3] = starts + t[:, np.newaxis] * (ends - starts) + np.sin(np.pi * t)[:, np.newaxis] * bulge
+    # segment end points are exactly their node positions (growth joins segments at equal positions)
+    points[segment_offsets[:-1], 0:3] = node_positions[edges[:, 0]]
+    points[segment_offsets[1:] - 1, 0:3] = node_positions[edges[:, 1]]
+    points[:, 3] = rng.uniform(0.5, 2.0, len(edges))[seg_idxs] * rng.uniform(0.9, 1.1, len(points))
+
+    skel = ArraySkeleton(node_positions, edges, segment_offsets, points)
+
+    # the stack AABB cuts the points beyond the (1 - cut_fraction) quantile of X
+    lower = points[:, 0:3].min(axis=0) - segment_length
+    upper = points[:, 0:3].max(axis=0) + segment_length
+    if cut_fraction > 0:
+        upper[0] = np.percentile(points[:, 0], 100.0 * (1.0 - cut_fraction))
+
+    def xyz(v):
+        return {'x': float(v[0]), 'y': float(v[1]), 'z': float(v[2])}
+
+    annotation_data = {'soma': {'centre': xyz(node_positions[0]), 'radius': 0.5 * segment_length},
+                       'stack': {'AABB': {'v1': xyz(lower), 'v2': xyz(upper)}}}
+    return skel, annotation_data
+
+
+def write_synthetic_skeleton(skel_file, npoints, binary = True, **kwargs):
+    """
+    Generates a skeleton (see generate_skeleton), and writes its Amiramesh and annotations files.
+    :param skel_file: skeleton file path, without the *.am extension.
+    :param npoints: approximate number of skeleton points.
+    :param binary: True to write a binary Amiramesh file, False for ASCII.
+    :return: tuple of (ArraySkeleton, *.am file path, *.annotations.json file path).
+    """
+    skel, annotation_data = generate_skeleton(npoints, **kwargs)
+
+    am_file = skel_file + '.am'
+    json_file = skel_file + '.annotations.json'
+    AmirameshWriter(binary, compact=False).save(am_file, skel)
+    with open(json_file, 'w') as f:
+        json.dump(annotation_data, f, indent=2)
+    return skel, am_file, json_file
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""
+    Skeletonizer: Python Cell Morphology Analysis and Construction Toolkit
+
+    KAUST, BESE, Neuro-Inspired Computing Project
+    (c) 2014-2015. All rights reserved.
+"""
+"""
+    Skeletonizer benchmark suite.
+
+    Times the conversion stages (parsing, graph construction, segment ordering, growth and writing) of synthetic
+    skeletons of increasing size, saves the results as a JSON baseline, and compares them with a previous baseline.
+"""
+
+import os
+import sys
+import math
+import json
+import shutil
+import getopt
+import logging
+import platform
+import tempfile
+
+import numpy as np
+
+try:
+    import skeletonizer
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(os.path.split(__file__)[0]))))
+
+from skeletonizer.hdf5 import *
+from skeletonizer.profiling import *
+from skeletonizer.synthetic import *
+from skeletonizer.morphology import *
+
+
+k_DEFAULT_SIZES = (1000, 10000, 100000)
+k_DEFAULT_THRESHOLD = 0.25
+# stage times below this (seconds) are too noisy to compare
+k_MIN_SECONDS = 0.01
+# scaling exponents above this (between sizes) are reported as super-linear
+k_MAX_EXPONENT = 1.3
+
+
+def run_benchmark(npoints, work_dir, binary = True, seed = 0):
+    """
+    Generates, converts and writes one synthetic skeleton.
+    :param npoints: approximate number of skeleton points.
+    :param work_dir: directory of the generated and written files.
+    :param binary: True for a binary Amiramesh file, False for ASCII.
+    :param seed: random seed of the synthetic skeleton.
+    :return: dictionary of the skeleton point count, and the seconds of each stage.
+    """
+    profiler = StageProfiler()
+    skel_file = os.path.join(work_dir, 'synthetic_%i.SptGraph' % npoints)
+
+    with profiler.stage('generate'):
+        skel, annotation_data = generate_skeleton(npoints, seed=seed)
+    with profiler.stage('write_amiramesh'):
+        AmirameshWriter(binary, compact=False).save(skel_file + '.am', skel)
+        with open(skel_file + '.annotations.json', 'w') as f:
+            json.dump(annotation_data, f)
+
+    options = MorphologyCreateOptions()
+    options.set_pathname(skel_file)
+    options.ignore_optional_input_files = True
+    options.use_cache = False
+    options.force_overwrite = True
+    options.morphology_writer = 'swc'
+    options.verbosity_level = logging.WARNING
+    options.set_filepaths()
+
+    # growth builds the backend-neutral ArrayMorphology (no BBPSDK); written as SWC, and HDF5 if h5py is available
+    morphology = skeletonize(options, profiler)
+    if h5py is not None:
+        with profiler.stage('write_h5py'):
+            H5MorphologyWriter().save(os.path.join(work_dir, 'synthetic_%i.h5' % npoints), morphology)
+
+    stages = {}
+    for r in profiler.records:
+        name = 'write_swc' if r['name'] == 'write' else r['name']
+        stages[name] = stages.get(name, 0.0) + r['wall']
+    return {'points': len(skel.points), 'stages': stages}
+
+
+def run_suite(sizes, repeat = 1, binary = True, seed = 0):
+    """
+    :param sizes: skeleton sizes (approximate point counts).
+    :param repeat: runs of each size; the fastest time of each stage is kept.
+    :return: JSON serializable dictionary of the environment, and the results by size.
+    """
+    results = {
+        'version': 1,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'h5py': h5py is not None,
+        'binary': binary,
+        'seed': seed,
+        'sizes': {},
+    }
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        for npoints in sizes:
+            runs = [run_benchmark(npoints, work_dir, binary, seed) for _ in range(repeat)]
+            stages = dict((name, min(run['stages'][name] for run in runs)) for name in runs[0]['stages'])
+            results['sizes'][str(npoints)] = {'points': runs[0]['points'], 'stages': stages}
+            logging.info('Benchmarked %i points: %.2fs', runs[0]['points'], stages['create_morphology'])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def scaling_exponents(results):
+    """
+    Returns the scaling exponent of each stage between consecutive sizes, i.e., time ~ points^exponent
+    (1 for linear, 2 for quadratic), as a dictionary mapping stage names to lists of (size, exponent).
+    """
+    sizes = sorted(results['sizes'].values(), key=lambda s: s['points'])
+    exponents = {}
+    for smaller, larger in zip(sizes[:-1], sizes[1:]):
+        for name, seconds in larger['stages'].items():
+            base = smaller['stages'].get(name)
+            if base is not None and base >= k_MIN_SECONDS and seconds >= k_MIN_SECONDS:
+                exponent = math.log(seconds / base) / math.log(float(larger['points']) / smaller['points'])
+                exponents.setdefault(name, []).append((larger['points'], exponent))
+    return exponents
+
+
+def compare_results(baseline, results, threshold = k_DEFAULT_THRESHOLD, min_seconds = k_MIN_SECONDS):
+    """
+    :param baseline: results of a previous run (see run_suite).
+    :param results: results of this run.
+    :param threshold: relative slow-down reported as a regression (e.g., 0.25 for 25% slower).
+    :param min_seconds: stages faster than this (in both runs) are not compared.
+    :return: list of regressions: (size, stage, baseline seconds, seconds, ratio), for the sizes and stages of both.
+    """
+    regressions = []
+    for size, result in sorted(results['sizes'].items(), key=lambda item: int(item[0])):
+        base_result = baseline['sizes'].get(size)
+        if base_result is None:
+            continue
+        for name, seconds in sorted(result['stages'].items()):
+            base = base_result['stages'].get(name)
+            if base is None or max(base, seconds) < min_seconds:
+                continue
+            ratio = seconds / max(base, 1e-9)
+            if ratio > 1.0 + threshold:
+                regressions.append((int(size), name, base, seconds, ratio))
+    return regressions
+
+
+def show_results(results, baseline = None):
+    """ Prints the stage times of each size (and the ratio to the baseline), and the super-linear stages"""
+    sizes = sorted(results['sizes'].items(), key=lambda item: int(item[0]))
+    names = sorted(set(name for _, result in sizes for name in result['stages']))
+
+    print('%-28s' % 'Stage (seconds)' + ''.join('%20s' % ('%i pts' % result['points']) for _, result in sizes))
+    for name in names:
+        row = '%-28s' % name
+        for size, result in sizes:
+            seconds = result['stages'].get(name)
+            cell = '%.4f' % seconds if seconds is not None else '-'
+            base = baseline['sizes'].get(size, {}).get('stages', {}).get(name) if baseline else None
+            if seconds is not None and base:
+                cell += ' (x%.2f)' % (seconds / base)
+            row += '%20s' % cell
+        print(row)
+
+    for name, exponents in sorted(scaling_exponents(results).items()):
+        for points, exponent in exponents:
+            if exponent > k_MAX_EXPONENT:
+                print('SUPER-LINEAR %s: time ~ points^%.2f (up to %i points)' % (name, exponent, points))
+
+
+if __name__ == '__main__':
+    k_FORMAT = "%(message)s"
+    logging.basicConfig(format=k_FORMAT, level=logging.ERROR)
+
+    sizes = k_DEFAULT_SIZES
+    repeat = 1
+    binary = True
+    seed = 0
+    threshold = k_DEFAULT_THRESHOLD
+    save_file = None
+    baseline_file = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:r:s:b:t:", ["sizes=", "repeat=", "save=", "baseline=",
+                                                                 "threshold=", "ascii", "seed="])
+    except getopt.GetoptError:
+        print('benchmark_skeletonizer.py -h')
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print('Benchmarks the conversion stages of synthetic skeletons, and compares them with a baseline.')
+            print('\nUsage:')
+            print(' benchmark_skeletonizer.py [-n <sizes>] [-r <repeat>] [-s <save.json>] [-b <baseline.json>] [-t <threshold>]')
+            print('\t -n <sizes>\t Comma separated skeleton sizes in points, 10^3 to 10^7 (default %s)' %
+                  ','.join(map(str, k_DEFAULT_SIZES)))
+            print('\t -r <repeat>\t Runs of each size; the fastest time of each stage is kept (default 1)')
+            print('\t -s <filename>\t Save the results as a JSON baseline')
+            print('\t -b <filename>\t Compare the results with a JSON baseline; exit code 1 if any stage regressed')
+            print('\t -t <threshold>\t Relative slow-down reported as a regression (default %.2f)' % k_DEFAULT_THRESHOLD)
+            print('\t --ascii \t Benchmark ASCII (instead of binary) Amiramesh files')
+            print('\t --seed <seed>\t Random seed of the synthetic skeletons (default 0)')
+            sys.exit()
+        elif opt in ('-n', '--sizes'):
+            sizes = [int(float(size)) for size in arg.split(',')]
+        elif opt in ('-r', '--repeat'):
+            repeat = int(arg)
+        elif opt in ('-s', '--save'):
+            save_file = arg
+        elif opt in ('-b', '--baseline'):
+            baseline_file = arg
+        elif opt in ('-t', '--threshold'):
+            threshold = float(arg)
+        elif opt == '--ascii':
+            binary = False
+        elif opt == '--seed':
+            seed = int(arg)
+
+    baseline = None
+    if baseline_file:
+        with open(baseline_file, 'r') as f:
+            baseline = json.load(f)
+
+    results = run_suite(sizes, repeat, binary, seed)
+    if baseline is not None and (baseline.get('binary'), baseline.get('seed')) != (binary, seed):
+        print('WARNING - baseline skeletons differ (binary %s, seed %s)' % (baseline.get('binary'), baseline.get('seed')))
+    show_results(results, baseline)
+
+    if save_file:
+        with open(save_file, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Saved baseline: %s' % save_file)
+
+    if baseline is not None:
+        regressions = compare_results(baseline, results, threshold)
+        for size, name, base, seconds, ratio in regressions:
+            print('REGRESSION %i points %s: %.4fs -> %.4fs (x%.2f)' % (size, name, base, seconds, ratio))
+        if regressions:
+            sys.exit(1)
+        print('No regressions (threshold %.0f%%)' % (threshold * 100))
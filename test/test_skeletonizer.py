@@ -24,6 +24,12 @@ import logging
 import operator
 from collections import defaultdict
 import subprocess
+import shutil
+import tempfile
+import threading
+import StringIO
+
+import numpy as np
 
 try:
     import skeletonizer
@@ -32,9 +38,17 @@ except ImportError:
 
 from skeletonizer.bbp_import_module import *
 from skeletonizer.amiramesh import *
+from skeletonizer.cache import *
+from skeletonizer.cross_section import *
 from skeletonizer.maths import *
 from skeletonizer.graphs import *
+from skeletonizer.simplify import *
+from skeletonizer.hdf5 import *
+from skeletonizer.swc import *
 from skeletonizer.morphology import *
+from skeletonizer.batch import *
+from skeletonizer.profiling import *
+from skeletonizer.synthetic import *
 
 
 class MorphologyFileTestCase(unittest.TestCase):
@@ -79,23 +93,9 @@ class MorphologyFileTestCase(unittest.TestCase):
         options.set_annotation_data(annotation_data)
 
 
-        with open(options.skel_csv_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter='\t', quotechar='|')
-            xsection_data = {}
-            for r in reader:
-                area = float(r['area'])
-                perimeter = float(r['perimeter'])
-                diameter = math.sqrt(area) / math.pi
-                xsection_data[(int(r['segment_idx']), int(r['pnt_idx']))] = \
-                            {'area':area, 'perimeter':perimeter, \
-                             'estimated_diameter':float(r['estimated_diameter']), \
-                             'estimated_area':float(r['estimated_area']), \
-                             'estimated_perimeter':float(r['estimated_perimeter']), \
-                             'blender_position':r['blender_position'], \
-                             'blender_normal':r['blender_normal'], \
-                             'diameter':diameter}
-
-        skel.update_diameters(xsection_data)
+        xsection_data = load_cross_sections(options.skel_csv_file)
+
+        skel.update_diameters(xsection_data.to_dict())
         options.set_xsection_data(xsection_data)
 
 
@@ -171,6 +171,1369 @@ class MorphologyFileTestCase(unittest.TestCase):
         # TODO: Scan stdout from subprocess.call to find errors or issues (e.g., "No cross-section data for node:")
 
 
+class MorphologyCreateTestCase(unittest.TestCase):
+
+    def test_grow_deep_branch(self):
+        # a single branch, far deeper than the Python recursion limit
+        nnodes = sys.getrecursionlimit() * 2
+        node_positions = np.zeros((nnodes, 3))
+        node_positions[:, 0] = np.arange(nnodes)
+        edges = np.column_stack((np.arange(nnodes - 1), np.arange(1, nnodes)))
+        points = np.zeros((3 * (nnodes - 1), 4))
+        points[:, 0] = (np.arange(nnodes - 1)[:, np.newaxis] + [0.0, 0.5, 1.0]).ravel()
+        points[:, 3] = 0.5
+        skel = ArraySkeleton(node_positions, edges, np.arange(0, len(points) + 1, 3), points)
+
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.WARNING
+        options.stack_AABB = v3_to_aabb((-1, -1, -1), (nnodes, 1, 1))
+        amorph = create_array_morphology(skel, {'centre': {'x': 0, 'y': 0, 'z': 0}, 'radius': 0.5}, options)
+
+        # one unbranched chain of single point sections, from the first point outside the soma (x = 1)
+        self.assertEqual(amorph.points[:, 0].tolist(), np.arange(1, nnodes - 0.5, 0.5).tolist())
+        self.assertEqual(amorph.sections[:, 0].tolist(), list(range(-1, len(amorph) - 1)))
+        self.assertEqual(amorph.section_offsets().tolist(), list(range(len(amorph) + 1)))
+        self.assertFalse(amorph.cut_points.any())
+        self.assertTrue(create_bbp_morphology(amorph) is not None)
+
+    def test_grow_branches(self):
+        # node 1 branches to nodes 2 and 3; the segment from node 2 to 4, and nodes 4, 5 and 6 are outside the stack
+        node_positions = np.array([(0, 0, 0), (2, 0, 0), (4, 2, 0), (4, -2, 0), (10, 2, 0), (8, -2, 0), (10, -2, 0)],
+                                  dtype=np.float64)
+        segment_points = [[(0, 0, 0), (1, 0, 0), (2, 0, 0)],
+                          [(2, 0, 0), (3, 1, 0), (4, 2, 0)],
+                          [(2, 0, 0), (3, -1, 0), (4, -2, 0)],
+                          [(4, 2, 0), (6, 2, 0), (8, 2, 0), (10, 2, 0)],
+                          [(4, -2, 0), (6, -2, 0), (8, -2, 0)],
+                          [(8, -2, 0), (9, -2, 0), (10, -2, 0)]]
+        edges = np.array([(0, 1), (1, 2), (1, 3), (2, 4), (3, 5), (5, 6)])
+        offsets = np.cumsum([0] + [len(p) for p in segment_points])
+        points = np.column_stack((np.concatenate(segment_points), np.full(offsets[-1], 0.1)))
+        skel = ArraySkeleton(node_positions, edges, offsets, points)
+
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.ERROR
+        options.stack_AABB = v3_to_aabb((-1, -3, -1), (7, 3, 1))
+        context = MorphologyContext(skel, (0, 0, 0), 0.5, options)
+        dgraph = create_directed_graph([0], create_node_graph(skel), context)
+        nodesegments = create_node_segments_dict(skel.segments, dgraph, context)
+
+        morphology = ArrayMorphology()
+        nodes = {}
+        grow_soma(morphology, [0], nodesegments, nodes, context)
+        grow_segments(0, dgraph, nodesegments, nodes, set(), morphology, context)
+
+        # recursive pre-order: each node grows an interior section and an end node section per segment;
+        # the subtree of node 2 before node 3; a cut ends its section, and node 5 (cut) grows no children
+        self.assertEqual(morphology.soma_points.tolist(), [[0, 0, 0]])
+        self.assertEqual(morphology.sections[:, 0].tolist(), [-1, 0, 1, 2, 1, 4, 3, 6, 5, 8])
+        self.assertEqual([morphology.section_points(i)[:, 0:2].tolist() for i in range(len(morphology))],
+                         [[[1, 0]], [[2, 0]], [[3, 1]], [[4, 2]], [[3, -1]], [[4, -2]],
+                          [[6, 2], [8, 2]], [[10, 2]], [[6, -2]], [[8, -2]]])
+        self.assertEqual(np.flatnonzero(morphology.cut_points).tolist(), [6, 7, 9])
+        self.assertEqual(context.stats.warn_counts[GrowStatistics.k_WARN_CUT_NODES_FOUND], 3)
+        self.assertEqual(dict((n, [p[0:2] for p in ps]) for n, ps in context.stats.node_grow_stats.items()),
+                         {ArrayMorphology.k_SOMA: [(1, 0)], 0: [(2, 0)], 1: [(3, 1), (3, -1)], 2: [(4, 2)],
+                          3: [(6, 2)], 4: [(4, -2)], 5: [(6, -2)], 6: [(10, 2)], 8: [(8, -2)]})
+
+        # a depth limit stops each branch after as many nodes (depth 2: nodes 0 and 1)
+        context = MorphologyContext(skel, (0, 0, 0), 0.5, options)
+        morphology = ArrayMorphology()
+        nodes = {}
+        grow_soma(morphology, [0], nodesegments, nodes, context)
+        grow_segments(0, dgraph, nodesegments, nodes, set(), morphology, context, 2)
+        self.assertEqual(len(morphology), 6)
+        self.assertEqual(context.stats.warn_counts[GrowStatistics.k_WARN_MAX_GROW_DEPTH_REACHED], 2)
+
+    def test_concurrent_runs(self):
+        data_dir_path = os.path.join(os.path.split(__file__)[0], 'data')
+        with open(os.path.join(data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            skel = ArraySkeleton.from_skeleton(AmirameshReader().parse(f))
+        with open(os.path.join(data_dir_path, 'test.SptGraph.annotations.json'), 'r') as f:
+            soma_data = json.load(f)['soma']
+
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.WARNING
+        expected = create_array_morphology(skel, soma_data, options)
+
+        # runs in threads share no state: each grows the same morphology as a single run
+        results = [None] * 4
+        def run(i):
+            results[i] = create_array_morphology(skel, soma_data, options)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for morphology in results:
+            self.assertEqual(morphology.sections.tolist(), expected.sections.tolist())
+            self.assertEqual(morphology.points.tolist(), expected.points.tolist())
+            self.assertEqual(morphology.cut_points.tolist(), expected.cut_points.tolist())
+
+        # the transform is applied once to the points; only the segment end points (nodes) are clamped
+        context = MorphologyContext(skel, (0, 0, 0), 1.0, options)
+        self.assertEqual(context.k_POINT_POSITIONS.tolist(), skel.points[:, 0:3].tolist())
+        self.assertEqual(context.k_END_POINTS.tolist(),
+                         np.unique(np.concatenate((skel.segment_offsets[:-1], skel.segment_offsets[1:] - 1))).tolist())
+        for pidx in context.k_END_POINTS.tolist():
+            pos, diameter = skel.points[pidx, 0:3], skel.points[pidx, 3]
+            self.assertEqual(context.node_position(pidx), vadjust_offset_length3(tuple(pos), (0, 0, 0), max(0, 1.0 - diameter)))
+            self.assertEqual(context.soma_position(pidx), vadjust_offset_length3(tuple(pos), (0, 0, 0), 1.0))
+
+        # each run context collects its own statistics
+        first = MorphologyContext(skel, (0, 0, 0), 1.0, options)
+        second = MorphologyContext(skel, (0, 0, 0), 1.0, options)
+        create_node_segments_dict(skel.segments, {}, first)
+        self.assertEqual(first.stats.warn_counts[GrowStatistics.k_WARN_UNCONNECTED_SEGMENTS], len(skel.segments))
+        self.assertEqual(second.stats.warn_counts[GrowStatistics.k_WARN_UNCONNECTED_SEGMENTS], 0)
+
+
+class ArrayMorphologyTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def test_builder(self):
+        morphology = ArrayMorphology()
+        morphology.add_soma_point((1, 0, 0))
+        morphology.add_soma_point((-1, 0, 0))
+        s0 = morphology.add_section(ArrayMorphology.k_SOMA, (1, 0, 0), 0.5)
+        morphology.add_points(s0, [(2, 0, 0, 0.5), (3, 0, 0, 0.4)])
+        s1 = morphology.add_section(s0, (3, 1, 0), 0.3, ArrayMorphology.k_SECTION_AXON)
+        morphology.add_point(s1, (3, 2, 0), 0.2)
+        morphology.mark_cut_point(s1)
+
+        self.assertEqual(len(morphology), 2)
+        self.assertEqual(morphology.sections.tolist(), [[-1, 3, 0], [0, 2, 3]])
+        self.assertEqual(morphology.section_offsets().tolist(), [0, 3, 5])
+        self.assertEqual(morphology.section_points(1).tolist(), [[3, 1, 0, 0.3], [3, 2, 0, 0.2]])
+        self.assertEqual(morphology.cut_points.tolist(), [False, True])
+        self.assertEqual(morphology.soma_radius(), (1.0, 1.0))
+
+        # points are only added to the last section
+        self.assertRaises(AssertionError, morphology.add_point, s0, (4, 0, 0), 0.1)
+        self.assertRaises(AssertionError, morphology.add_section, 5, (4, 0, 0), 0.1)
+
+        copy = ArrayMorphology(morphology.sections, morphology.points, morphology.soma_points, morphology.cut_points)
+        self.assertEqual(copy.points.tolist(), morphology.points.tolist())
+        self.assertEqual(copy.cut_points.tolist(), morphology.cut_points.tolist())
+
+        # the buffers grow past their initial capacity
+        nsections = ArrayMorphology.k_INITIAL_CAPACITY * 3
+        for i in range(nsections):
+            section = copy.add_section(len(copy) - 1, (i, 0, 0), 0.1)
+            copy.add_points(section, [(i, 1, 0, 0.1), (i, 2, 0, 0.1)])
+            copy.add_soma_point((0, i, 0))
+        self.assertEqual(len(copy), nsections + 2)
+        self.assertEqual(copy.points.shape, (5 + 3 * nsections, 4))
+        self.assertEqual(len(copy.soma_points), 2 + nsections)
+        self.assertEqual(copy.section_points(1).tolist(), [[3, 1, 0, 0.3], [3, 2, 0, 0.2]])
+        self.assertEqual(copy.section_points(len(copy) - 1)[:, 1].tolist(), [0, 1, 2])
+        self.assertEqual(np.flatnonzero(copy.cut_points).tolist(), [1])
+
+    def test_create_array_morphology(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            skel = AmirameshReader().parse(f)
+
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.WARNING
+        options.scaling_factor = 2.0
+        morphology = create_array_morphology(skel, {'centre': {'x': 0, 'y': 0, 'z': 0}, 'radius': 1.0}, options)
+
+        sections = morphology.sections
+        self.assertTrue(len(sections) > 0)
+        # parents are stored before their children, and every section has points
+        self.assertTrue(np.all(sections[:, 0] < np.arange(len(sections))))
+        self.assertTrue(np.all(np.diff(morphology.section_offsets()) > 0))
+        self.assertTrue(len(morphology.soma_points) > 0)
+        self.assertTrue(np.any(sections[:, 0] == ArrayMorphology.k_SOMA))
+
+        # grown points are scaled skeleton points
+        askel = ArraySkeleton.from_skeleton(skel)
+        self.assertTrue(np.all(np.in1d(morphology.points[:, 3], askel.points[:, 3] * 2.0)))
+
+    def test_baseline_growth(self):
+        # the morphology grown by the original BBPSDK growth
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.morphology.json'), 'r') as f:
+            expected = json.load(f)
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.annotations.json'), 'r') as f:
+            annotation_data = json.load(f)
+        annotation_data['stack'] = expected['stack']
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            skel = AmirameshReader().parse(f)
+
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.ERROR
+        options.scaling_factor = expected['scaling_factor']
+        options.set_annotation_data(annotation_data)
+        amorph = create_array_morphology(skel, annotation_data['soma'], options)
+
+        self.assertEqual(amorph.sections.tolist(), expected['sections'])
+        self.assertTrue(np.allclose(amorph.points, expected['points'], rtol=0, atol=1e-8))
+        self.assertTrue(np.allclose(amorph.soma_points, expected['soma_points'], rtol=0, atol=1e-8))
+        self.assertEqual(np.flatnonzero(amorph.cut_points).tolist(), expected['cut_sections'])
+
+        # the BBPSDK morphology is grown with the same sequence of sections and points
+        calls = []
+        class recorded_section(object):
+            def __init__(self, sidx):
+                self.sidx = sidx
+            def grow(self, x, y, z, d, section_type = None):
+                if section_type is None:
+                    calls.append(('point', self.sidx, [x, y, z, d]))
+                    return None
+                calls.append(('section', self.sidx, [x, y, z, d], section_type))
+                return recorded_section(len([c for c in calls if c[0] == 'section']) - 1)
+        class recorded_soma_points(object):
+            def insert(self, v):
+                calls.append(('soma_point', ArrayMorphology.k_SOMA, v))
+        class recorded_soma(recorded_section):
+            def surface_points(self):
+                return recorded_soma_points()
+        class recorded_morphology(object):
+            def __init__(self):
+                self.soma_section = recorded_soma(ArrayMorphology.k_SOMA)
+            def soma(self):
+                return self.soma_section
+            def mark_cut_point(self, section):
+                calls.append(('cut', section.sidx))
+
+        morphology_module = sys.modules[create_bbp_morphology.__module__]
+        bbp_names = morphology_module.Morphology, morphology_module.Vector3f
+        morphology_module.Morphology, morphology_module.Vector3f = recorded_morphology, lambda x, y, z: [x, y, z]
+        try:
+            create_bbp_morphology(amorph)
+        finally:
+            morphology_module.Morphology, morphology_module.Vector3f = bbp_names
+
+        expected_calls = [('soma_point', ArrayMorphology.k_SOMA, pos) for pos in expected['soma_points']]
+        for sidx, (parent, section_type, first) in enumerate(expected['sections']):
+            last = expected['sections'][sidx + 1][2] if sidx + 1 < len(expected['sections']) else len(expected['points'])
+            expected_calls.append(('section', parent, expected['points'][first], Section_Type.DENDRITE))
+            expected_calls.extend(('point', sidx, pos) for pos in expected['points'][first + 1:last])
+            if sidx in expected['cut_sections']:
+                expected_calls.append(('cut', sidx))
+
+        # calls (kind, section, position and diameter, [section type]); positions are compared separately
+        self.assertEqual([c[0:2] + c[3:] for c in calls], [c[0:2] + c[3:] for c in expected_calls])
+        for kind in ('soma_point', 'section', 'point'):
+            self.assertTrue(np.allclose([c[2] for c in calls if c[0] == kind],
+                                        [c[2] for c in expected_calls if c[0] == kind], rtol=0, atol=1e-8))
+
+
+@unittest.skipIf(h5py is None, 'requires h5py')
+class H5MorphologyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.morphology = ArrayMorphology()
+        for pos in ((1, 0, 0), (0, 1, 0), (-1, 0, 0)):
+            self.morphology.add_soma_point(pos)
+        s0 = self.morphology.add_section(ArrayMorphology.k_SOMA, (1, 0, 0), 0.5)
+        self.morphology.add_points(s0, [(2, 0, 0, 0.5), (3, 0, 0, 0.4)])
+        s1 = self.morphology.add_section(s0, (3.1, 1, 0), 0.3)
+        self.morphology.add_point(s1, (3.2, 2, 0), 0.2)
+        s2 = self.morphology.add_section(s0, (3.1, -1, 0), 0.3, ArrayMorphology.k_SECTION_AXON)
+        self.morphology.mark_cut_point(s2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def assertSameMorphology(self, a, b):
+        self.assertEqual(a.sections.tolist(), b.sections.tolist())
+        self.assertEqual(a.soma_points.tolist(), b.soma_points.tolist())
+        self.assertEqual(a.cut_points.tolist(), b.cut_points.tolist())
+        self.assertTrue(np.allclose(a.points, b.points))
+
+    def test_layout(self):
+        points, structure, cut_sections = H5MorphologyWriter().arrays(self.morphology)
+
+        self.assertEqual(points.dtype, np.float32)
+        self.assertEqual(points.shape, (3 + 6, 4))
+        self.assertEqual(structure.tolist(), [[0, 1, -1], [3, 3, 0], [6, 3, 1], [8, 2, 1]])
+        self.assertEqual(cut_sections.tolist(), [3])
+
+    def test_round_trip(self):
+        h5_file = os.path.join(self.tmp_dir, 'test.h5')
+        for precision, compression, chunk_rows in ((32, 4, None), (64, 0, None), (64, 0, 2), (32, 9, 1)):
+            H5MorphologyWriter(precision, compression, chunk_rows).save(h5_file, self.morphology)
+            with h5py.File(h5_file, 'r') as f:
+                self.assertEqual(f['points'].dtype, np.dtype('f%i' % (precision // 8)))
+                self.assertEqual(f['points'].compression, 'gzip' if compression else None)
+                self.assertEqual(f['points'].chunks is not None, bool(compression or chunk_rows))
+
+            self.assertSameMorphology(H5MorphologyReader().read(h5_file), self.morphology)
+
+        self.assertEqual(os.listdir(self.tmp_dir), ['test.h5'])
+
+    def test_unsized_soma(self):
+        morphology = ArrayMorphology()
+        morphology.add_section(ArrayMorphology.k_SOMA, (1, 0, 0), 0.5)
+        h5_file = os.path.join(self.tmp_dir, 'test.h5')
+        H5MorphologyWriter(64).save(h5_file, morphology)
+        self.assertSameMorphology(H5MorphologyReader().read(h5_file), morphology)
+
+
+class SWCTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_rows(self):
+        morphology = ArrayMorphology()
+        morphology.add_soma_point((1, 0, 0))
+        morphology.add_soma_point((-1, 0, 0))
+        s0 = morphology.add_section(ArrayMorphology.k_SOMA, (1, 0, 0), 0.5)
+        morphology.add_point(s0, (2, 0, 0), 0.5)
+        s1 = morphology.add_section(s0, (3, 1, 0), 0.3, ArrayMorphology.k_SECTION_AXON)
+        morphology.add_section(s0, (3, -1, 0), 0.4)
+        morphology.add_point(s1 + 1, (4, -1, 0), 0.2)
+
+        self.assertEqual(SWCWriter().rows(morphology).tolist(),
+                         [[1, 1, 0, 0, 0, 1, -1],
+                          [2, 1, 0, -1, 0, 1, 1],
+                          [3, 1, 0, 1, 0, 1, 1],
+                          [4, 3, 1, 0, 0, 0.25, 1],
+                          [5, 3, 2, 0, 0, 0.25, 4],
+                          [6, 2, 3, 1, 0, 0.15, 5],
+                          [7, 3, 3, -1, 0, 0.2, 5],
+                          [8, 3, 4, -1, 0, 0.1, 7]])
+
+        f = StringIO.StringIO()
+        SWCWriter().write(f, morphology)
+        read = SWCReader().parse(StringIO.StringIO(f.getvalue()))
+        self.assertEqual(read.sections.tolist(), morphology.sections.tolist())
+        self.assertEqual(read.points.tolist(), morphology.points.tolist())
+        # the soma is read as the surface points of the three-point soma, of the same radius
+        self.assertEqual(read.soma_points.tolist(), [[0, -1, 0], [0, 1, 0]])
+        self.assertEqual(read.soma_radius(), morphology.soma_radius())
+
+    def test_soma_rows(self):
+        morphology = ArrayMorphology()
+        s0 = morphology.add_section(ArrayMorphology.k_SOMA, (1, 0, 0), 0.5)
+        morphology.add_point(s0, (2, 0, 0), 0.5)
+        morphology.add_section(ArrayMorphology.k_SOMA, (-1, 0, 0), 0.5)
+
+        def round_trip(amorph):
+            f = StringIO.StringIO()
+            SWCWriter().write(f, amorph)
+            return SWCReader().parse(StringIO.StringIO(f.getvalue()))
+
+        # no soma points: no soma rows, the root sections are roots
+        self.assertEqual(SWCWriter().rows(morphology).tolist(),
+                         [[1, 3, 1, 0, 0, 0.25, -1],
+                          [2, 3, 2, 0, 0, 0.25, 1],
+                          [3, 3, -1, 0, 0, 0.25, -1]])
+        read = round_trip(morphology)
+        self.assertEqual(read.soma_points.shape, (0, 3))
+        self.assertEqual(read.sections.tolist(), morphology.sections.tolist())
+
+        # a soma of zero radius is a single point at the origin
+        morphology.add_soma_point((0, 0, 0))
+        self.assertEqual(SWCWriter().rows(morphology)[:, 6].tolist(), [-1, 1, 2, 1])
+        self.assertEqual(SWCWriter().rows(morphology)[0].tolist(), [1, 1, 0, 0, 0, 0, -1])
+        self.assertEqual(round_trip(morphology).soma_points.tolist(), [[0, 0, 0]])
+
+        # a three-point soma of the mean radius of the soma points, at the origin; the stems grow from its centre
+        morphology.add_soma_point((3, 0, 0))
+        morphology.add_soma_point((-3, 0, 0))
+        rows = SWCWriter().rows(morphology)
+        self.assertEqual(rows[0:3].tolist(), [[1, 1, 0, 0, 0, 2, -1],
+                                              [2, 1, 0, -2, 0, 2, 1],
+                                              [3, 1, 0, 2, 0, 2, 1]])
+        self.assertEqual(rows[3:, 6].tolist(), [1, 4, 1])
+        self.assertEqual(round_trip(morphology).soma_radius(), (2, 2))
+
+        # a single-point soma is read as the three-point soma
+        read = SWCReader().parse(StringIO.StringIO('1 1 2 0 0 1.5 -1\n2 3 4 0 0 0.5 1\n'))
+        self.assertEqual(read.soma_points.tolist(), [[2, -1.5, 0], [2, 1.5, 0]])
+        self.assertEqual(read.sections.tolist(), [[-1, 3, 0]])
+
+    def test_read(self):
+        # unordered ids, comments, and an unbranched chain (read as one section)
+        swc = StringIO.StringIO('# comment\n'
+                                '10 1 0 0 0 1.0 -1\n'
+                                '30 3 1 0 0 0.5 10  # inline comment\n'
+                                '20 3 2 0 0 0.5 30\n'
+                                '40 3 3 0 0 0.5 20\n'
+                                '50 3 3 1 0 0.5 40\n'
+                                '60 2 3 -1 0 0.5 40\n')
+        morphology = SWCReader().parse(swc)
+        self.assertEqual(morphology.soma_points.tolist(), [[0, -1, 0], [0, 1, 0]])
+        self.assertEqual(morphology.sections.tolist(), [[-1, 3, 0], [0, 3, 3], [0, 2, 4]])
+        self.assertEqual(morphology.points[:, 3].tolist(), [1.0] * 5)
+
+        self.assertRaises(AssertionError, SWCReader().parse, StringIO.StringIO('1 1 0 0 0 1.0 -1\n2 3 1 0 0 1.0 5\n'))
+
+    def test_round_trip(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            skel = AmirameshReader().parse(f)
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.WARNING
+        morphology = create_array_morphology(skel, {'centre': {'x': 0, 'y': 0, 'z': 0}, 'radius': 1.0}, options)
+
+        swc_file = os.path.join(self.tmp_dir, 'test.swc')
+        SWCWriter('%.17g').save(swc_file, morphology)
+        read = SWCReader().read(swc_file)
+        self.assertEqual(read.points.tolist(), morphology.points.tolist())
+        self.assertAlmostEqual(read.soma_radius()[0], morphology.soma_radius()[0], places=12)
+        self.assertTrue(len(read) <= len(morphology))
+
+        # unbranched sections are merged, so the file rows are unchanged
+        with open(swc_file, 'r') as f:
+            rows = f.read()
+        f = StringIO.StringIO()
+        SWCWriter('%.17g').write(f, read)
+        self.assertEqual(f.getvalue(), rows)
+
+
+class ArraySkeletonTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def setUp(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            self.skel = AmirameshReader().parse(f)
+
+    def test_array_skeleton_views(self):
+        askel = ArraySkeleton.from_skeleton(self.skel)
+
+        self.assertEqual(askel.node_positions.shape, (11, 3))
+        self.assertEqual(askel.edges.shape, (22, 2))
+        self.assertEqual(askel.points.shape, (284, 4))
+        self.assertEqual(len(askel.segment_offsets), 23)
+
+        for nidx, node in self.skel.nodes.iteritems():
+            self.assertEqual(askel.nodes[nidx].position(), node.position())
+
+        for s, v in zip(self.skel.segments, askel.segments):
+            self.assertEqual((s.start, s.end, len(s.points)), (v.start, v.end, len(v.points)))
+            self.assertEqual([p.list() for p in s.points], [p.list() for p in v.points])
+            self.assertEqual([p.position() for p in s.points[-2:0:-1]],
+                             [p.position() for p in v.points[-2:0:-1]])
+
+    def test_array_skeleton_round_trip(self):
+        askel = ArraySkeleton.from_skeleton(self.skel)
+        skel = askel.to_skeleton()
+
+        self.assertEqual([p.list() for s in skel.segments for p in s.points], askel.points.tolist())
+
+        # point views write through to the point array
+        askel.segments[1].points[2].diameter = 2.5
+        self.assertEqual(askel.points[askel.segment_offsets[1] + 2, 3], 2.5)
+
+
+    def test_segment_view(self):
+        askel = ArraySkeleton.from_skeleton(self.skel)
+
+        for segm in (self.skel.segments[3], askel.segments[3]):
+            view = SegmentView(segm)
+            self.assertEqual((view.start, view.end), (segm.end, segm.start))
+            self.assertEqual(len(view.points), len(segm.points))
+            self.assertEqual([p.position() for p in view.points], [p.position() for p in reversed(segm.points)])
+            self.assertEqual([p.position() for p in view.points[1:-1]], [p.position() for p in segm.points[-2:0:-1]])
+
+        # reversed points are the original points, not copies
+        view = SegmentView(self.skel.segments[3])
+        self.assertTrue(view.points[0] is self.skel.segments[3].points[-1])
+        self.assertTrue(SegmentView(view).points[0] is self.skel.segments[3].points[0])
+
+    def test_update_diameters(self):
+        askel = ArraySkeleton.from_skeleton(self.skel)
+
+        # every other point, with alternating diameter changes
+        xsection_data = {}
+        for sidx, s in enumerate(self.skel.segments):
+            for pidx in range(0, len(s.points), 2):
+                xsection_data[(sidx, pidx)] = {'diameter': s.points[pidx].diameter + (-0.1, 0.2, 0.5)[pidx % 3],
+                                               'estimated_diameter': s.points[pidx].diameter}
+
+        self.skel.update_diameters(xsection_data, require_complete_xsection=False)
+        outliers = askel.update_diameters(xsection_data, require_complete_xsection=False,
+                                          outlier_logging_threshold=0.3)
+
+        self.assertEqual(askel.points.tolist(), ArraySkeleton.from_skeleton(self.skel).points.tolist())
+        self.assertEqual([askel.segment_point(i) for i in outliers],
+                         sorted(k for k in xsection_data if k[1] % 3 == 2))
+        self.assertRaises(AssertionError, askel.update_diameters, xsection_data)
+
+
+class CrossSectionDataTestCase(unittest.TestCase):
+    k_CSV = ('am_position\tsegment_idx\tpnt_idx\tarea\tperimeter\testimated_diameter\testimated_area\testimated_perimeter\tblender_position\tblender_normal\n'
+             '(0.5, 1.0, 2.0)\t0\t0\t1.5\t4.5\t0.25\t0.049\t0.785\t(-0.5, 2.0, 1.0)\tVector((0.0, 1.0, -0.25))\n'
+             '(1.5, 2.0, 3.0)\t1\t2\t2.0\t5.0\t0.5\t0.196\t1.571\t(-1.5, 3.0, 2.0)\t<Vector (1.0000, 0.0000, 0.0000)>\n')
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.csv_file = os.path.join(self.out_dir, 'test.cross_section.csv')
+        with open(self.csv_file, 'w') as f:
+            f.write(self.k_CSV)
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def test_load_cross_sections(self):
+        data = load_cross_sections(self.csv_file)
+
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data['segment_idx'].tolist(), [0, 1])
+        self.assertEqual(data['pnt_idx'].dtype, np.int64)
+        self.assertEqual(data['area'].tolist(), [1.5, 2.0])
+        self.assertEqual(data['diameter'].tolist(), [math.sqrt(1.5) / math.pi, math.sqrt(2.0) / math.pi])
+        self.assertEqual(data['blender_position'].tolist(), [[-0.5, 2.0, 1.0], [-1.5, 3.0, 2.0]])
+        self.assertEqual(data['blender_normal'].tolist(), [[0.0, 1.0, -0.25], [1.0, 0.0, 0.0]])
+        self.assertEqual(data.to_dict()[(1, 2)]['estimated_diameter'], 0.5)
+
+    def test_companion_file(self):
+        # whole seconds, so the modification time is restored exactly
+        mtime = 1400000000
+        os.utime(self.csv_file, (mtime, mtime))
+        data = load_cross_sections(self.csv_file)
+        self.assertTrue(os.path.exists(companion_file_path(self.csv_file)))
+
+        # the companion file is used until the *.csv file changes: a *.csv file of the same size and modification
+        # time is not read (its changed point index is not loaded)
+        with open(companion_file_path(self.csv_file), 'rb') as f:
+            companion = f.read()
+        with open(self.csv_file, 'w') as f:
+            f.write(self.k_CSV.replace('\t2\t2.0\t', '\t9\t2.0\t'))
+        os.utime(self.csv_file, (mtime, mtime))
+        self.assertEqual(os.path.getsize(self.csv_file), len(self.k_CSV))
+
+        cached = load_cross_sections(self.csv_file)
+        self.assertEqual(sorted(cached.keys()), sorted(data.keys()))
+        for name in data.keys():
+            self.assertEqual(cached[name].tolist(), data[name].tolist())
+        self.assertEqual(cached.to_dict(), data.to_dict())
+        self.assertEqual(cached['pnt_idx'].tolist(), [0, 2])
+        self.assertEqual(load_cross_sections(self.csv_file, companion=False)['pnt_idx'].tolist(), [0, 9])
+
+        with open(self.csv_file, 'w') as f:
+            f.write(self.k_CSV.replace('\t2\t2.0\t', '\t12\t2.0\t'))
+        self.assertEqual(load_cross_sections(self.csv_file)['pnt_idx'].tolist(), [0, 12])
+        with open(companion_file_path(self.csv_file), 'rb') as f:
+            self.assertNotEqual(f.read(), companion)
+
+
+class AmirameshReaderTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def test_parse_arrays(self):
+        am_file = os.path.join(self.data_dir_path, 'test.SptGraph.am')
+        reader = AmirameshReader()
+
+        with open(am_file, 'r') as f:
+            skel = ArraySkeleton.from_skeleton(reader.parse(f))
+        with open(am_file, 'r') as f:
+            askel = reader.parse_arrays(f)
+
+        self.assertEqual(askel.node_positions.tolist(), skel.node_positions.tolist())
+        self.assertEqual(askel.edges.tolist(), skel.edges.tolist())
+        self.assertEqual(askel.segment_offsets.tolist(), skel.segment_offsets.tolist())
+        self.assertEqual(askel.points.tolist(), skel.points.tolist())
+
+    def test_parse_binary_arrays(self):
+        reader = AmirameshReader()
+
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'rb') as f:
+            askel = reader.parse_arrays(f)
+        with open(os.path.join(self.data_dir_path, 'test-files', 'GeometrySurface.Smt.SptGraph'), 'rb') as f:
+            bskel = reader.parse_arrays(f)
+
+        self.assertEqual(bskel.edges.tolist(), askel.edges.tolist())
+        self.assertEqual(bskel.segment_offsets.tolist(), askel.segment_offsets.tolist())
+        self.assertTrue(np.allclose(bskel.node_positions, askel.node_positions))
+        self.assertTrue(np.allclose(bskel.points, askel.points))
+
+    def test_binary_rle_sections(self):
+        with open(os.path.join(self.data_dir_path, 'test-files', 'GeometrySurface.scanConverted'), 'rb') as f:
+            header, sections = AmirameshReader().read_sections(f)
+
+        self.assertEqual(header.format, 'BINARY-LITTLE-ENDIAN')
+        self.assertEqual(header.dimensions['Lattice'], (57, 77, 77))
+        self.assertEqual(header.fields[1].encoding, 'HxByteRLE')
+        self.assertEqual(sections[1].size, 57 * 77 * 77)
+        self.assertEqual(set(sections[1].tolist()), set([0, 1]))
+
+    def test_decode_byte_rle(self):
+        encoded = bytearray([3, 7, 0x82, 1, 2, 1, 9])
+        self.assertEqual(decode_byte_rle(encoded, 6).tolist(), [7, 7, 7, 1, 2, 9])
+
+    def test_iter_segments(self):
+        reader = AmirameshReader()
+
+        for am_file in [os.path.join(self.data_dir_path, 'test.SptGraph.am'),
+                        os.path.join(self.data_dir_path, 'test-files', 'GeometrySurface.Smt.SptGraph')]:
+            with open(am_file, 'rb') as f:
+                askel = reader.parse_arrays(f)
+
+            # small chunks exercise reading segments across chunk boundaries
+            with open(am_file, 'rb') as f:
+                segments = list(reader.iter_segments(f, chunk_points=16))
+
+            self.assertEqual([s[0] for s in segments], list(range(len(askel.edges))))
+            self.assertEqual([[s[1], s[2]] for s in segments], askel.edges.tolist())
+            for sidx, _, _, points in segments:
+                offsets = askel.segment_offsets
+                self.assertEqual(points.tolist(), askel.points[offsets[sidx]:offsets[sidx + 1]].tolist())
+
+    def test_read_segment_range(self):
+        reader = AmirameshReader()
+
+        for am_file in [os.path.join(self.data_dir_path, 'test.SptGraph.am'),
+                        os.path.join(self.data_dir_path, 'test-files', 'GeometrySurface.Smt.SptGraph')]:
+            with open(am_file, 'rb') as f:
+                askel = reader.parse_arrays(f)
+            with open(am_file, 'rb') as f:
+                index = AmirameshIndex.build(f)
+
+            self.assertEqual(index.segment_count(), 22)
+
+            with open(am_file, 'rb') as f:
+                skel = reader.read_segment_range(f, (5, 9), index)
+
+            offsets = askel.segment_offsets
+            self.assertEqual(skel.edges.tolist(), askel.edges[5:9].tolist())
+            self.assertEqual(skel.points.tolist(), askel.points[offsets[5]:offsets[9]].tolist())
+            self.assertEqual([len(s.points) for s in skel.segments], [len(askel.segments[i].points) for i in range(5, 9)])
+
+    def test_attributes(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            text = f.read()
+
+        # extra per-vertex and per-edge fields, declared before the spatial graph fields
+        text = text.replace('VERTEX { float[3] VertexCoordinates } @1',
+                            'VERTEX { int Label } @6\nEDGE { float MeanRadius } @7\nVERTEX { float[3] VertexCoordinates } @1')
+        text = text.replace('# Data section follows\n',
+                            '# Data section follows\n@6\n' + '\n'.join(str(i % 3) for i in range(11)) +
+                            '\n\n@7\n' + '\n'.join('%i.5' % i for i in range(22)) + '\n\n')
+
+        am_file = os.path.join(tempfile.mkdtemp(), 'attributes.am')
+        try:
+            with open(am_file, 'w') as f:
+                f.write(text)
+
+            reader = AmirameshReader()
+            with open(am_file, 'r') as f:
+                skel = ArraySkeleton.from_skeleton(reader.parse(f))
+            with open(am_file, 'rb') as f:
+                askel = reader.parse_arrays(f, attributes=None)
+            with open(am_file, 'rb') as f:
+                label_skel = reader.parse_arrays(f, attributes=['Label'])
+        finally:
+            shutil.rmtree(os.path.dirname(am_file), ignore_errors=True)
+
+        self.assertEqual(askel.points.tolist(), skel.points.tolist())
+        self.assertEqual(askel.attributes.keys(), ['EdgeConnectivity', 'EdgePointCoordinates', 'Label', 'MeanRadius',
+                                                   'NumEdgePoints', 'VertexCoordinates', 'thickness'])
+        self.assertEqual(askel.attributes['Label'].dtype, np.int32)
+        self.assertEqual(askel.attributes['Label'].tolist(), [i % 3 for i in range(11)])
+        self.assertEqual(askel.attributes.location('MeanRadius'), 'EDGE')
+        self.assertEqual(askel.attributes['MeanRadius'].tolist(), [i + 0.5 for i in range(22)])
+        self.assertEqual(askel.attributes['EdgePointCoordinates'].shape, (284, 3))
+
+        # only the requested fields are decoded
+        self.assertEqual(label_skel.attributes.keys(), ['Label'])
+        self.assertEqual(label_skel.attributes.sections, None)
+        self.assertEqual(label_skel.attributes['Label'].tolist(), [i % 3 for i in range(11)])
+
+    def test_lazy_sections(self):
+        with open(os.path.join(self.data_dir_path, 'test-files', 'GeometrySurface.scanConverted'), 'rb') as f:
+            header, sections = AmirameshReader().read_sections(f)
+
+            self.assertEqual(list(sections), [1])
+            self.assertEqual(sections.arrays, {})
+            self.assertEqual(sections.field_array('Labels').size, 57 * 77 * 77)
+            self.assertEqual(list(sections.arrays), [1])
+
+    def test_header(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            header = read_header(f)
+
+        self.assertEqual(header.format, 'ASCII')
+        self.assertEqual(header.content_type, 'HxSpatialGraph')
+        self.assertEqual(header.defines, {'VERTEX': 11, 'EDGE': 22, 'POINT': 284})
+        self.assertEqual(header.field('EdgePointCoordinates').index, 4)
+        self.assertEqual(header.field('EdgePointCoordinates').components, 3)
+        self.assertEqual(header.field('NumEdgePoints').location, 'EDGE')
+
+
+class AmirameshWriterTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def test_write_round_trip(self):
+        reader = AmirameshReader()
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'rb') as f:
+            askel = reader.parse_arrays(f)
+
+        for binary in (False, True):
+            am_file = os.path.join(self.out_dir, 'out.am')
+            AmirameshWriter(binary).save(am_file, askel)
+            with open(am_file, 'rb') as f:
+                skel = reader.parse_arrays(f)
+
+            self.assertEqual(skel.edges.tolist(), askel.edges.tolist())
+            self.assertEqual(skel.segment_offsets.tolist(), askel.segment_offsets.tolist())
+            self.assertTrue(np.allclose(skel.node_positions, askel.node_positions))
+            self.assertTrue(np.allclose(skel.points, askel.points))
+
+    def test_write_binary(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            skel = AmirameshReader().parse(f)
+
+        am_file = os.path.join(self.out_dir, 'out.am')
+        AmirameshWriter(binary=True).save(am_file, skel)
+
+        # the test graph holds float32 values, so it writes out exactly as Avizo does
+        with open(am_file, 'rb') as f, \
+             open(os.path.join(self.data_dir_path, 'test-files', 'GeometrySurface.Smt.SptGraph'), 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_compact_skeleton(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            skel = AmirameshReader().parse(f)
+
+        # segments 0-3 are the only segments of node 0
+        del skel.segments[0:4]
+        askel = compact_skeleton(skel)
+
+        self.assertEqual(len(askel.node_positions), 10)
+        self.assertEqual(askel.node_positions[1].tolist(), list(skel.nodes[2].position()))
+        self.assertEqual(askel.edges[0].tolist(), [skel.segments[0].start - 1, skel.segments[0].end - 1])
+        self.assertEqual(len(askel.segments), 18)
+
+
+class MathsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(5)
+        self.v1 = rng.uniform(-10.0, 10.0, (50, 3))
+        self.v2 = rng.uniform(-10.0, 10.0, (50, 3))
+        self.v1[0] = self.v2[0]                   # zero length offset
+        self.v1[1] = self.v2[1] + (0.0, 0.25, 0.0)   # shorter than min_length
+        self.centre = (1.0, -2.0, 0.5)
+
+    def test_offsets_lengths(self):
+        v1, v2 = self.v1.tolist(), self.v2.tolist()
+
+        self.assertEqual(vsub_array(self.v1, self.v2).tolist(), [list(vsub3(a, b)) for a, b in zip(v1, v2)])
+        self.assertEqual(vadd_array(self.v1, self.centre).tolist(), [list(vadd3(a, self.centre)) for a in v1])
+        self.assertEqual(vlength_array(self.v1).tolist(), [vlength(a) for a in v1])
+        self.assertEqual(distance_squared_array(self.v1, self.v2).tolist(),
+                         [distance_squared(a, b) for a, b in zip(v1, v2)])
+        self.assertEqual(distance_array(self.v1, self.centre).tolist(), [distance(a, self.centre) for a in v1])
+
+        # a single vector is a 1 x 3 array
+        self.assertEqual(vlength_array(self.centre).tolist(), [vlength(self.centre)])
+
+    def test_normalize(self):
+        v = vsub_array(self.v1, self.v2)
+        expected = [list(vnormalize_zero3(tuple(a))) for a in v.tolist()]
+        self.assertEqual(vnormalize_zero_array(v).tolist(), expected)
+        self.assertEqual(vnormalize_zero_array(v)[0].tolist(), [0.0, 0.0, 0.0])
+        self.assertEqual(vnormalize_array(v[1:]).tolist(), expected[1:])
+        self.assertRaises(AssertionError, vnormalize_array, v)
+
+    def test_adjust_offset_length(self):
+        for min_length in (0, 0.5, 5.0):
+            adjusted = vadjust_offset_length_array(self.v1, self.v2[1], min_length)
+            expected = [list(vadjust_offset_length3(a, tuple(self.v2[1]), min_length)) for a in self.v1.tolist()]
+            self.assertEqual(adjusted.tolist(), expected)
+
+    def test_inside_aabb(self):
+        aabb = v3_to_aabb((-5.0, -5.0, -5.0), (5.0, 5.0, 5.0))
+        points = np.vstack((self.v1, [aabb[0], aabb[1], (0.0, 0.0, 5.0)]))
+        self.assertEqual(inside_aabb_array(aabb, points).tolist(),
+                         [inside_aabb(aabb, p) for p in points.tolist()])
+
+    def test_pairwise_distances(self):
+        dsqr = pairwise_distance_squared_array(self.v1[:7], self.v2)
+        self.assertEqual(dsqr.shape, (7, 50))
+        self.assertEqual(dsqr.tolist(), [[distance_squared(a, b) for b in self.v2.tolist()] for a in self.v1[:7].tolist()])
+        self.assertEqual(pairwise_distance_array(self.v1[:7], self.v2).tolist(), np.sqrt(dsqr).tolist())
+        self.assertEqual(pairwise_distance_squared_array(self.v1[0], self.v2).shape, (1, 50))
+
+    def test_coordinate_transform(self):
+        transform = CoordinateTransform(self.centre, 2.5)
+        for min_length in (0, 3.0):
+            expected = [list(vmuls3(vadjust_offset_length3(a, self.centre, min_length), 2.5)) for a in self.v1.tolist()]
+            self.assertEqual(transform.apply(self.v1, min_length).tolist(), expected)
+
+        # per position clamp lengths
+        min_lengths = np.linspace(0.0, 10.0, len(self.v1))
+        expected = [list(vadjust_offset_length3(a, self.centre, m)) for a, m in zip(self.v1.tolist(), min_lengths)]
+        self.assertEqual(transform.offset(self.v1, min_lengths).tolist(), expected)
+
+        # the swizzle maps Avizo to Blender coordinates, and back
+        swizzle = CoordinateTransform(swizzle=k_AVIZO_BLENDER_SWIZZLE)
+        self.assertEqual(swizzle.apply(self.v1).tolist(),
+                         [list(swizzle3(a, k_AVIZO_BLENDER_SWIZZLE)) for a in self.v1.tolist()])
+        self.assertEqual(swizzle.apply(swizzle.apply(self.v1)).tolist(), self.v1.tolist())
+
+        transform = CoordinateTransform(self.centre, 2.5, k_AVIZO_BLENDER_SWIZZLE)
+        self.assertTrue(np.allclose(transform.inverse(transform.apply(self.v1)), self.v1))
+        self.assertEqual(transform.inverse(transform.apply(self.centre)).tolist(), [list(self.centre)])
+
+
+class GraphsTestCase(unittest.TestCase):
+
+    class graph_context:
+        def __init__(self, allow_cycles, connect_soma_soma):
+            self.k_ALLOW_CYCLES = allow_cycles
+            self.k_CONNECT_SOMA_SOMA = connect_soma_soma
+            self.stats = GrowStatistics()
+
+    def test_create_directed_graph(self):
+        nodesgraph = defaultdict(lambda: set())
+        for start, end in [(0, 1), (0, 2), (1, 2), (2, 3), (1, 4), (4, 0)]:
+            nodesgraph[start].add(end)
+            nodesgraph[end].add(start)
+
+        # (k_ALLOW_CYCLES, k_CONNECT_SOMA_SOMA): (directed graph, ignored edge count)
+        expected = {(False, False): ({0: [1, 2], 1: [2], 2: [3], 3: [], 4: [1]}, 7),
+                    (False, True): ({0: [1, 2, 4], 1: [2], 2: [3], 3: [], 4: [1]}, 6),
+                    (True, False): ({0: [1, 2], 1: [2], 2: [1, 3], 3: [2], 4: [1]}, 5),
+                    (True, True): ({0: [1, 2, 4], 1: [0, 2, 4], 2: [0, 1, 3], 3: [2], 4: [0, 1]}, 0)}
+
+        for (allow_cycles, connect_soma_soma), (graph, ignored) in expected.items():
+            context = self.graph_context(allow_cycles, connect_soma_soma)
+
+            dgraph = create_directed_graph([0, 4], nodesgraph, context)
+
+            self.assertEqual(dict((n, sorted(ns)) for n, ns in dgraph.items()), graph)
+            self.assertEqual(context.stats.warn_counts[GrowStatistics.k_WARN_IGNORED_EDGES], ignored)
+
+    def test_directed_graph_diamonds(self):
+        # a chain of diamonds: each bottom node is reached by two paths; re-exploring a node each time it is
+        # reached would double the work of each diamond
+        class counting_graph(defaultdict):
+            explored = 0
+            def __getitem__(self, n):
+                counting_graph.explored += 1
+                return defaultdict.__getitem__(self, n)
+
+        ndiamonds = 20
+        nodesgraph = counting_graph(lambda: set())
+        for d in range(ndiamonds):
+            top, left, right, bottom = 3 * d, 3 * d + 1, 3 * d + 2, 3 * d + 3
+            for start, end in [(top, left), (top, right), (left, bottom), (right, bottom)]:
+                nodesgraph[start].add(end)
+                nodesgraph[end].add(start)
+        counting_graph.explored = 0
+
+        context = self.graph_context(False, False)
+        dgraph = create_directed_graph([0], nodesgraph, context)
+
+        self.assertEqual(len(dgraph), 3 * ndiamonds + 1)
+        self.assertEqual(sorted(dgraph[3]), [4, 5])
+        self.assertEqual(sorted(dgraph[4]), [6])
+        self.assertEqual(sorted(dgraph[5]), [6])
+        # each diamond ignores the edges back from its left and right nodes (to the top),
+        # and from its bottom node (to left and right)
+        self.assertEqual(context.stats.warn_counts[GrowStatistics.k_WARN_IGNORED_EDGES], 4 * ndiamonds)
+        # each node is explored once
+        self.assertEqual(counting_graph.explored, 3 * ndiamonds + 1)
+
+
+    def test_node_spatial_index(self):
+        with open(os.path.join(os.path.split(__file__)[0], 'data', 'test.SptGraph.am'), 'r') as f:
+            skel = AmirameshReader().parse(f)
+        askel = ArraySkeleton.from_skeleton(skel)
+
+        centres = [askel.node_positions[0], askel.node_positions[2], (0.0, 0.0, 0.0)]
+        radii = [1.0, 0.5, 10.0]
+
+        for nodes in (skel.nodes, askel.nodes):
+            index = NodeSpatialIndex(nodes)
+            results = index.query_radius(centres, radii)
+            self.assertEqual(len(results), 3)
+
+            for centre, radius, result in zip(centres, radii, results):
+                expected = [nidx for nidx, node in sorted(nodes.items())
+                            if distance_squared(tuple(centre), node.position()) <= square(radius)]
+                self.assertEqual(result.tolist(), expected)
+                self.assertEqual(collect_soma_nodes(tuple(centre), radius, nodes, index), expected)
+
+        self.assertEqual(results[2].tolist(), list(range(11)))
+
+    @unittest.skipIf(cKDTree is None, 'requires scipy')
+    def test_node_spatial_index_tree(self):
+        skel, _ = generate_skeleton(20000, seed=4)
+        rng = np.random.RandomState(4)
+        centres = skel.node_positions[rng.randint(0, len(skel.node_positions), 50)] + rng.normal(size=(50, 3))
+        radii = rng.uniform(0.0, 30.0, 50)
+
+        index = NodeSpatialIndex(skel.nodes)
+        self.assertTrue(index.tree is not None)
+        graphs_module = sys.modules[NodeSpatialIndex.__module__]
+        try:
+            graphs_module.cKDTree = None
+            fallback = NodeSpatialIndex(skel.nodes)
+        finally:
+            graphs_module.cKDTree = cKDTree
+        self.assertTrue(fallback.tree is None)
+
+        for result, expected in zip(index.query_radius(centres, radii), fallback.query_radius(centres, radii)):
+            self.assertEqual(result.tolist(), expected.tolist())
+
+    def test_soma_index_reused(self):
+        skel, annotation_data = generate_skeleton(2000, seed=3)
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.ERROR
+        options.set_annotation_data(annotation_data)
+        soma_data = dict(annotation_data['soma'])
+        radii = [soma_data['radius'], 2.0 * soma_data['radius']]
+
+        expected = []
+        for radius in radii:
+            soma_data['radius'] = radius
+            expected.append(create_array_morphology(skel, soma_data, options))
+
+        # one index of the skeleton nodes serves every growth
+        index = NodeSpatialIndex(skel.nodes)
+        graphs_module = sys.modules[collect_soma_nodes.__module__]
+        def rebuilt(nodes):
+            raise AssertionError('soma index rebuilt')
+        try:
+            graphs_module.NodeSpatialIndex = rebuilt
+            for radius, morphology in zip(radii, expected):
+                soma_data['radius'] = radius
+                grown = create_array_morphology(skel, soma_data, options, soma_index=index)
+                self.assertEqual(grown.sections.tolist(), morphology.sections.tolist())
+                self.assertEqual(grown.points.tolist(), morphology.points.tolist())
+                self.assertEqual(grown.soma_points.tolist(), morphology.soma_points.tolist())
+        finally:
+            graphs_module.NodeSpatialIndex = NodeSpatialIndex
+        self.assertNotEqual(len(expected[0].soma_points), len(expected[1].soma_points))
+
+    def test_cut_point_mask(self):
+        with open(os.path.join(os.path.split(__file__)[0], 'data', 'test.SptGraph.am'), 'r') as f:
+            askel = ArraySkeleton.from_skeleton(AmirameshReader().parse(f))
+
+        positions = askel.points[:, 0:3]
+        centre = positions.mean(axis=0)
+        aabb = v3_to_aabb(tuple(centre - 2.0), tuple(centre + 2.0))
+
+        mask = cut_point_mask(positions, aabb)
+        self.assertEqual(mask.tolist(), [is_cut_point(tuple(p), aabb) for p in positions.tolist()])
+        self.assertTrue(0 < mask.sum() < len(positions))
+        self.assertEqual(cut_point_mask(positions, None), None)
+
+        # positions on the AABB boundary are cut-points, as in is_cut_point
+        self.assertEqual(cut_point_mask([aabb[0], aabb[1]], aabb).tolist(), [True, True])
+
+        # no AABB: no clipped nodes
+        show_node_pos_stats(askel.node_positions, None, tuple(centre))
+
+
+class SimplifyTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def setUp(self):
+        with open(os.path.join(self.data_dir_path, 'test.SptGraph.am'), 'r') as f:
+            self.skel = ArraySkeleton.from_skeleton(AmirameshReader().parse(f))
+
+    def assertSegmentEnds(self, skel):
+        self.assertEqual(skel.edges.tolist(), self.skel.edges.tolist())
+        for segm, simplified in zip(self.skel.segments, skel.segments):
+            self.assertEqual(simplified.points[0].position(), segm.points[0].position())
+            self.assertEqual(simplified.points[-1].position(), segm.points[-1].position())
+
+    def test_arc_lengths(self):
+        arc = segment_arc_lengths(self.skel)
+        for sidx, segm in enumerate(self.skel.segments):
+            first = self.skel.segment_offsets[sidx]
+            self.assertEqual(arc[first], 0.0)
+            for pidx in range(1, len(segm.points)):
+                step = distance(segm.points[pidx].position(), segm.points[pidx - 1].position())
+                self.assertAlmostEqual(arc[first + pidx] - arc[first + pidx - 1], step)
+
+    def test_min_spacing(self):
+        spacing = 2.0
+        skel = simplify_min_spacing(self.skel, spacing)
+        self.assertSegmentEnds(skel)
+        self.assertTrue(len(skel.points) < len(self.skel.points))
+
+        # greedily, interior points are kept at least spacing (arc-length) from the previous kept point
+        arc = segment_arc_lengths(self.skel)
+        for sidx, segm in enumerate(self.skel.segments):
+            first = self.skel.segment_offsets[sidx]
+            kept = [0]
+            for pidx in range(1, len(segm.points) - 1):
+                if arc[first + pidx] - arc[first + kept[-1]] >= spacing:
+                    kept.append(pidx)
+            kept.append(len(segm.points) - 1)
+            self.assertEqual([p.position() for p in skel.segments[sidx].points],
+                             [segm.points[pidx].position() for pidx in kept])
+
+        self.assertEqual(simplify_min_spacing(self.skel, 1e-9).points.tolist(), self.skel.points.tolist())
+
+    def test_resample_uniform(self):
+        skel = resample_uniform(self.skel, 1.0)
+        self.assertSegmentEnds(skel)
+
+        # segments are resampled at uniform (source) arc-length intervals of at most 1.0
+        arc = segment_arc_lengths(self.skel)
+        lengths = arc[self.skel.segment_offsets[1:] - 1]
+        self.assertEqual(skel.segment_counts().tolist(), (np.maximum(1, np.ceil(lengths / 1.0)) + 1).astype(int).tolist())
+
+        # positions and thickness are interpolated between the source points
+        line = ArraySkeleton([(0, 0, 0), (4, 0, 0)], [(0, 1)], [0, 3], [(0, 0, 0, 1.0), (1, 0, 0, 2.0), (4, 0, 0, 5.0)])
+        self.assertTrue(np.allclose(resample_uniform(line, 1.5).points,
+                                    [(0, 0, 0, 1.0), (4.0 / 3, 0, 0, 7.0 / 3), (8.0 / 3, 0, 0, 11.0 / 3), (4, 0, 0, 5.0)]))
+
+    def test_douglas_peucker(self):
+        skel = simplify_douglas_peucker(self.skel, 1.0)
+        self.assertSegmentEnds(skel)
+        self.assertTrue(len(skel.points) < len(self.skel.points))
+        self.assertTrue(len(simplify_douglas_peucker(self.skel, 5.0).points) <= len(skel.points))
+
+        # a straight line simplifies to its end points
+        points = np.zeros((5, 4))
+        points[:, 0] = np.arange(5)
+        points[:, 3] = 1.0
+        line = ArraySkeleton([(0, 0, 0), (4, 0, 0)], [(0, 1)], [0, 5], points)
+        self.assertEqual(simplify_douglas_peucker(line, 0.0).points.tolist(), points[[0, 4]].tolist())
+
+    def test_simplify_skeleton(self):
+        skel = simplify_skeleton(self.skel.to_skeleton(), 'uniform', 2.0)
+        self.assertEqual(skel.points.tolist(), resample_uniform(self.skel, 2.0).points.tolist())
+        self.assertRaises(AssertionError, simplify_skeleton, self.skel, 'unknown', 1.0)
+
+
+class SkeletonCacheTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_cache_round_trip(self):
+        am_file = os.path.join(self.data_dir_path, 'test.SptGraph.am')
+        cache = SkeletonCache(self.cache_dir)
+        self.assertEqual(cache.load(am_file), None)
+
+        skel = AmirameshReader(cache).read(am_file)
+        self.assertEqual(os.listdir(self.cache_dir), [cache.key(am_file) + '.npz'])
+
+        cached = cache.load(am_file)
+        self.assertEqual(cached.node_positions.tolist(), skel.node_positions.tolist())
+        self.assertEqual(cached.edges.tolist(), skel.edges.tolist())
+        self.assertEqual(cached.segment_offsets.tolist(), skel.segment_offsets.tolist())
+        self.assertEqual(cached.points.tolist(), skel.points.tolist())
+
+    def test_cache_eviction(self):
+        am_files = [os.path.join(self.data_dir_path, 'test.SptGraph.am'),
+                    os.path.join(self.data_dir_path, 'test-files', 'GeometrySurface.Smt.SptGraph')]
+
+        cache = SkeletonCache(self.cache_dir)
+        reader = AmirameshReader(cache)
+        reader.read(am_files[0])
+        os.utime(cache.entry_path(cache.key(am_files[0])), (0, 0))
+        reader.read(am_files[1])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        # shrinking the cache evicts the least-recently-used entry
+        cache.max_bytes = os.path.getsize(cache.entry_path(cache.key(am_files[1])))
+        cache.evict()
+        self.assertEqual(os.listdir(self.cache_dir), [cache.key(am_files[1]) + '.npz'])
+
+    def test_cache_unreadable_entries(self):
+        am_file = os.path.join(self.data_dir_path, 'test.SptGraph.am')
+        cache = SkeletonCache(self.cache_dir)
+        AmirameshReader(cache).read(am_file)
+        path = cache.entry_path(cache.key(am_file))
+
+        # a truncated entry is ignored
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[0:len(data) // 2])
+        self.assertEqual(cache.load(am_file), None)
+
+        # an entry removed while evicting (here, a dangling link) is skipped
+        os.symlink(os.path.join(self.cache_dir, 'removed'), os.path.join(self.cache_dir, 'removed.npz'))
+        cache.max_bytes = 0
+        cache.evict()
+        self.assertEqual(os.listdir(self.cache_dir), ['removed.npz'])
+
+
+class BatchTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for name in ('a.SptGraph', 'b.SptGraph'):
+            shutil.copy(os.path.join(self.data_dir_path, 'test.SptGraph.am'), os.path.join(self.tmp_dir, name + '.am'))
+            shutil.copy(os.path.join(self.data_dir_path, 'test.SptGraph.annotations.json'),
+                        os.path.join(self.tmp_dir, name + '.annotations.json'))
+
+        self.options = MorphologyCreateOptions()
+        self.options.ignore_optional_input_files = True
+        self.options.use_cache = False
+        self.options.morphology_writer = 'swc'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_find_skeletons(self):
+        am_files = [os.path.join(self.tmp_dir, name) for name in ('a.SptGraph.am', 'b.SptGraph.am')]
+        self.assertEqual(find_skeletons([self.tmp_dir]), am_files)
+        self.assertEqual(find_skeletons([os.path.join(self.tmp_dir, 'b*.am'), am_files[1]]), am_files[1:])
+
+        manifest = os.path.join(self.tmp_dir, 'cells.txt')
+        with open(manifest, 'w') as f:
+            f.write('# cells\nb.SptGraph\n\na.SptGraph.am # first\n')
+        self.assertEqual(find_skeletons([manifest]), am_files)
+
+    def test_validate(self):
+        options = copy.copy(self.options)
+        options.set_pathname(os.path.join(self.tmp_dir, 'missing.SptGraph'))
+        options.set_filepaths()
+        with self.assertRaises(MorphologyOptionsError) as context:
+            options.validate()
+        self.assertEqual(context.exception.exit_code, 2)
+
+    def test_run_batch(self):
+        with open(os.path.join(self.tmp_dir, 'c.SptGraph.am'), 'w') as f:
+            f.write('# not a skeleton\n')
+        am_files = find_skeletons([self.tmp_dir])
+
+        # a failed cell does not abort the batch
+        results = run_batch(am_files, self.options, processes=1)
+        statuses = dict((os.path.basename(r['am_file']), r['status']) for r in results)
+        self.assertEqual(statuses, {'a.SptGraph.am': k_CONVERTED, 'b.SptGraph.am': k_CONVERTED,
+                                    'c.SptGraph.am': k_FAILED})
+        summary = summarize_batch(results, 1.0)
+        self.assertEqual((summary[k_CONVERTED], summary[k_FAILED]), (2, 1))
+        self.assertEqual(summary['points'], 2 * len(SWCReader().read(results[0]['out_file']).points))
+
+        # up to date outputs are skipped, until an input changes
+        results = run_batch(am_files[0:2], self.options, processes=1)
+        self.assertEqual([r['status'] for r in results], [k_SKIPPED, k_SKIPPED])
+
+        out_mtime = os.path.getmtime(results[0]['out_file'])
+        os.utime(am_files[0], (out_mtime + 1, out_mtime + 1))
+        results = run_batch(am_files[0:2], self.options, processes=1)
+        self.assertEqual([r['status'] for r in results], [k_CONVERTED, k_SKIPPED])
+
+    def test_run_batch_pool(self):
+        am_files = find_skeletons([self.tmp_dir])
+
+        # cells are converted by worker processes (in any order), from the pickled options template
+        self.options.verbosity_level = logging.ERROR
+        results = run_batch(am_files, self.options, processes=2)
+        self.assertEqual(sorted(r['am_file'] for r in results), am_files)
+        self.assertEqual([r['status'] for r in results], [k_CONVERTED, k_CONVERTED])
+        expected = SWCReader().read(results[0]['out_file'])
+        for result in results:
+            self.assertEqual(SWCReader().read(result['out_file']).points.tolist(), expected.points.tolist())
+
+        self.options.force_overwrite = True
+        results = run_batch(am_files, self.options, processes=2)
+        self.assertEqual([r['status'] for r in results], [k_CONVERTED, k_CONVERTED])
+
+    def test_set_option(self):
+        options = MorphologyCreateOptions()
+        opts, args = getopt.getopt(['-a', '-n', '-t', '0.5', '--writer', 'swc', '--simplify', 'dp:0.25',
+                                    '-o', self.tmp_dir, 'cell.am'],
+                                   options.k_SHORT_OPTIONS, options.k_LONG_OPTIONS)
+        self.assertEqual([options.set_option(opt, arg) for opt, arg in opts], [True] * 6)
+        self.assertEqual((options.allow_cycles, options.use_cache, options.threshold_segment_length),
+                         (True, False, 0.5))
+        self.assertEqual((options.morphology_writer, options.simplify_method, options.simplify_value),
+                         ('swc', 'dp', 0.25))
+        self.assertEqual(options.skel_out_path, os.path.abspath(self.tmp_dir))
+        self.assertEqual(args, ['cell.am'])
+        self.assertFalse(options.set_option('-j', '4'))
+
+        self.assertTrue(options.set_option('--precision', '64') and options.set_option('--compression', '0'))
+        self.assertEqual((options.h5_precision, options.h5_compression), (64, 0))
+
+        for opt, arg, exit_code in [('--writer', 'xml', 2), ('--simplify', 'dp', 2),
+                                    ('--precision', '16', 2), ('--precision', 'abc', 2),
+                                    ('--compression', '10', 2), ('--compression', '-1', 2),
+                                    ('--simplify', 'dp:abc', 2), ('--cache_size', 'abc', 2), ('-t', 'abc', 2),
+                                    ('-v', '1.5', 2), ('-x', '', 2),
+                                    ('-o', os.path.join(self.tmp_dir, 'missing'), 4)]:
+            with self.assertRaises(MorphologyOptionsError) as context:
+                options.set_option(opt, arg)
+            self.assertEqual(context.exception.exit_code, exit_code)
+
+        self.assertEqual(parse_option_value('-j', '4', int), 4)
+        self.assertRaises(MorphologyOptionsError, parse_option_value, '-j', 'abc', int)
+
+
+class StageProfilerTestCase(unittest.TestCase):
+    data_dir_path = os.path.join(os.path.abspath(os.path.split(__file__)[0]), 'data')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_stages(self):
+        profiler = StageProfiler()
+        with profiler.stage('outer'):
+            with profiler.stage('inner'):
+                pass
+        with profiler.stage('last'):
+            pass
+
+        self.assertEqual([(r['name'], r['depth']) for r in profiler.records], [('outer', 0), ('inner', 1), ('last', 0)])
+        self.assertTrue(all(r['wall'] >= 0 and r['cpu'] >= 0 for r in profiler.records))
+        self.assertEqual(profiler.totals()['wall'], profiler.records[0]['wall'] + profiler.records[2]['wall'])
+
+        # the process peak RSS never decreases; its growth is recorded per stage
+        if resource is not None:
+            outer, inner, last = profiler.records
+            self.assertTrue(all(r['rss_delta'] >= 0 for r in profiler.records))
+            self.assertTrue(inner['max_rss'] <= outer['max_rss'] <= last['max_rss'] - last['rss_delta'])
+            self.assertEqual(profiler.totals()['max_rss'], last['max_rss'])
+
+        # the profile states what its memory records measure
+        notes = profiler.to_dict()['memory']
+        self.assertEqual(sorted(notes), sorted(k_MEMORY_NOTE) if profiler.is_tracing_memory() else ['max_rss', 'rss_delta'])
+        self.assertTrue('process-wide' in notes['max_rss'])
+
+        disabled = StageProfiler(enabled=False)
+        with disabled.stage('ignored'):
+            pass
+        self.assertEqual(disabled.records, [])
+
+    def test_skeletonize_profile(self):
+        options = MorphologyCreateOptions()
+        options.set_pathname(os.path.join(self.data_dir_path, 'test.SptGraph'))
+        options.skel_out_path = self.tmp_dir
+        options.ignore_optional_input_files = True
+        options.use_cache = False
+        options.morphology_writer = 'swc'
+        options.verbosity_level = logging.WARNING
+        options.set_filepaths()
+
+        profiler = StageProfiler()
+        skeletonize(options, profiler)
+        names = [r['name'] for r in profiler.records]
+        for name in ('read_skeleton', 'create_node_graph', 'create_directed_graph', 'create_node_segments_dict',
+                     'validate_graph_segments', 'grow', 'write'):
+            self.assertTrue(name in names, 'expected stage %s' % name)
+
+        json_file = os.path.join(self.tmp_dir, 'profile.json')
+        profiler.save(json_file, skeleton=options.skel_name)
+        with open(json_file, 'r') as f:
+            profile = json.load(f)
+        self.assertEqual(profile['skeleton'], options.skel_name)
+        self.assertEqual([r['name'] for r in profile['stages']], names)
+
+
+class SyntheticSkeletonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_tree_positions(self):
+        parents = np.array([-1, 0, 1, 1, 3])
+        steps = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [2, 0, 0], [0, 3, 0]], dtype=np.float64)
+        self.assertEqual(tree_positions(parents, steps).tolist(),
+                         [[1, 0, 0], [1, 1, 0], [1, 1, 1], [3, 1, 0], [3, 4, 0]])
+
+    def test_generate_skeleton(self):
+        skel, annotation_data = generate_skeleton(5000, seed=1, cycle_fraction=0.05, duplicate_fraction=0.05)
+        self.assertTrue(4000 < len(skel.points) < 6000)
+
+        # segment ends are exactly their node positions
+        counts = skel.segment_counts()
+        self.assertTrue(np.all(counts >= 2))
+        self.assertEqual(skel.points[skel.segment_offsets[:-1], 0:3].tolist(), skel.node_positions[skel.edges[:, 0]].tolist())
+        self.assertEqual(skel.points[skel.segment_offsets[1:] - 1, 0:3].tolist(), skel.node_positions[skel.edges[:, 1]].tolist())
+
+        # a tree has one edge less than its nodes; the others are cycles and duplicates
+        undirected = set(tuple(sorted(e)) for e in skel.edges.tolist())
+        self.assertTrue(len(undirected) > len(skel.node_positions) - 1)
+        self.assertTrue(len(undirected) < len(skel.edges))
+
+        # the same seed generates the same skeleton
+        again, _ = generate_skeleton(5000, seed=1, cycle_fraction=0.05, duplicate_fraction=0.05)
+        self.assertEqual(again.points.tolist(), skel.points.tolist())
+
+        options = MorphologyCreateOptions()
+        options.verbosity_level = logging.ERROR
+        options.set_annotation_data(annotation_data)
+        morphology = create_array_morphology(skel, annotation_data['soma'], options)
+        self.assertTrue(len(morphology) > 0)
+        self.assertTrue(morphology.cut_points.any())
+
+    def test_generate_diamonds(self):
+        chain = 5
+        skel, _ = generate_skeleton(5000, seed=2, cycle_fraction=0.0, duplicate_fraction=0.0,
+                                    diamond_fraction=0.05, diamond_chain=chain)
+        nodesgraph = defaultdict(lambda: set())
+        for start, end in skel.edges.tolist():
+            nodesgraph[start].add(end)
+            nodesgraph[end].add(start)
+
+        # each diamond adds a node and two edges to the tree
+        nnodes = len(skel.node_positions)
+        nedges = len(set(tuple(sorted(e)) for e in skel.edges.tolist()))
+        self.assertTrue(nedges > nnodes - 1)
+
+        # the diamonds chain: some node is reached by 2^chain shortest paths from the soma
+        paths = {0: 1}
+        level = [0]
+        while level:
+            below = defaultdict(lambda: 0)
+            for n in level:
+                for nn in nodesgraph[n]:
+                    if nn not in paths:
+                        below[nn] += paths[n]
+            paths.update(below)
+            level = list(below)
+        self.assertEqual(len(paths), nnodes)
+        self.assertTrue(max(paths.values()) >= 2 ** chain)
+
+        # the directed graph explores each node once, and ignores each edge once (in one direction)
+        explored = [0]
+        class counting_graph(dict):
+            def __getitem__(self, n):
+                explored[0] += 1
+                return dict.__getitem__(self, n)
+
+        class graph_context(object):
+            k_ALLOW_CYCLES = False
+            k_CONNECT_SOMA_SOMA = False
+            stats = GrowStatistics()
+
+        dgraph = create_directed_graph([0], counting_graph(nodesgraph), graph_context)
+        self.assertEqual(len(dgraph), nnodes)
+        self.assertEqual(explored[0], nnodes)
+        self.assertEqual(graph_context.stats.warn_counts[GrowStatistics.k_WARN_IGNORED_EDGES], nedges)
+
+    def test_write_synthetic_skeleton(self):
+        skel, am_file, json_file = write_synthetic_skeleton(os.path.join(self.tmp_dir, 'synthetic'), 2000)
+        read = AmirameshReader().read(am_file)
+        # binary Amiramesh files store float32 coordinates
+        self.assertEqual(read.edges.tolist(), skel.edges.tolist())
+        self.assertEqual(read.points.shape, skel.points.shape)
+        self.assertTrue(np.allclose(read.points, skel.points, rtol=1e-6, atol=1e-5))
+        with open(json_file, 'r') as f:
+            self.assertTrue('soma' in json.load(f))
+
+
 suite = unittest.TestLoader().loadTestsFromTestCase(MorphologyFileTestCase)
 unittest.TextTestRunner(verbosity=2).run(suite)
 